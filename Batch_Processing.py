@@ -0,0 +1,380 @@
+import argparse
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from Image import Image
+from Image_Operations import Image_Operations, OPERATION_METHODS, DTYPE_POLICIES
+from Pipeline import Pipeline
+from Deduplication import Dedup_Index, DEDUP_INDEX_NAME, get_operation_key
+
+# Image extensions picked up from the input directory
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+# Function to list the image files of a directory in a stable order
+def list_images(input_dir:str) -> list:
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+# Function to build the output path of an input file
+def get_output_path(input_path:str, output_dir:str, extension:str = None) -> str:
+    stem, input_extension = os.path.splitext(os.path.basename(input_path))
+    return os.path.join(output_dir, stem + (extension or input_extension))
+
+
+# Function executed once in every worker process, it resolves the lazily loaded skimage functions
+# up front so that their import time is not counted in the latency of the first file
+def init_worker():
+    import skimage as ski
+    ski.filters.sobel, ski.filters.threshold_multiotsu, ski.segmentation.chan_vese
+
+
+# Function to load and process a single image.
+# method is an operation name, or a serialized Pipeline (dict) to replay a chain of operations.
+# pixels are the already decoded input_path, if any
+def compute_file(input_path:str, method, params:dict, dtype_policy:str = 'float64', pixels=None) -> Image:
+    image_operator = Image_Operations(input_path if pixels is None else pixels, dtype_policy=dtype_policy)
+    if image_operator.get_source_image().get_nd_image() is None:
+        raise ValueError('Could not decode image: ' + input_path)
+
+    if isinstance(method, dict):
+        result = Pipeline.from_dict(method).run(image_operator.get_source_image())
+    else:
+        result = image_operator.apply_operation(method, **params)
+
+    # Conversions return None when the source is already in the target color space
+    if result is None:
+        return image_operator.get_source_image()
+    return Image(result)
+
+
+# Function executed in the worker processes, it loads, processes and saves a single image
+def process_file(input_path:str, output_path:str, method, params:dict, dtype_policy:str = 'float64') -> tuple:
+    start = time.perf_counter()
+
+    compute_file(input_path, method, params, dtype_policy).save_image(output_path)
+
+    return input_path, output_path, time.perf_counter() - start
+
+
+# Function executed in the worker processes, it processes one image and writes the result for all its duplicates.
+# Each format is encoded once, the other outputs of the same format are copies of that file
+def process_group(input_path:str, output_paths:list, method, params:dict, dtype_policy:str = 'float64', pixels=None) -> tuple:
+    start = time.perf_counter()
+
+    result = compute_file(input_path, method, params, dtype_policy, pixels)
+
+    encoded = {}
+    for output_path in output_paths:
+        extension = os.path.splitext(output_path)[1].lower()
+        if extension in encoded:
+            shutil.copyfile(encoded[extension], output_path)
+        else:
+            result.save_image(output_path)
+            encoded[extension] = output_path
+
+    return input_path, output_paths, time.perf_counter() - start
+
+
+# Function executed in the worker processes, it decodes an image to hash its pixels, the second deduplication stage.
+# The pixels are returned with their hash, so that an image to process is not decoded a second time
+def hash_pixels(input_path:str) -> tuple:
+    image = Image(input_path)
+    if image.get_nd_image() is None:
+        raise ValueError('Could not decode image: ' + input_path)
+    return image.get_hash(), image.get_nd_image()
+
+
+def run_batch(input_paths:list, output_dir:str, method:str, params:dict = None, workers:int = None, extension:str = None,
+              dtype_policy:str = 'float64', deduplicate:bool = False, index_path:str = None, log=print) -> dict:
+    """
+    Function to run an operation over a list of images on a process pool.
+    Results are written to disk as soon as each worker finishes.
+    :param input_paths: list - Image paths to process
+    :param output_dir: str - Directory where the results are saved
+    :param method: str or dict - Operation name, see Image_Operations.OPERATION_METHODS, or a serialized Pipeline
+    :param params: dict - Extra keyword arguments for the operation
+    :param workers: int - Number of worker processes, None uses the CPU count
+    :param extension: str - Output extension like '.png', None keeps the input extension
+    :param dtype_policy: str - Precision of the operation, see Image_Operations.DTYPE_POLICIES. Pipelines use their own
+    :param deduplicate: bool - Process duplicate images once, see run_deduplicated_batch
+    :param index_path: str - Persistent index of the deduplication, None keeps it in the output directory
+    :param log: callable - Function used to report per-file results
+    :return: dict - Summary with processed, failed, elapsed time and throughput
+    """
+    params = params or {}
+    os.makedirs(output_dir, exist_ok=True)
+
+    if deduplicate:
+        return run_deduplicated_batch(input_paths, output_dir, method, params, workers, extension, dtype_policy, index_path, log)
+
+    latencies = []
+    failed = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {
+            executor.submit(process_file, path, get_output_path(path, output_dir, extension), method, params, dtype_policy): path
+            for path in input_paths
+        }
+
+        for future in as_completed(futures):
+            try:
+                input_path, output_path, latency = future.result()
+            except Exception as e:
+                failed.append(futures[future])
+                log('FAILED  {}: {}'.format(futures[future], e))
+                continue
+
+            latencies.append(latency)
+            log('{:7.1f} ms  {} -> {}'.format(latency * 1000, input_path, output_path))
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        'processed': len(latencies),
+        'failed': len(failed),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'mean_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+        'max_latency': max(latencies) if latencies else 0.0,
+    }
+
+
+def run_deduplicated_batch(input_paths:list, output_dir:str, method, params:dict, workers:int = None, extension:str = None,
+                           dtype_policy:str = 'float64', index_path:str = None, log=print) -> dict:
+    """
+    Function to run an operation over a list of images, processing every distinct image once.
+    Inputs are grouped in two stages: the hash of their bytes finds byte-identical copies without decoding,
+    then one file per distinct byte hash is decoded to hash its pixels, which finds copies in other formats.
+    Each group is processed once, from the pixels decoded for its hash, and its result written to the outputs of all its members.
+    The hashes and the outputs are kept in a persistent index, so a later run neither reads unchanged inputs
+    again nor rewrites outputs that were made from the same pixels by the same operation.
+    :param index_path: str - JSON file of the index, None keeps it in the output directory
+    See run_batch for the other parameters
+    :return: dict - Summary of run_batch with the work saved by the deduplication
+    """
+    index = Dedup_Index(index_path or os.path.join(output_dir, DEDUP_INDEX_NAME))
+
+    latencies = []
+    failed = []
+    start = time.perf_counter()
+
+    def get_key(output_path):
+        return get_operation_key(method, params, dtype_policy, os.path.splitext(output_path)[1])
+
+    # Stage 1, hash of the bytes. Unchanged files are not read, their hash comes from the index
+    file_hashes = {}
+    files_read = 0
+    for path in input_paths:
+        try:
+            file_hashes[path], cached = index.get_file_hash(path)
+        except OSError as e:
+            failed.append(path)
+            log('FAILED  {}: {}'.format(path, e))
+            continue
+        files_read += not cached
+
+    # Inputs by byte hash, with their outputs. Inputs whose outputs collide are written once
+    members = {}
+    claimed = set()
+    for path, file_hash in file_hashes.items():
+        output_path = get_output_path(path, output_dir, extension)
+        if output_path in claimed:
+            log('  skipped {}: {} is the output of another input'.format(path, output_path))
+            continue
+        claimed.add(output_path)
+        members.setdefault(file_hash, []).append((path, output_path))
+
+    skipped = copied = computed = 0
+    unique_images = set()
+    tasks = {}
+
+    # Groups being computed by pixel hash. Members of the same pixels found meanwhile wait for their outputs, with their
+    # decoded pixels: those of a format the group does not write are computed from them without decoding again
+    running = set()
+    waiting = {}
+
+    # Function to plan the outputs of inputs with the same pixels. Outputs still current from a previous run are
+    # skipped, outputs of a format already made from the same pixels are copied, the others are computed at once
+    def plan(executor, pixel_hash, group, pixels=None):
+        nonlocal skipped, copied
+        unique_images.add(pixel_hash)
+
+        if pixel_hash in running:
+            waiting_group, waiting_pixels = waiting.get(pixel_hash, ([], None))
+            waiting[pixel_hash] = (waiting_group + group, waiting_pixels if waiting_pixels is not None else pixels)
+            return
+
+        pending = []
+        for path, output_path in group:
+            if index.is_output_current(output_path, pixel_hash, get_key(output_path)):
+                skipped += 1
+                continue
+
+            existing = index.find_output(pixel_hash, get_key(output_path), os.path.splitext(output_path)[1])
+            if existing is not None:
+                shutil.copyfile(existing, output_path)
+                index.set_output(output_path, pixel_hash, get_key(output_path))
+                copied += 1
+                log('  copied  {} -> {}'.format(existing, output_path))
+                continue
+
+            pending.append((path, output_path))
+
+        if pending:
+            future = executor.submit(process_group, pending[0][0], [output_path for _, output_path in pending], method, params, dtype_policy, pixels)
+            tasks[future] = ('group', pixel_hash, pending)
+            running.add(pixel_hash)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+
+        # Inputs whose pixel hash is in the index are planned at once, grouped by pixels
+        known = {}
+        to_decode = []
+        for file_hash, group in members.items():
+            pixel_hash = index.get_pixel_hash(file_hash)
+            if pixel_hash is None:
+                to_decode.append((file_hash, group[0][0]))
+            else:
+                known.setdefault(pixel_hash, []).extend(group)
+        for pixel_hash, group in known.items():
+            plan(executor, pixel_hash, group)
+
+        # Stage 2, hash of the pixels. Only one file per new byte hash is decoded, its pixels are processed as soon as
+        # it is hashed. Few decodes are in flight, each result holds a decoded image until its group is computed
+        decoded = len(to_decode)
+        max_decodes = 2 * (workers or os.cpu_count() or 1)
+        to_decode.reverse()
+
+        while to_decode or tasks:
+            while to_decode and sum(task[0] == 'hash' for task in tasks.values()) < max_decodes:
+                file_hash, path = to_decode.pop()
+                tasks[executor.submit(hash_pixels, path)] = ('hash', file_hash, path)
+
+            done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, key, value = tasks.pop(future)
+
+                if kind == 'hash':
+                    try:
+                        pixel_hash, pixels = future.result()
+                    except Exception as e:
+                        failed.extend(path for path, _ in members[key])
+                        log('FAILED  {}: {}'.format(value, e))
+                        continue
+
+                    index.set_pixel_hash(key, pixel_hash)
+                    plan(executor, pixel_hash, members[key], pixels)
+                    continue
+
+                pixel_hash, pending = key, value
+                running.discard(pixel_hash)
+                try:
+                    input_path, output_paths, latency = future.result()
+                except Exception as e:
+                    failed.extend(path for path, _ in pending)
+                    log('FAILED  {}: {}'.format(pending[0][0], e))
+                else:
+                    for output_path in output_paths:
+                        index.set_output(output_path, pixel_hash, get_key(output_path))
+                    computed += 1
+                    copied += len(output_paths) - 1
+                    latencies.append(latency)
+                    log('{:7.1f} ms  {} -> {}'.format(latency * 1000, input_path, ', '.join(output_paths)))
+
+                # Inputs of the same pixels found while the group was computed copy its outputs
+                if pixel_hash in waiting:
+                    plan(executor, pixel_hash, *waiting.pop(pixel_hash))
+
+    index.save()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'processed': computed + copied + skipped,
+        'failed': len(failed),
+        'elapsed': elapsed,
+        'throughput': len(input_paths) / elapsed if elapsed > 0 else 0.0,
+        'mean_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+        'max_latency': max(latencies) if latencies else 0.0,
+        'inputs': len(input_paths),
+        'files_read': files_read,
+        'decoded': decoded,
+        'unique_images': len(unique_images),
+        'computed': computed,
+        'copied': copied,
+        'skipped': skipped,
+        'saved': len(input_paths) - len(failed) - computed,
+    }
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='batch', description='Run an image operation over a directory without the UI')
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument('--op', choices=OPERATION_METHODS, help='Operation to apply')
+    operation.add_argument('--pipeline', default=None, help='JSON file of a saved Pipeline to replay on every image')
+    parser.add_argument('--in', dest='input_dir', required=True, help='Input image directory')
+    parser.add_argument('--out', dest='output_dir', required=True, help='Output directory')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--ext', default=None, help='Output extension like .png (default: keep the input extension)')
+    parser.add_argument('--dedup', action='store_true', help='Process duplicate images once and skip outputs that are up to date')
+    parser.add_argument('--index', dest='index_path', default=None, help='Deduplication index file (default: ' + DEDUP_INDEX_NAME + ' in the output directory)')
+    parser.add_argument('--dtype', dest='dtype_policy', choices=list(DTYPE_POLICIES), default=None, help='Precision of the operation (default: float64)')
+    parser.add_argument('--threshold1', type=int, default=None, help='threshold1 for edge detection')
+    parser.add_argument('--threshold2', type=int, default=None, help='threshold2 for edge detection')
+    parser.add_argument('--num-classes', dest='num_classes', type=int, default=None, help='num_classes for segmentation')
+    parser.add_argument('--color-space', dest='color_space', choices=['gray', 'bgr', 'hsv'], default=None, help='Planes segmented by multi Otsu (default: gray)')
+    parser.add_argument('--max-iter', dest='max_num_iter', type=int, default=None, help='Iteration budget of the Chan-Vese segmentations')
+    parser.add_argument('--tol', type=float, default=None, help='Convergence tolerance of the Chan-Vese segmentations')
+    return parser
+
+
+def main(argv:list = None) -> int:
+    args = get_argument_parser().parse_args(argv)
+
+    # Only forward the parameters that were given on the command line
+    params = {name: getattr(args, name) for name in ('threshold1', 'threshold2', 'num_classes', 'color_space', 'max_num_iter', 'tol') if getattr(args, name) is not None}
+
+    if args.pipeline is not None:
+        if params or args.dtype_policy is not None:
+            get_argument_parser().error('operation parameters and the precision are stored in the pipeline file')
+        method = Pipeline.load(args.pipeline).to_dict()
+    else:
+        method = args.op
+        if ('threshold1' in params or 'threshold2' in params) and not method.startswith('edge_'):
+            get_argument_parser().error('--threshold1/--threshold2 only apply to edge detection operations')
+        if 'num_classes' in params and not method.startswith('segment_'):
+            get_argument_parser().error('--num-classes only applies to segmentation operations')
+        if 'color_space' in params and method != 'segment_multi_otsu':
+            get_argument_parser().error('--color-space only applies to multi Otsu')
+        if ('max_num_iter' in params or 'tol' in params) and method not in ('segment_chan_vese', 'segment_moprh_snakes'):
+            get_argument_parser().error('--max-iter/--tol only apply to the Chan-Vese segmentations')
+
+    input_paths = list_images(args.input_dir)
+    if not input_paths:
+        print('No images found in', args.input_dir)
+        return 1
+
+    summary = run_batch(input_paths, args.output_dir, method, params, args.workers, args.ext, args.dtype_policy or 'float64', args.dedup, args.index_path)
+
+    print('Processed {} images ({} failed) in {:.2f} s, {:.2f} images/s, mean latency {:.1f} ms, max latency {:.1f} ms'.format(
+        summary['processed'], summary['failed'], summary['elapsed'], summary['throughput'],
+        summary['mean_latency'] * 1000, summary['max_latency'] * 1000,
+    ))
+    if args.dedup:
+        print('Deduplication: {} inputs ({} read, {} decoded to hash), {} unique images, {} computed, {} copied, {} up to date, {} operations saved'.format(
+            summary['inputs'], summary['files_read'], summary['decoded'], summary['unique_images'],
+            summary['computed'], summary['copied'], summary['skipped'], summary['saved'],
+        ))
+
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from Image import Image
+from Image_Operations import Image_Operations, CONVERSION_METHODS, EDGE_DETECTION_METHODS, SEGMENTATION_METHODS, DTYPE_POLICIES
+
+# Square sizes from 256² to 4K, plus 8K UHD
+SIZES = [(256, 256), (512, 512), (1024, 1024), (2048, 2048), (4096, 4096), (7680, 4320)]
+CHANNELS = ['gray', 'bgr']
+
+# The iterative segmentations take seconds per frame even coarse-to-fine, they are skipped above this many pixels
+SLOW_METHODS = ['segment_chan_vese', 'segment_moprh_snakes']
+SLOW_METHOD_MAX_PIXELS = 2048 * 2048
+
+
+# Function to create a reproducible synthetic image with smooth regions and edges
+def make_image(width:int, height:int, channels:str, seed:int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+
+    y, x = np.mgrid[0:height, 0:width]
+    base = (128 + 60 * np.sin(x / 37.0) * np.cos(y / 23.0)).astype(np.float32)
+    base[(x // 64 + y // 64) % 2 == 0] += 40
+    base += rng.normal(0, 8, size=base.shape).astype(np.float32)
+    gray = np.clip(base, 0, 255).astype(np.uint8)
+
+    if channels == 'gray':
+        return gray
+    return np.dstack([gray, np.roll(gray, 7, axis=1), np.roll(gray, 7, axis=0)])
+
+
+# Function to list every (name, callable factory) benchmark case for an input array
+def get_cases(nd_image:np.ndarray, output_dir:str, dtype_policy:str = 'float64') -> list:
+    pixels = nd_image.shape[0] * nd_image.shape[1]
+
+    # Every call gets a fresh operator and Image so neither the result cache nor the derived planes are reused
+    def operation(method):
+        return lambda: Image_Operations(Image(nd_image), dtype_policy=dtype_policy).apply_operation(method)
+
+    cases = []
+    for method in CONVERSION_METHODS + EDGE_DETECTION_METHODS + SEGMENTATION_METHODS:
+        if method in SLOW_METHODS and pixels > SLOW_METHOD_MAX_PIXELS:
+            continue
+        cases.append((method, operation(method)))
+
+    try:
+        import PyQt5.QtGui
+        cases.append(('get_QImage', lambda: Image(nd_image).get_QImage()))
+    except ImportError:
+        # Display conversion is only measured where PyQt5 is installed
+        pass
+
+    for extension in ('.png', '.jpg'):
+        path = os.path.join(output_dir, 'benchmark' + extension)
+        cases.append(('save_image' + extension, lambda path=path: Image(nd_image).save_image(path)))
+
+    return cases
+
+
+# Function to time a callable, returning the median wall time, median CPU time and the peak traced allocation
+def measure(function, repeats:int) -> dict:
+    wall_times = []
+    cpu_times = []
+
+    for _ in range(repeats):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        function()
+        wall_times.append(time.perf_counter() - start_wall)
+        cpu_times.append(time.process_time() - start_cpu)
+
+    # Memory is traced in a separate run, tracing slows the timed runs down
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'wall_time': statistics.median(wall_times),
+        'cpu_time': statistics.median(cpu_times),
+        'peak_memory': peak_memory,
+    }
+
+
+def run_benchmarks(sizes:list = None, channels:list = None, methods:list = None, repeats:int = 3, dtype_policy:str = 'float64', log=print) -> dict:
+    """
+    Function to benchmark every operation on synthetic inputs
+    :param sizes: list of (width, height), None uses SIZES
+    :param channels: list of 'gray' and/or 'bgr', None uses both
+    :param methods: list of case names to run, None runs all of them
+    :param repeats: int - Timed runs per case, the median is reported
+    :param dtype_policy: str - Precision of the operations, see Image_Operations.DTYPE_POLICIES
+    :param log: callable - Function used to report each result
+    :return: dict - Results keyed by 'case/channels/WxH/dtype_policy'
+    """
+    results = {}
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as output_dir:
+        for width, height in sizes or SIZES:
+            for channel in channels or CHANNELS:
+                nd_image = make_image(width, height, channel)
+
+                for name, function in get_cases(nd_image, output_dir, dtype_policy):
+                    if methods is not None and name not in methods:
+                        continue
+
+                    result = measure(function, repeats)
+                    result['throughput'] = width * height / 1e6 / result['wall_time'] if result['wall_time'] > 0 else 0.0
+
+                    key = '{}/{}/{}x{}/{}'.format(name, channel, width, height, dtype_policy)
+                    results[key] = result
+                    log('{:48s} {:9.2f} ms {:9.1f} MP/s {:9.1f} MB'.format(
+                        key, result['wall_time'] * 1000, result['throughput'], result['peak_memory'] / 1e6))
+
+    return results
+
+
+# Function to read a baseline, returning its dtype policy and its results.
+# Keys of baselines saved before the dtype policy was part of the key get the policy of their meta
+def load_baseline(path:str) -> tuple:
+    with open(path) as file:
+        baseline = json.load(file)
+
+    dtype_policy = baseline.get('meta', {}).get('dtype_policy', 'float64')
+    results = {
+        key if key.count('/') >= 3 else '{}/{}'.format(key, dtype_policy): result
+        for key, result in baseline['results'].items()
+    }
+    return dtype_policy, results
+
+
+# Function to compare results against a baseline, returning the cases slower than the allowed threshold
+def find_regressions(results:dict, baseline:dict, threshold:float) -> list:
+    regressions = []
+
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        baseline_time = baseline[key]['wall_time']
+        if result['wall_time'] > baseline_time * (1 + threshold):
+            regressions.append((key, baseline_time, result['wall_time']))
+
+    return regressions
+
+
+def main(argv:list = None) -> int:
+    parser = argparse.ArgumentParser(prog='benchmark', description='Benchmark the image operations on synthetic inputs')
+    parser.add_argument('--sizes', nargs='+', default=None, help='Sizes as WxH, e.g. 256x256 7680x4320 (default: 256² to 8K)')
+    parser.add_argument('--channels', nargs='+', choices=CHANNELS, default=None, help='Input channels (default: gray and bgr)')
+    parser.add_argument('--methods', nargs='+', default=None, help='Only run these cases, e.g. edge_sobel get_QImage save_image.png')
+    parser.add_argument('--dtype', dest='dtype_policy', choices=list(DTYPE_POLICIES), default='float64', help='Precision of the operations')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per case, the median is reported')
+    parser.add_argument('--save', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown against the baseline (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    sizes = [tuple(int(value) for value in size.lower().split('x')) for size in args.sizes] if args.sizes else None
+    results = run_benchmarks(sizes, args.channels, args.methods, args.repeats, args.dtype_policy)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'dtype_policy': args.dtype_policy,
+                    'processor': platform.processor(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                },
+                'results': results,
+            }, file, indent=4)
+
+    if args.baseline:
+        baseline_policy, baseline = load_baseline(args.baseline)
+
+        # Timings of another precision are not comparable, the absence of regressions would mean nothing
+        if baseline_policy != args.dtype_policy:
+            print('Baseline {} was measured with --dtype {}, not {}'.format(args.baseline, baseline_policy, args.dtype_policy))
+            return 2
+        if not any(key in baseline for key in results):
+            print('No case of this run is in the baseline', args.baseline)
+            return 2
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for key, baseline_time, wall_time in regressions:
+            print('REGRESSION {}: {:.2f} ms -> {:.2f} ms ({:+.0f}%)'.format(
+                key, baseline_time * 1000, wall_time * 1000, (wall_time / baseline_time - 1) * 100))
+
+        if regressions:
+            return 1
+        print('No regressions against', args.baseline)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
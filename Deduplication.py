@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+
+INDEX_VERSION = 1
+
+# Default file name of the index, kept in the output directory of a batch
+DEDUP_INDEX_NAME = '.dedup_index.json'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+# Function to hash the bytes of a file, the cheap first stage: byte-identical copies are found without decoding
+def hash_file(path:str) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# Function to get the key of an operation, an output is reused only for the same operation, parameters, precision and format
+def get_operation_key(method, params:dict, dtype_policy:str, extension:str) -> str:
+    description = json.dumps({'method': method, 'params': params or {}, 'dtype_policy': dtype_policy, 'extension': extension.lower()}, sort_keys=True)
+    return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+# Function to get the stat of a file as stored in the index
+def get_file_stat(path:str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Dedup_Index:
+    def __init__(self, path:str = None):
+        """
+        Constructor for Dedup_Index class, the persistent content hashes of the inputs and the outputs made from them.
+        - files: path -> stat and file hash, a file whose size and mtime did not change is not read again
+        - pixels: file hash -> pixel hash (Image.get_hash), a known file is not decoded to find its duplicates
+        - outputs: path -> stat, pixel hash and operation key of the image that produced it
+        :param path: str - JSON file of the index, None keeps it in memory only
+        """
+        self.path = path
+        self.files = {}
+        self.pixels = {}
+        self.outputs = {}
+        self.__lock = threading.Lock()
+
+        # Outputs by (pixel hash, operation key), so that finding an output to copy does not scan the whole index
+        self.__outputs_by_key = {}
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except ValueError:
+                data = {}
+
+            # An index of another version is rebuilt
+            if data.get('version') == INDEX_VERSION:
+                self.files, self.pixels, self.outputs = data['files'], data['pixels'], data['outputs']
+
+        for path, entry in self.outputs.items():
+            self.__outputs_by_key.setdefault((entry['pixel_hash'], entry['operation']), set()).add(path)
+
+    ########################################### Inputs ####################################################
+
+    def get_file_hash(self, path:str) -> tuple:
+        """
+        Function to get the hash of a file's bytes, read from the index if the file did not change
+        :param path: str
+        :return: tuple - (file hash, True if it came from the index)
+        """
+        path = os.path.abspath(path)
+        stat = get_file_stat(path)
+
+        with self.__lock:
+            entry = self.files.get(path)
+            if entry is not None and entry['stat'] == stat:
+                return entry['hash'], True
+
+        file_hash = hash_file(path)
+        with self.__lock:
+            self.files[path] = {'stat': stat, 'hash': file_hash}
+        return file_hash, False
+
+    def get_pixel_hash(self, file_hash:str) -> str:
+        with self.__lock:
+            return self.pixels.get(file_hash)
+
+    def set_pixel_hash(self, file_hash:str, pixel_hash:str):
+        with self.__lock:
+            self.pixels[file_hash] = pixel_hash
+
+    ########################################### Outputs ####################################################
+
+    def is_output_current(self, path:str, pixel_hash:str, operation_key:str) -> bool:
+        """
+        Function to check if an output was made from the same pixels by the same operation and was not modified since
+        :param path: str
+        :param pixel_hash: str
+        :param operation_key: str - see get_operation_key
+        :return: bool
+        """
+        path = os.path.abspath(path)
+        with self.__lock:
+            entry = self.outputs.get(path)
+        if entry is None or entry['pixel_hash'] != pixel_hash or entry['operation'] != operation_key:
+            return False
+        return os.path.exists(path) and get_file_stat(path) == entry['stat']
+
+    def set_output(self, path:str, pixel_hash:str, operation_key:str):
+        path = os.path.abspath(path)
+        entry = {'stat': get_file_stat(path), 'pixel_hash': pixel_hash, 'operation': operation_key}
+        with self.__lock:
+            previous = self.outputs.get(path)
+            if previous is not None:
+                self.__outputs_by_key[(previous['pixel_hash'], previous['operation'])].discard(path)
+
+            self.outputs[path] = entry
+            self.__outputs_by_key.setdefault((pixel_hash, operation_key), set()).add(path)
+
+    def find_output(self, pixel_hash:str, operation_key:str, extension:str) -> str:
+        """
+        Function to find a current output of the same pixels and operation, its file can be copied instead of recomputed
+        :return: str or None
+        """
+        with self.__lock:
+            candidates = sorted(self.__outputs_by_key.get((pixel_hash, operation_key), ()))
+        for path in candidates:
+            if os.path.splitext(path)[1].lower() == extension.lower() and self.is_output_current(path, pixel_hash, operation_key):
+                return path
+        return None
+
+    def save(self):
+        """
+        Function to write the index atomically
+        :return: None
+        """
+        if self.path is None:
+            return
+
+        with self.__lock:
+            data = {'version': INDEX_VERSION, 'files': self.files, 'pixels': self.pixels, 'outputs': self.outputs}
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as file:
+                json.dump(data, file)
+        os.replace(temporary_path, self.path)
@@ -1,6 +1,10 @@
+import hashlib
+
 import numpy as np
 import cv2
-from PyQt5.QtGui import QPixmap, QImage
+
+from Tracing import traced
+from Image_Export import get_encode_params, write_encoded
 
 
 class Image:
@@ -13,8 +17,19 @@ class Image:
         if image is not None:
             self.set_image( image )
 
+    @traced('Image.set_image', 'decode')
     def set_image(self, image: np.ndarray):
-        if isinstance(image, str):
+        # Invalidate the values derived from the previous pixels
+        self.__hash = None
+        self.__derived = {}
+        self.__pyramid = {}
+        self.__qimage = None
+        self.__qimage_buffer = None
+
+        if isinstance(image, str) and image.endswith('.npy'):
+            # .npy images are memory-mapped, the pixels are read from disk on demand
+            self.image = np.load(image, mmap_mode='r')
+        elif isinstance(image, str):
             self.image = cv2.imread(image, cv2.IMREAD_COLOR)
         elif isinstance(image, np.ndarray):
             self.image = image
@@ -26,6 +41,147 @@ class Image:
             raise ValueError('Invalid image type')    
         return self.image
     
+    def get_hash(self) -> str:
+        """
+        Function to get a hash of the pixels, computed once per image
+        :return: str
+        """
+        if getattr(self, '_Image__hash', None) is None:
+            img = np.ascontiguousarray(self.get_nd_image())
+
+            hasher = hashlib.blake2b(digest_size=16)
+            hasher.update(str((img.shape, img.dtype.str)).encode())
+            hasher.update(img.data)
+            self.__hash = hasher.hexdigest()
+
+        return self.__hash
+
+    def get_derived(self, name:str, compute):
+        """
+        Function to get a representation derived from the pixels, computed once per image and shared read-only
+        :param name: str - Name of the representation
+        :param compute: callable - Function computing the representation from the image
+        :return: np.ndarray or tuple of np.ndarray
+        """
+        if getattr(self, '_Image__derived', None) is None:
+            self.__derived = {}
+
+        if name not in self.__derived:
+            value = compute()
+            for array in (value if isinstance(value, tuple) else (value,)):
+                array.setflags(write=False)
+            self.__derived[name] = value
+
+        return self.__derived[name]
+
+    def get_gray(self) -> np.ndarray:
+        """
+        Function to get the gray plane of the image
+        :return: np.ndarray
+        """
+        if self.get_image_channels_type() == 'GRAY':
+            return self.get_nd_image()
+
+        return self.get_derived('gray', lambda: cv2.cvtColor(self.get_nd_image(), cv2.COLOR_BGR2GRAY))
+
+    def get_hsv(self) -> np.ndarray:
+        """
+        Function to get the HSV planes of the image, the gray plane of a GRAY image
+        :return: np.ndarray
+        """
+        if self.get_image_channels_type() == 'GRAY':
+            return self.get_nd_image()
+
+        return self.get_derived('hsv', lambda: cv2.cvtColor(self.get_nd_image(), cv2.COLOR_BGR2HSV))
+
+    def get_planes(self, color_space:str = 'gray') -> np.ndarray:
+        """
+        Function to get the planes of the image in a color space
+        :param color_space: str - 'gray', 'bgr' or 'hsv', GRAY images always return their gray plane
+        :return: np.ndarray - 2D for gray, 3D with the planes last otherwise
+        """
+        if color_space == 'gray':
+            return self.get_gray()
+        elif color_space == 'bgr':
+            return self.get_nd_image()
+        elif color_space == 'hsv':
+            return self.get_hsv()
+        else:
+            raise ValueError('Invalid color space, color_space: ', color_space)
+
+    def get_histogram(self, color_space:str = 'gray', channel:int = 0) -> tuple:
+        """
+        Function to get the 256-bin histogram of a plane, computed once per image
+        :param color_space: str - 'gray', 'bgr' or 'hsv', see get_planes
+        :param channel: int - Plane index in the color space, ignored for 2D planes
+        :return: tuple of (counts, bin_centers) - The format accepted by skimage's hist arguments
+        """
+        def compute():
+            planes = self.get_planes(color_space)
+            index = channel if planes.ndim == 3 else 0
+
+            if planes.dtype == np.uint8:
+                # calcHist reads the plane in place, without copying it out of the interleaved image
+                counts = cv2.calcHist([np.ascontiguousarray(planes)], [index], None, [256], [0, 256])
+                return counts.ravel().astype(np.int64), np.arange(256)
+
+            plane = planes[..., index] if planes.ndim == 3 else planes
+            counts, bin_edges = np.histogram(plane, bins=256)
+            return counts, (bin_edges[:-1] + bin_edges[1:]) / 2
+
+        planes = self.get_planes(color_space)
+        key = 'histogram' if planes.ndim == 2 else 'histogram_{}_{}'.format(color_space, channel)
+        return self.get_derived(key, compute)
+
+    def get_float_image(self, dtype=np.float64) -> np.ndarray:
+        """
+        Function to get the gray plane as floats, uint8 images are normalized to [0, 1] like skimage's img_as_float
+        :param dtype: np.float64 or np.float32 - Precision of the plane, each one is computed once
+        :return: np.ndarray
+        """
+        dtype = np.dtype(dtype)
+
+        def compute():
+            gray = self.get_gray()
+            if gray.dtype == np.uint8:
+                return np.multiply(gray, dtype.type(1 / 255), dtype=dtype)
+            return gray.astype(dtype)
+
+        return self.get_derived('float' if dtype == np.float64 else 'float_' + dtype.name, compute)
+
+    def get_pyramid_level(self, width:int, height:int) -> int:
+        """
+        Function to get the coarsest pyramid level that still covers the given display size
+        :param width: int
+        :param height: int
+        :return: int - 0 is the full resolution, every level halves the size
+        """
+        h, w = self.get_nd_image().shape[:2]
+
+        level = 0
+        while (w // 2) >= width and (h // 2) >= height:
+            w, h = w // 2, h // 2
+            level += 1
+
+        return level
+
+    def get_pyramid_image(self, level:int) -> 'Image':
+        """
+        Function to get a downsampled copy of the image, computed once per level with cv2.pyrDown
+        :param level: int - 0 returns the image itself
+        :return: Image
+        """
+        if level <= 0:
+            return self
+
+        if getattr(self, '_Image__pyramid', None) is None:
+            self.__pyramid = {}
+
+        if level not in self.__pyramid:
+            self.__pyramid[level] = Image(cv2.pyrDown(self.get_pyramid_image(level - 1).get_nd_image()))
+
+        return self.__pyramid[level]
+
     def get_image_channels_type(self) -> str:
         """
         Function to get the type of the image channels like RGB, BGR, HSV, GRAY etc.
@@ -34,9 +190,30 @@ class Image:
         channels = self.get_nd_image().shape[2] if len(self.get_nd_image().shape) > 2  else 1
         return 'BGR' if channels == 3 else 'GRAY' 
     
-    def get_QImage(self) -> QImage:
+    def get_uint8_image(self) -> np.ndarray:
+        """
+        Function to get the image as 8-bit unsigned integers. The scaling is chosen from the dtype, the pixels are not scanned:
+        floats are in [0, 1] like skimage's, 16-bit images keep their high byte, bool and other integers are 0/1 masks
+        :return: np.ndarray
+        """
+        img = self.get_nd_image()
+        if img.dtype == np.uint8:
+            return img
+
+        # Scale and cast in a single ufunc pass, without a full size temporary
+        ret = np.empty(img.shape, dtype=np.uint8)
+        if img.dtype == np.uint16:
+            np.right_shift(img, 8, out=ret, casting='unsafe')
+        else:
+            np.multiply(img, np.uint8(255), out=ret, casting='unsafe')
+        return ret
+
+    @traced('Image.get_QImage', 'display')
+    def get_QImage(self) -> 'QImage':
         """
-        Function to get the QImage object from the numpy array
+        Function to get the QImage object from the numpy array. The QImage wraps the pixel buffer
+        without copying it and is cached until set_image changes the pixels; the buffer is kept alive
+        by this Image, so the QImage must not outlive it (QPixmap.fromImage makes its own copy).
     
         Arguments:
             None
@@ -44,53 +221,51 @@ class Image:
         Returns:
             QImage: QImage object - The image object to be displayed in the UI
         """
+        # Qt is imported here so that headless tools can use Image without PyQt5
+        from PyQt5 import sip
+        from PyQt5.QtGui import QImage
 
+        if getattr(self, '_Image__qimage', None) is not None:
+            return self.__qimage
 
-        img = self.get_nd_image()
+        img = self.get_uint8_image()
 
-        # Convert the image to 8-bit unsigned integer if it's not already
-        if img.dtype != np.uint8:
-            img = (img * 255).astype(np.uint8)
+        # self.image_operator.get_output_image().get_nd_image() => array([ 92, 150], dtype=uint8)
+        # Convert this to a single column image
+        if len(img.shape) == 1:
+            img = img.reshape(img.shape[0], 1)
 
-        # Convert grayscale to RGB
-        if len(img.shape) == 2:  # Grayscale image
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-        else:  # Color image
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # QImage needs contiguous pixels inside each row, the row stride itself can be anything
+        if img.strides[-1] != img.itemsize or (img.ndim == 3 and img.strides[1] != img.shape[2]):
+            img = np.ascontiguousarray(img)
 
-        # Get the shape of the image
-        h, w, ch = img.shape
+        h, w = img.shape[:2]
 
-        # Convert the image to QImage
-        bytes_per_line = ch * w
+        if img.ndim == 2:
+            image_format = QImage.Format_Grayscale8
+        elif hasattr(QImage, 'Format_BGR888'):
+            image_format = QImage.Format_BGR888
+        else:
+            # Qt older than 5.14 has no BGR format
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            image_format = QImage.Format_RGB888
 
-        # self.image_operator.get_output_image().get_nd_image() => array([ 92, 150], dtype=uint8)
-        # Convert this to cv image
-        if len(img.shape) == 1:
-            img = img.reshape(img.shape[0], 1)
+        # Keep a reference to the buffer for as long as the QImage is cached
+        self.__qimage_buffer = img
+        self.__qimage = QImage(sip.voidptr(img.ctypes.data), w, h, img.strides[0], image_format)
 
-        return QImage(
-            img.data, 
-            w, 
-            h, 
-            bytes_per_line, 
-            QImage.Format_RGB888
-            )
-    
-    def save_image(self, path:str):
+        return self.__qimage
+
+    @traced('Image.save_image', 'encode')
+    def save_image(self, path:str, jpeg_quality:int = None, png_compression:int = None):
         """
         Function to save the image to the specified path
-        :param path: str
+        :param path: str - The extension selects the format
+        :param jpeg_quality: int - JPEG and WebP quality (0-100), None uses Image_Export's default
+        :param png_compression: int - PNG compression level (0-9), None uses Image_Export's default
         :return: None
         """
-
-        nd_img = self.get_nd_image()
-
-        # Convert the image to 8-bit unsigned integer if it's not already
-        if nd_img.dtype != np.uint8 or nd_img.max() < 2:
-            nd_img = (nd_img * 255).astype(np.uint8)
-
-        cv2.imwrite(path, nd_img)
+        write_encoded(path, self.get_uint8_image(), get_encode_params(path, jpeg_quality, png_compression))
     
 if __name__ == '__main__':
     image = Image('src/images/lena.png')
@@ -0,0 +1,184 @@
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from Batch_Processing import list_images
+from Deduplication import Dedup_Index
+from Result_Cache import Result_Cache
+
+THUMBNAIL_SIZE = 96
+
+# Reduced decodes from the coarsest to the full resolution. JPEG decodes them directly at the
+# reduced size (DCT scaling), which is several times faster than a full decode and a resize
+REDUCED_DECODES = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR)]
+
+
+# Function to decode an image for a thumbnail at the coarsest reduction still covering the thumbnail size
+def decode_thumbnail(path:str, size:int = THUMBNAIL_SIZE) -> np.ndarray:
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if img is None:
+        raise ValueError('Could not decode image: ' + path)
+
+    # Small images are decoded again at the largest reduction that still covers the thumbnail
+    if max(img.shape[:2]) < size:
+        full_size = max(img.shape[:2]) * 8
+        for factor, flag in REDUCED_DECODES[1:]:
+            if full_size // factor >= size or factor == 1:
+                img = cv2.imread(path, flag)
+                break
+
+    scale = size / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, (max(round(img.shape[1] * scale), 1), max(round(img.shape[0] * scale), 1)), interpolation=cv2.INTER_AREA)
+
+    return img
+
+
+class Image_Browser:
+    def __init__(self, cache_max_bytes:int = 512 * 1024 * 1024, workers:int = 2, prefetch_distance:int = 1, thumbnail_size:int = THUMBNAIL_SIZE):
+        """
+        Constructor for Image_Browser class, walks through the images of a folder.
+        Full decodes run on a thread pool and are kept in a bounded LRU cache, the neighbours of the
+        current image are decoded in the background so that moving to them does not wait for a decode.
+        :param cache_max_bytes: int - Memory budget of the decoded images
+        :param workers: int - Number of decode threads, cv2.imread releases the GIL
+        :param prefetch_distance: int - Number of images prefetched on each side of the current one
+        :param thumbnail_size: int - Longest side of the thumbnails in pixels
+        """
+        self.paths = []
+        self.index = -1
+
+        self.prefetch_distance = prefetch_distance
+        self.thumbnail_size = thumbnail_size
+
+        self.decode_cache = Result_Cache(max_bytes=cache_max_bytes)
+
+        # Hashes of the files, kept in memory and only recomputed when a file's size or mtime changes.
+        # Decoded images by file hash, so that copies of a file share one decode while any of them is cached
+        self.file_index = Dedup_Index()
+        self.__decoded = weakref.WeakValueDictionary()
+        self.__hash_locks = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image_browser')
+
+        # Full decodes in flight, a request for an image that is being prefetched waits for that decode
+        self.__pending = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def open_folder(self, folder:str) -> int:
+        """
+        Function to list the images of a folder, nothing is decoded until they are requested
+        :param folder: str
+        :return: int - Number of images found
+        """
+        self.paths = list_images(folder)
+        self.index = 0 if self.paths else -1
+        return len(self.paths)
+
+    def get_path(self, index:int = None) -> str:
+        return self.paths[self.index if index is None else index]
+
+    ########################################### Decoding ####################################################
+
+    # Cache key of a file, cheap enough for the GUI thread: a file modified on disk is decoded again.
+    # It raises OSError if the file is gone
+    def __get_key(self, path:str) -> tuple:
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+    # Function to decode a file in a worker, the file is hashed there so that a copy of a decoded file is not decoded again
+    def __decode(self, key:tuple, path:str) -> np.ndarray:
+        try:
+            file_hash = self.file_index.get_file_hash(path)[0]
+
+            # Copies decoded at the same time wait for the first one
+            with self.__lock:
+                hash_lock = self.__hash_locks.setdefault(file_hash, threading.Lock())
+
+            with hash_lock:
+                img = self.__decoded.get(file_hash)
+                if img is None:
+                    img = cv2.imread(path, cv2.IMREAD_COLOR)
+                    if img is None:
+                        raise ValueError('Could not decode image: ' + path)
+                    self.__decoded[file_hash] = img
+
+            self.decode_cache.put(key, img)
+            return img
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    # Function to start the full decode of a file if it is neither cached nor already being decoded
+    def __submit(self, path:str):
+        key = self.__get_key(path)
+
+        with self.__lock:
+            future = self.__pending.get(key)
+            if future is None and self.decode_cache.get(key) is None:
+                future = self.executor.submit(self.__decode, key, path)
+                self.__pending[key] = future
+
+        return key, future
+
+    # Function to check if an entry is decoded, it raises OSError if its file is gone
+    def is_cached(self, index:int) -> bool:
+        return self.decode_cache.get(self.__get_key(self.paths[index])) is not None
+
+    def get_image(self, index:int, progress_callback=None) -> np.ndarray:
+        """
+        Function to get the full resolution image of a folder entry and make it the current one.
+        A cached image is returned at once, otherwise it waits for its decode. The neighbours are prefetched.
+        :param index: int
+        :param progress_callback: callable(int) - Called with the progress in percent
+        :return: np.ndarray - Read-only BGR image, shared with the cache
+        """
+        self.index = index
+        key, future = self.__submit(self.paths[index])
+        self.prefetch(index)
+
+        img = future.result() if future is not None else self.decode_cache.get(key)
+        if img is None:
+            # Evicted between the check and the lookup, decoded again
+            img = self.__decode(key, self.paths[index])
+
+        if progress_callback is not None:
+            progress_callback(100)
+        return img
+
+    def prefetch(self, index:int):
+        """
+        Function to decode the neighbours of an entry in the background, nearest first
+        :param index: int
+        :return: None
+        """
+        for distance in range(1, self.prefetch_distance + 1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(self.paths):
+                    # A missing neighbour is reported when it is opened
+                    try:
+                        self.__submit(self.paths[neighbour])
+                    except OSError:
+                        pass
+
+    def get_thumbnail(self, index:int, progress_callback=None) -> np.ndarray:
+        """
+        Function to decode the thumbnail of a folder entry at reduced resolution
+        :param index: int
+        :param progress_callback: callable(int) - Called with the progress in percent
+        :return: np.ndarray - BGR image whose longest side is at most thumbnail_size
+        """
+        img = decode_thumbnail(self.paths[index], self.thumbnail_size)
+
+        if progress_callback is not None:
+            progress_callback(100)
+        return img
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,89 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+# Formats the exporter can write, by extension
+EXPORT_FORMATS = ['.jpg', '.png', '.bmp', '.tiff', '.webp']
+
+# JPEG quality is 0-100, PNG compression is 0 (fastest, largest) to 9 (slowest, smallest)
+DEFAULT_JPEG_QUALITY = 95
+DEFAULT_PNG_COMPRESSION = 1
+
+
+# Function to get the cv2.imwrite/imencode parameters of a format
+def get_encode_params(path:str, jpeg_quality:int = None, png_compression:int = None) -> list:
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, DEFAULT_JPEG_QUALITY if jpeg_quality is None else int(jpeg_quality)]
+    if extension == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, DEFAULT_PNG_COMPRESSION if png_compression is None else int(png_compression)]
+    if extension == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, DEFAULT_JPEG_QUALITY if jpeg_quality is None else int(jpeg_quality)]
+    return []
+
+
+# Function to encode an 8-bit image and write it atomically, a reader never sees a partially written file
+def write_encoded(path:str, img:np.ndarray, params:list = None):
+    extension = os.path.splitext(path)[1]
+    success, buffer = cv2.imencode(extension, img, params or [])
+    if not success:
+        raise ValueError('Could not encode image: ' + path)
+
+    temporary_path = path + '.tmp'
+    buffer.tofile(temporary_path)
+    os.replace(temporary_path, path)
+
+
+class Image_Exporter:
+    def __init__(self, workers:int = None):
+        """
+        Constructor for Image_Exporter class, encodes images on a thread pool.
+        cv2.imencode releases the GIL, so the formats of one export are encoded in parallel.
+        :param workers: int - Number of encoder threads, None uses the executor default
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image_exporter')
+        self.__lock = threading.Lock()
+        self.__pending = 0
+
+    def export(self, image, paths:list, jpeg_quality:int = None, png_compression:int = None, progress_callback=None) -> list:
+        """
+        Function to write an image to one or several files, e.g. the same output as .jpg and .png.
+        The 8-bit conversion is done once and shared by every format.
+        :param image: Image
+        :param paths: list of str - Output paths, their extension selects the format
+        :param jpeg_quality: int - JPEG and WebP quality (0-100), None uses DEFAULT_JPEG_QUALITY
+        :param png_compression: int - PNG compression level (0-9), None uses DEFAULT_PNG_COMPRESSION
+        :param progress_callback: callable(int) - Called with the progress in percent after each file
+        :return: list of str - The written paths
+        """
+        img = image.get_uint8_image()
+
+        with self.__lock:
+            self.__pending += len(paths)
+
+        try:
+            futures = [
+                self.executor.submit(write_encoded, path, img, get_encode_params(path, jpeg_quality, png_compression))
+                for path in paths
+            ]
+            for done, future in enumerate(futures, 1):
+                future.result()
+                if progress_callback is not None:
+                    progress_callback(100 * done // len(paths))
+        finally:
+            with self.__lock:
+                self.__pending -= len(paths)
+
+        return list(paths)
+
+    def is_busy(self) -> bool:
+        with self.__lock:
+            return self.__pending > 0
+
+    def shutdown(self, wait:bool = True):
+        # Files being written are finished, exiting in the middle of an encode would leave a .tmp file
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,245 @@
+import tempfile
+import zlib
+from collections import deque
+
+import numpy as np
+
+from Image import Image
+
+
+class Snapshot:
+    """
+    One entry of the history. The pixels live in exactly one of three places:
+    an Image object (raw), zlib compressed bytes in memory, or a region of the spill file.
+    Snapshots of a reopened session are external: their pixels are loaded by a callable when needed.
+    """
+    __slots__ = ('image', 'compressed', 'file_offset', 'file_length', 'loader', 'shape', 'dtype', 'metadata')
+
+    def __init__(self, image:Image, metadata:dict = None, loader=None, shape:tuple = None, dtype=None):
+        self.image = image
+        self.metadata = metadata
+        self.compressed = None
+        self.file_offset = None
+        self.file_length = None
+        self.loader = loader
+
+        if image is not None:
+            nd_image = image.get_nd_image()
+            self.shape = nd_image.shape
+            self.dtype = nd_image.dtype
+        else:
+            self.shape = shape
+            self.dtype = dtype
+
+    def get_state(self) -> str:
+        if self.image is not None:
+            return 'raw'
+        if self.compressed is not None:
+            return 'compressed'
+        if self.loader is not None:
+            return 'external'
+        return 'spilled'
+
+    def get_memory_size(self) -> int:
+        if self.image is not None:
+            return self.image.get_nd_image().nbytes
+        if self.compressed is not None:
+            return len(self.compressed)
+        return 0
+
+
+class Image_History:
+    def __init__(self, max_bytes:int = 512 * 1024 * 1024, raw_window:int = 1, compression_level:int = 1):
+        """
+        Constructor for Image_History class, a memory-bounded undo/redo stack of output images
+        :param max_bytes: int - Memory budget of the snapshots, older snapshots spill to a temporary file past it
+        :param raw_window: int - Snapshots closer than this to the current one stay uncompressed
+        :param compression_level: int - zlib level used for older snapshots (1 is fastest)
+        """
+        self.max_bytes = max_bytes
+        self.raw_window = raw_window
+        self.compression_level = compression_level
+
+        self.__snapshots = []
+        self.__current_index = -1
+        self.__memory_size = 0
+        self.__spill_file = None
+
+        # Indices of the uncompressed snapshots and the in-memory compressed snapshots in spill order,
+        # both stay small so keeping the budget never walks the whole history
+        self.__raw_indices = set()
+        self.__compressed_queue = deque()
+
+    def __len__(self) -> int:
+        return len(self.__snapshots)
+
+    def get_current_index(self) -> int:
+        return self.__current_index
+
+    def get_memory_size(self) -> int:
+        return self.__memory_size
+
+    def get_states(self) -> list:
+        """
+        Function to get the storage state of every snapshot, oldest first
+        :return: list of 'raw', 'compressed', 'spilled' or 'external'
+        """
+        return [snapshot.get_state() for snapshot in self.__snapshots]
+
+    ########################################### Stack Operations ####################################################
+
+    def push(self, image:Image, metadata:dict = None):
+        """
+        Function to add a new snapshot after the current one, dropping the redo branch
+        :param image: Image
+        :param metadata: dict - Information about how the image was produced, kept uncompressed
+        :return: None
+        """
+        # Drop the redo branch, every snapshot is deleted at most once so this is amortized O(1)
+        for index in range(self.__current_index + 1, len(self.__snapshots)):
+            self.__drop(index)
+        del self.__snapshots[self.__current_index + 1:]
+
+        snapshot = Snapshot(image, metadata)
+        self.__snapshots.append(snapshot)
+        self.__memory_size += snapshot.get_memory_size()
+        self.__current_index = len(self.__snapshots) - 1
+        self.__raw_indices.add(self.__current_index)
+
+        self.__enforce_budget()
+
+    def append_external(self, loader, shape:tuple, dtype, metadata:dict = None):
+        """
+        Function to add a snapshot whose pixels are loaded only when it becomes the current one, e.g. from a session file.
+        The current index is not changed, see set_current_index
+        :param loader: callable() -> np.ndarray
+        :param shape: tuple - Shape of the array the loader returns
+        :param dtype: dtype of the array the loader returns
+        :param metadata: dict
+        :return: None
+        """
+        self.__snapshots.append(Snapshot(None, metadata, loader, tuple(shape), np.dtype(dtype)))
+
+    def set_current_index(self, index:int):
+        if not -1 <= index < len(self.__snapshots):
+            raise IndexError('Invalid history index, index: ', index)
+        self.__current_index = index
+
+    def undo(self) -> bool:
+        if self.__current_index <= 0:
+            return False
+        self.__current_index -= 1
+        return True
+
+    def redo(self) -> bool:
+        if self.__current_index >= len(self.__snapshots) - 1:
+            return False
+        self.__current_index += 1
+        return True
+
+    def get_current(self) -> Image:
+        """
+        Function to get the current snapshot, restoring it if it was compressed or spilled
+        :return: Image
+        """
+        if self.__current_index < 0:
+            raise IndexError('History is empty')
+
+        snapshot = self.__snapshots[self.__current_index]
+        if snapshot.image is None:
+            self.__restore(snapshot)
+            self.__raw_indices.add(self.__current_index)
+            self.__enforce_budget()
+
+        return snapshot.image
+
+    def get_current_metadata(self) -> dict:
+        if self.__current_index < 0:
+            raise IndexError('History is empty')
+        return self.__snapshots[self.__current_index].metadata
+
+    def clear(self):
+        self.__snapshots = []
+        self.__current_index = -1
+        self.__memory_size = 0
+        self.__raw_indices = set()
+        self.__compressed_queue = deque()
+
+        if self.__spill_file is not None:
+            self.__spill_file.close()
+            self.__spill_file = None
+
+    ########################################### Storage Management ####################################################
+
+    def __enforce_budget(self):
+        # Snapshots away from the current one are compressed, the nearest ones stay raw for fast undo/redo
+        for index in list(self.__raw_indices):
+            if abs(index - self.__current_index) > self.raw_window:
+                self.__compress(self.__snapshots[index])
+                self.__raw_indices.discard(index)
+
+        # Past the budget the oldest compressed snapshots are spilled to disk
+        current_snapshot = self.__snapshots[self.__current_index] if self.__current_index >= 0 else None
+        while self.__memory_size > self.max_bytes and self.__compressed_queue:
+            snapshot = self.__compressed_queue.popleft()
+
+            # Skip snapshots that were restored or dropped since they were queued
+            if snapshot.compressed is None or snapshot is current_snapshot:
+                continue
+            self.__spill(snapshot)
+
+    def __drop(self, index:int):
+        snapshot = self.__snapshots[index]
+
+        self.__memory_size -= snapshot.get_memory_size()
+        self.__raw_indices.discard(index)
+        snapshot.image = None
+        snapshot.compressed = None
+        snapshot.loader = None
+
+    def __compress(self, snapshot:Snapshot):
+        self.__memory_size -= snapshot.get_memory_size()
+
+        # A snapshot restored from the spill file or loaded from outside is still on disk, so it is simply released again
+        if snapshot.file_offset is not None or snapshot.loader is not None:
+            snapshot.image = None
+            return
+
+        nd_image = np.ascontiguousarray(snapshot.image.get_nd_image())
+        snapshot.compressed = zlib.compress(nd_image, self.compression_level)
+        snapshot.image = None
+        self.__memory_size += snapshot.get_memory_size()
+        self.__compressed_queue.append(snapshot)
+
+    def __spill(self, snapshot:Snapshot):
+        if self.__spill_file is None:
+            self.__spill_file = tempfile.TemporaryFile(prefix='image_history_')
+
+        # The spill file is append-only, space is reclaimed when the history is cleared
+        self.__spill_file.seek(0, 2)
+        snapshot.file_offset = self.__spill_file.tell()
+        snapshot.file_length = len(snapshot.compressed)
+        self.__spill_file.write(snapshot.compressed)
+
+        self.__memory_size -= snapshot.get_memory_size()
+        snapshot.compressed = None
+
+    def __restore(self, snapshot:Snapshot):
+        if snapshot.loader is not None:
+            snapshot.image = Image(snapshot.loader())
+            self.__memory_size += snapshot.get_memory_size()
+            return
+
+        if snapshot.compressed is not None:
+            data = snapshot.compressed
+        else:
+            self.__spill_file.seek(snapshot.file_offset)
+            data = self.__spill_file.read(snapshot.file_length)
+
+        nd_image = np.frombuffer(zlib.decompress(data), dtype=snapshot.dtype).reshape(snapshot.shape)
+
+        self.__memory_size -= snapshot.get_memory_size()
+        # Copy so the restored array is writable like the original one
+        snapshot.image = Image(nd_image.copy())
+        snapshot.compressed = None
+        self.__memory_size += snapshot.get_memory_size()
@@ -1,21 +1,61 @@
 import numpy as np
 import cv2
-import skimage as ski
 
 from Image import Image
+from Image_History import Image_History
+from Result_Cache import Result_Cache, cached_operation
+import Tiled_Processing
+import Edge_Engine
+import Segmentation_Engine
+from Tracing import traced
+from Lazy_Import import Lazy_Module
+
+# skimage submodules are imported on the first edge detection or segmentation call
+ski = Lazy_Module('skimage')
+
+
+# Method names accepted by Image_Operations.apply_operation
+CONVERSION_METHODS = ['bgr_2_gray', 'bgr_2_hsv']
+EDGE_DETECTION_METHODS = ['edge_roberts', 'edge_sobel', 'edge_scharr', 'edge_prewitt', 'edge_compare_all']
+SEGMENTATION_METHODS = ['segment_multi_otsu', 'segment_chan_vese', 'segment_moprh_snakes']
+DENOISE_METHODS = ['denoise_gaussian', 'denoise_median']
+OPERATION_METHODS = CONVERSION_METHODS + EDGE_DETECTION_METHODS + SEGMENTATION_METHODS + DENOISE_METHODS
+
+# Precision of the processing path, by policy name: (dtype the float computations run in, dtype the outputs are stored in).
+# 'float64' matches skimage exactly, 'float32' halves the memory of float outputs,
+# 'uint8' stores outputs like the sources, at the display's precision, 8x smaller than float64
+DTYPE_POLICIES = {
+    'float64': (np.float64, None),
+    'float32': (np.float32, np.float32),
+    'uint8': (np.float32, np.uint8),
+}
+
+
+# Function to report the progress of an operation if a callback is given
+def report_progress(progress_callback, value:int):
+    if progress_callback is not None:
+        progress_callback(value)
+
 
 class Image_Operations(Image):
-    def __init__(self, image:np.ndarray = None):
+    def __init__(self, image:np.ndarray = None, history_max_bytes:int = 512 * 1024 * 1024, cache_max_bytes:int = 256 * 1024 * 1024, dtype_policy:str = 'float64'):
         """
         Constructor for image_operator class
         :param image: np.ndarray or str
+        :param history_max_bytes: int - Memory budget of the undo/redo history, older snapshots spill to disk past it
+        :param cache_max_bytes: int - Memory budget of the operation result cache
+        :param dtype_policy: str - Precision of the processing path, one of DTYPE_POLICIES
         """
         
+        # Initialize the result cache before the source image, setting the source invalidates it
+        self.result_cache = Result_Cache(max_bytes=cache_max_bytes)
+        self.set_dtype_policy(dtype_policy)
+
         if image is not None:
             self.set_source_image( image )
 
         # Initialize the image history for redo and undo operations
-        self.output_image_history = {"image_history":[], "current_index":0}
+        self.output_image_history = Image_History(max_bytes=history_max_bytes)
     
     # Set the source image
     def set_source_image(self, image:np.ndarray):
@@ -23,64 +63,120 @@ class Image_Operations(Image):
         # If the input is a ndarray, create an Image object, else use the Image object directly
         self.source_image = Image(image) if type(image) != Image else image
 
-    # Set the output image
-    def set_output_image(self, output:np.ndarray):
+        # Cached results belong to the previous source
+        self.result_cache.clear()
+
+    # Set the precision of the processing path, see DTYPE_POLICIES
+    def set_dtype_policy(self, dtype_policy:str):
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError('Invalid dtype policy, dtype_policy: ', dtype_policy)
+        self.dtype_policy = dtype_policy
+
+        # Cached results were computed with the previous precision
+        self.result_cache.clear()
+
+    # Get the dtype float computations run in
+    def get_compute_dtype(self):
+        return DTYPE_POLICIES[self.dtype_policy][0]
+
+    # Convert an operation output to the storage dtype of the policy, the history and the display get that array
+    def to_storage_dtype(self, output:np.ndarray) -> np.ndarray:
+        storage_dtype = DTYPE_POLICIES[self.dtype_policy][1]
+        if output is None or storage_dtype is None or output.dtype == storage_dtype:
+            return output
+
+        if storage_dtype == np.uint8:
+            # Same scaling as the display and save_image
+            return Image(output).get_uint8_image()
+        if output.dtype.kind == 'f':
+            return output.astype(storage_dtype)
+        return output
+
+    # Set the output image, operation holds the method and parameters that produced it
+    def set_output_image(self, output:np.ndarray, operation:dict = None):
         
         # If the input is a ndarray, create an Image object, else use the Image object directly
-        self.__output_image = Image(output) if type(output) != Image else output
+        output_image = Image(output) if type(output) != Image else output
 
-        if self.output_image_history["current_index"] == 0:
-            self.output_image_history["image_history"].insert(0, self.__output_image)
-        else:
-            self.output_image_history["image_history"] = self.output_image_history["image_history"][self.output_image_history["current_index"]:]
-            self.output_image_history["image_history"].insert(0, self.__output_image)
-            self.output_image_history["current_index"] = 0
+        # Pushing drops the redo branch of the history
+        self.output_image_history.push(output_image, operation)
     
     # Get the source image
     def get_source_image(self) -> np.ndarray:    
         return self.source_image
+
+    # Check if a source image is loaded, a cleared source is an Image without pixels
+    def has_source_image(self) -> bool:
+        source = getattr(self, 'source_image', None)
+        return source is not None and isinstance(getattr(source, 'image', None), np.ndarray)
     
+    # Get the image the operations run on, the pyramid level matching the preview size or the full resolution source
+    def get_operation_source(self, preview_size:tuple = None) -> Image:
+        source = self.get_source_image()
+
+        if preview_size is None:
+            return source
+        return source.get_pyramid_image(source.get_pyramid_level(*preview_size))
+
     # Get the output image
     def get_output_image(self) -> np.ndarray:
 
         try:
-            index = self.output_image_history["current_index"]
-            return self.output_image_history["image_history"][index] 
-        except:
+            return self.output_image_history.get_current()
+        except IndexError:
             print("No output image available")
 
 
 
+    # Get the method and parameters that produced the output image
+    def get_output_operation(self) -> dict:
+        try:
+            return self.output_image_history.get_current_metadata()
+        except IndexError:
+            return None
+
     ########################################### Undo - Redo Functions ####################################################
 
     def undo_output_image(self):
-        try:
-            if self.output_image_history["current_index"] < len(self.output_image_history["image_history"]) - 1 :
-                self.output_image_history["current_index"] = (self.output_image_history["current_index"] + 1) 
-                                                        
-            # I didn't use set function because I don't want to update the history list
-            self.__output_image = self.output_image_history["image_history"][self.output_image_history["current_index"]]
-        except:
+        if not self.output_image_history.undo():
             print("No more undo operations")
+
     def redo_output_image(self):
-        try:
-            if self.output_image_history["current_index"] > 0:
-                self.output_image_history["current_index"] = (self.output_image_history["current_index"] - 1)
-            
-            # I didn't use set function because I don't want to update the history list
-            self.__output_image = self.output_image_history["image_history"][self.output_image_history["current_index"]]
-        except:
+        if not self.output_image_history.redo():
             print("No more redo operations")
 
     #################################################################################################################
 
 
+    # Function to run any operation by its method name, e.g. 'bgr_2_gray', 'edge_sobel', 'segment_multi_otsu'
+    def apply_operation(self, method:str, **kwargs) -> np.ndarray:
+        method = method.replace('_menu', '')
+
+        if method.startswith('bgr_2_'):
+            return self.conversion_actions(method=method, **kwargs)
+        elif method.startswith('edge_'):
+            return self.edge_detection_actions(method=method, **kwargs)
+        elif method.startswith('segment_'):
+            return self.segment_image(method=method, **kwargs)
+        elif method.startswith('denoise_'):
+            return self.denoise_actions(method=method, **kwargs)
+        else:
+            raise ValueError('Invalid operation, method: ', method)
+
     # Function to convert the image to a specified color space
-    def conversion_actions(self, method:str='gray') -> np.ndarray:
-        src_type = self.get_source_image().get_image_channels_type()
+    @traced('Image_Operations.conversion_actions', 'operation')
+    @cached_operation
+    def conversion_actions(self, method:str='gray', preview_size:tuple=None, progress_callback=None) -> np.ndarray:
+        report_progress(progress_callback, 0)
+        source = self.get_operation_source(preview_size)
+        src_type = source.get_image_channels_type()
 
         method = method.replace('_menu', '')
 
+        # Memory-mapped sources are processed tile by tile into a memory-mapped output
+        if isinstance(source.get_nd_image(), np.memmap) and src_type == 'BGR' and method in Tiled_Processing.TILE_HALO:
+            return self.to_storage_dtype(Tiled_Processing.run_tiled(source.get_nd_image(), method, progress_callback=progress_callback))
+
         if method == 'bgr_2_gray':
             if src_type == 'BGR':
                 cvt_type = cv2.COLOR_BGR2GRAY
@@ -96,55 +192,103 @@ class Image_Operations(Image):
         else:
             raise ValueError('Invalid method for conversion')
         
-        return cv2.cvtColor(self.get_source_image().get_nd_image(), cvt_type)
+        # The gray and HSV planes are shared with the other operations through the source image
+        if cvt_type == cv2.COLOR_BGR2GRAY:
+            ret = source.get_gray()
+        else:
+            ret = source.get_hsv()
+        report_progress(progress_callback, 100)
+
+        return self.to_storage_dtype(ret)
 
     
     # Function to detect edges in the image
-    def edge_detection_actions(self, method:str='roberts', threshold1:int=100, threshold2:int=200 ) -> np.ndarray:
-        
-        # Check if the image is in grayscale. If not, convert it to grayscale
-        if self.get_source_image().get_image_channels_type() == 'BGR':
-            img = self.conversion_actions(method='bgr_2_gray')
+    @traced('Image_Operations.edge_detection_actions', 'operation')
+    @cached_operation
+    def edge_detection_actions(self, method:str='roberts', threshold1:int=100, threshold2:int=200, preview_size:tuple=None, progress_callback=None) -> np.ndarray:
+        report_progress(progress_callback, 0)
 
         method = method.replace('_menu', '')
+        source = self.get_operation_source(preview_size)
+
+        # Memory-mapped sources are processed tile by tile into a memory-mapped output
+        if isinstance(source.get_nd_image(), np.memmap) and method in Tiled_Processing.TILE_HALO:
+            return self.to_storage_dtype(Tiled_Processing.run_tiled(source.get_nd_image(), method, output_dtype=self.get_compute_dtype(), progress_callback=progress_callback))
+
+        # The float gray plane is computed once per source and precision, and shared by every filter
+        img = source.get_float_image(self.get_compute_dtype())
+        report_progress(progress_callback, 20)
+
+        def engine_progress(value):
+            report_progress(progress_callback, 20 + value * 70 // 100)
 
-        # Detect edges using the specified method
-        if method == 'edge_roberts':
-            ret = ski.filters.roberts(img)
-        elif method == 'edge_sobel':
-            ret = ski.filters.sobel(img)
-        elif method == 'edge_scharr':
-            ret = ski.filters.scharr(img)
-        elif method == 'edge_prewitt':
-            ret = ski.filters.prewitt(img)
+        # Detect edges using the specified method, all four filters share one pass of the edge engine
+        if method == 'edge_compare_all':
+            planes = Edge_Engine.compute_edges(img, Edge_Engine.EDGE_ENGINE_METHODS, engine_progress)
+            ret = Edge_Engine.make_mosaic(planes, Edge_Engine.EDGE_ENGINE_METHODS)
+        elif method in Edge_Engine.EDGE_ENGINE_METHODS:
+            ret = Edge_Engine.compute_edges(img, [method], engine_progress)[0]
         else:
             raise ValueError('Invalid method for edge detection')
+        report_progress(progress_callback, 100)
     
-        return ret
-    # Function to segment the image
-    def segment_image(self, method:str='multi_otsu', num_classes:int=3) -> np.ndarray:
+        return self.to_storage_dtype(ret)
+
+    # Function to segment the image.
+    # num_classes and color_space are used by multi Otsu, the Chan-Vese methods are two-phase and take iteration and tolerance budgets,
+    # None keeps Segmentation_Engine's defaults
+    @traced('Image_Operations.segment_image', 'operation')
+    @cached_operation
+    def segment_image(self, method:str='multi_otsu', num_classes:int=3, color_space:str='gray', max_num_iter:int=None, tol:float=None, preview_size:tuple=None, progress_callback=None) -> np.ndarray:
+        report_progress(progress_callback, 0)
     
-        # Check if the image is in grayscale. If not, convert it to grayscale
-        if self.get_source_image().get_image_channels_type() == 'BGR':
-            img = self.conversion_actions(method='bgr_2_gray')
+        # The planes and their histograms are computed once per source and shared by every operation
+        source = self.get_operation_source(preview_size)
+        report_progress(progress_callback, 20)
 
         method = method.replace('_menu', '')
 
+        budgets = {name: value for name, value in (('max_num_iter', max_num_iter), ('tol', tol)) if value is not None}
+
+        def engine_progress(value):
+            report_progress(progress_callback, 20 + value * 75 // 100)
+
         # Detect segments using the specified method
         if method == 'segment_multi_otsu':
-            img = ski.filters.threshold_multiotsu(img)
-            img = np.digitize(self.source_image.get_nd_image(), bins=img)
-            ret = np.uint8(img * 255)
-            
-
+            ret = Segmentation_Engine.multi_otsu(source, num_classes, color_space, progress_callback=engine_progress)
         elif method == 'segment_chan_vese':
-            ret = ski.segmentation.chan_vese(img, num_classes)
+            ret = Segmentation_Engine.chan_vese(source, dtype=self.get_compute_dtype(), progress_callback=engine_progress, **budgets)
         elif method == 'segment_moprh_snakes':
-            ret = ski.segmentation.morphological_chan_vese(img, num_classes)
+            ret = Segmentation_Engine.morphological_chan_vese(source, progress_callback=engine_progress, **budgets)
         else:
             raise ValueError('Invalid method for segmentation, method: ', method)
+        report_progress(progress_callback, 100)
         
-        return ret
+        return self.to_storage_dtype(ret)
+
+    # Function to reduce the noise of the image
+    @traced('Image_Operations.denoise_actions', 'operation')
+    @cached_operation
+    def denoise_actions(self, method:str='denoise_gaussian', kernel_size:int=5, preview_size:tuple=None, progress_callback=None) -> np.ndarray:
+        # Both filters need a centered kernel, cv2 raises on even or non-positive sizes
+        if kernel_size < 1 or kernel_size % 2 == 0:
+            raise ValueError('Kernel size must be odd and positive, kernel_size: ', kernel_size)
+
+        report_progress(progress_callback, 0)
+        img = self.get_operation_source(preview_size).get_nd_image()
+
+        method = method.replace('_menu', '')
+
+        if method == 'denoise_gaussian':
+            ret = cv2.GaussianBlur(img, (kernel_size, kernel_size), 0)
+        elif method == 'denoise_median':
+            # cv2.medianBlur supports every kernel size only on 8-bit images
+            ret = cv2.medianBlur(Image(img).get_uint8_image(), kernel_size)
+        else:
+            raise ValueError('Invalid method for denoising, method: ', method)
+        report_progress(progress_callback, 100)
+
+        return self.to_storage_dtype(ret)
         
 if __name__ == '__main__':
     print(" Testing image_operator class: ")    
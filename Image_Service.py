@@ -0,0 +1,714 @@
+import argparse
+import base64
+import hashlib
+import inspect
+import io
+import json
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+import numpy as np
+import cv2
+
+from Image import Image
+from Image_Operations import Image_Operations, OPERATION_METHODS, DTYPE_POLICIES
+from Image_Export import EXPORT_FORMATS, get_encode_params
+from Batch_Processing import init_worker
+
+DEFAULT_PORT = 8765
+
+# Requests waiting for a worker, a request arriving when the queue is full is rejected with 503
+QUEUE_SIZE = 64
+
+# A batch takes the requests already queued when a worker frees up, waiting at most BATCH_WAIT seconds for more.
+# Requests are only batched together up to BATCH_MAX_BYTES of input, a large image runs alone
+BATCH_MAX_SIZE = 16
+BATCH_WAIT = 0.002
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+
+# Seconds a client waits for its result before the request times out with 504
+REQUEST_TIMEOUT = 300
+
+# Response formats besides the image formats, .npy returns the raw output array
+RESPONSE_FORMATS = EXPORT_FORMATS + ['.npy']
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg', '.png': 'image/png', '.bmp': 'image/bmp', '.tiff': 'image/tiff', '.webp': 'image/webp',
+    '.npy': 'application/octet-stream',
+}
+
+# Request bodies a browser cannot send to another origin without a preflight, which the service does not answer.
+# Form and text/plain bodies are refused, so a web page cannot make the service read or write files
+ACCEPTED_CONTENT_TYPES = ('application/json', 'application/octet-stream', 'image/')
+
+# Host names a TCP client may address the service by, other names are refused against DNS rebinding
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Image_Operations method running each family of operations, its signature gives the parameters of the service
+OPERATION_ACTIONS = {
+    'bgr_2_': 'conversion_actions',
+    'edge_': 'edge_detection_actions',
+    'segment_': 'segment_image',
+    'denoise_': 'denoise_actions',
+}
+INTERNAL_PARAMETERS = ('self', 'method', 'preview_size', 'progress_callback')
+
+# Completed requests kept for the latency percentiles, and the window of the recent throughput
+METRICS_SAMPLES = 4096
+THROUGHPUT_WINDOW = 60
+
+# Marks the end of the service in the queue
+_STOP = object()
+
+
+class Service_Busy(Exception):
+    pass
+
+
+########################################### Worker processes ####################################################
+
+# Source loaded by this worker: (source key, Image_Operations). Requests on the same file or payload as the
+# previous one skip the decode and reuse its derived planes and result cache
+_worker_source = None
+
+
+# Function to get the key of a request's source without decoding it: the stat of a file or the hash of a payload
+def get_source_key(task:dict) -> tuple:
+    if task.get('path') is not None:
+        stat = os.stat(task['path'])
+        return 'path', os.path.abspath(task['path']), stat.st_size, stat.st_mtime_ns
+    return 'data', hashlib.blake2b(task['data'], digest_size=16).hexdigest()
+
+
+# Function to get the operator of a request's source in a worker, decoding the source only if it changed
+def get_worker_operator(task:dict, source_key:tuple) -> Image_Operations:
+    global _worker_source
+
+    if _worker_source is None or _worker_source[0] != source_key:
+        _worker_source = None
+        if task.get('path') is not None:
+            img = cv2.imread(task['path'], cv2.IMREAD_COLOR)
+        else:
+            img = cv2.imdecode(np.frombuffer(task['data'], dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('Could not decode image: ' + (task.get('path') or 'payload'))
+        _worker_source = (source_key, Image_Operations(img, dtype_policy=task['dtype_policy']))
+
+    image_operator = _worker_source[1]
+    if image_operator.dtype_policy != task['dtype_policy']:
+        image_operator.set_dtype_policy(task['dtype_policy'])
+    return image_operator
+
+
+# Function to encode an output in a response format
+def encode_output(output:np.ndarray, response_format:str) -> bytes:
+    if response_format == '.npy':
+        buffer = io.BytesIO()
+        np.save(buffer, output, allow_pickle=False)
+        return buffer.getvalue()
+
+    success, buffer = cv2.imencode(response_format, Image(output).get_uint8_image(), get_encode_params(response_format))
+    if not success:
+        raise ValueError('Could not encode image, format: ', response_format)
+    return buffer.tobytes()
+
+
+# Function to run one request in a worker, it returns the encoded output or writes it to the output path
+def run_task(task:dict) -> dict:
+    image_operator = get_worker_operator(task, get_source_key(task))
+    output = image_operator.apply_operation(task['operation'], **task['params'])
+
+    # Conversions return None when the source is already in the requested color space
+    if output is None:
+        output = image_operator.get_source_image().get_nd_image()
+
+    result = {'shape': list(output.shape), 'dtype': output.dtype.str}
+    if task.get('output_path') is not None:
+        Image(output).save_image(task['output_path'])
+        result['output_path'] = task['output_path']
+    else:
+        result['data'] = encode_output(output, task['format'])
+    return result
+
+
+# Function executed in the worker processes, it runs a batch of requests.
+# Requests on the same source run one after the other so that it is decoded once. Every request
+# gets its own result or error, a failing request does not fail the others
+def process_batch(tasks:list) -> list:
+    def get_order_key(index):
+        try:
+            return get_source_key(tasks[index])
+        except OSError:
+            return ()
+
+    results = [None] * len(tasks)
+    for index in sorted(range(len(tasks)), key=get_order_key):
+        start = time.perf_counter()
+        try:
+            results[index] = ('ok', run_task(tasks[index]), time.perf_counter() - start)
+        except (ValueError, TypeError, OSError, cv2.error) as e:
+            # Operations reject invalid arguments with ValueError('message: ', value), cv2 with cv2.error
+            if isinstance(e, ValueError) and len(e.args) > 1:
+                message = str(e.args[0]) + ', '.join(str(arg) for arg in e.args[1:])
+            else:
+                message = str(e)
+            results[index] = ('invalid', message, time.perf_counter() - start)
+        except Exception as e:
+            results[index] = ('error', repr(e), time.perf_counter() - start)
+    return results
+
+
+########################################### Service ####################################################
+
+class Service_Request:
+    """
+    One request in the service queue, its future resolves to the worker's (status, result, compute time)
+    """
+    __slots__ = ('task', 'size', 'future', 'submitted', 'dispatched', 'batch_size')
+
+    def __init__(self, task:dict, size:int):
+        self.task = task
+        self.size = size
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.dispatched = None
+        self.batch_size = 0
+
+
+class Service_Metrics:
+    def __init__(self, samples:int = METRICS_SAMPLES):
+        """
+        Constructor for Service_Metrics class, the counters and latency samples reported by the metrics endpoint
+        :param samples: int - Number of recent requests the latency percentiles are computed over
+        """
+        self.start = time.perf_counter()
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.batched_requests = 0
+
+        # (completion time, total latency, queue time, compute time) of the recent requests
+        self.__samples = deque(maxlen=samples)
+        self.__lock = threading.Lock()
+
+    def record_accepted(self):
+        with self.__lock:
+            self.accepted += 1
+
+    def record_rejected(self):
+        with self.__lock:
+            self.rejected += 1
+
+    def record_batch(self, size:int):
+        with self.__lock:
+            self.batches += 1
+            self.batched_requests += size
+
+    def record_request(self, request:Service_Request, success:bool, compute_time:float):
+        now = time.perf_counter()
+        with self.__lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.__samples.append((now, now - request.submitted, request.dispatched - request.submitted, compute_time))
+
+    def get(self, queue_depth:int = 0, batches_in_flight:int = 0) -> dict:
+        """
+        Function to get a snapshot of the metrics, latencies are in milliseconds
+        :param queue_depth: int - Requests waiting for a worker
+        :param batches_in_flight: int - Batches running in the workers
+        :return: dict
+        """
+        now = time.perf_counter()
+        with self.__lock:
+            samples = np.array(self.__samples, dtype=np.float64).reshape(-1, 4)
+            metrics = {
+                'uptime': now - self.start,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'queue_depth': queue_depth,
+                'batches_in_flight': batches_in_flight,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_requests / self.batches if self.batches else 0.0,
+            }
+
+        recent = samples[samples[:, 0] >= now - THROUGHPUT_WINDOW]
+        window = min(THROUGHPUT_WINDOW, metrics['uptime'])
+        metrics['throughput'] = len(recent) / window if window > 0 else 0.0
+
+        latencies = {}
+        for column, name in ((1, 'total'), (2, 'queue'), (3, 'compute')):
+            values = samples[:, column] * 1000
+            latencies[name] = {
+                'mean': float(values.mean()) if len(values) else 0.0,
+                'p50': float(np.percentile(values, 50)) if len(values) else 0.0,
+                'p95': float(np.percentile(values, 95)) if len(values) else 0.0,
+                'p99': float(np.percentile(values, 99)) if len(values) else 0.0,
+                'max': float(values.max()) if len(values) else 0.0,
+            }
+        metrics['latency_ms'] = latencies
+        return metrics
+
+
+class Image_Service:
+    def __init__(self, workers:int = None, queue_size:int = QUEUE_SIZE, batch_max_size:int = BATCH_MAX_SIZE,
+                 batch_wait:float = BATCH_WAIT, batch_max_bytes:int = BATCH_MAX_BYTES):
+        """
+        Constructor for Image_Service class, runs requests on a pool of warm worker processes.
+        Requests wait in a bounded queue. A dispatcher thread takes them in batches as workers free up, so that
+        concurrent small requests share one round trip to a worker instead of paying one each.
+        :param workers: int - Number of worker processes, None uses the CPU count
+        :param queue_size: int - Requests waiting for a worker, submit raises Service_Busy past it
+        :param batch_max_size: int - Requests per batch
+        :param batch_wait: float - Seconds a batch waits for more requests once it has one
+        :param batch_max_bytes: int - Input bytes per batch, a larger request runs alone
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_max_size = batch_max_size
+        self.batch_wait = batch_wait
+        self.batch_max_bytes = batch_max_bytes
+        self.metrics = Service_Metrics()
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+
+        # The workers are started and their imports resolved before the first request
+        for future in [self.executor.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+        # A batch is only taken when a worker is free, the requests arriving meanwhile wait in the queue
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__slots = threading.Semaphore(self.workers)
+        self.__in_flight = 0
+        self.__lock = threading.Lock()
+
+        # A request taken from the queue that did not fit in the previous batch
+        self.__carried = None
+
+        self.__dispatcher = threading.Thread(target=self.__dispatch, name='image_service_dispatch', daemon=True)
+        self.__dispatcher.start()
+
+    def submit(self, task:dict) -> Service_Request:
+        """
+        Function to queue a request
+        :param task: dict - operation, params, dtype_policy, format, path or data (encoded image bytes), output_path
+        :return: Service_Request - Its future resolves to (status, result, compute time), see process_batch
+        """
+        if task.get('path') is not None:
+            size = os.path.getsize(task['path'])
+        else:
+            size = len(task['data'])
+
+        request = Service_Request(task, size)
+        try:
+            self.__queue.put_nowait(request)
+        except queue.Full:
+            self.metrics.record_rejected()
+            raise Service_Busy('The request queue is full')
+
+        self.metrics.record_accepted()
+        return request
+
+    def get_metrics(self) -> dict:
+        with self.__lock:
+            in_flight = self.__in_flight
+        return self.metrics.get(self.__queue.qsize(), in_flight)
+
+    ########################################### Dispatching ####################################################
+
+    def __take(self, timeout:float = None):
+        if self.__carried is not None:
+            request, self.__carried = self.__carried, None
+            return request
+        if timeout is None:
+            return self.__queue.get()
+        return self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+
+    def __collect(self, first:Service_Request) -> list:
+        batch = [first]
+        size = first.size
+        deadline = time.perf_counter() + self.batch_wait
+
+        while len(batch) < self.batch_max_size and size < self.batch_max_bytes:
+            try:
+                request = self.__take(deadline - time.perf_counter())
+            except queue.Empty:
+                break
+            if request is _STOP or size + request.size > self.batch_max_bytes:
+                self.__carried = request
+                break
+            batch.append(request)
+            size += request.size
+        return batch
+
+    def __dispatch(self):
+        while True:
+            self.__slots.acquire()
+            request = self.__take()
+            if request is _STOP:
+                self.__slots.release()
+                return
+
+            batch = self.__collect(request)
+            now = time.perf_counter()
+            for request in batch:
+                request.dispatched = now
+                request.batch_size = len(batch)
+            self.metrics.record_batch(len(batch))
+
+            with self.__lock:
+                self.__in_flight += 1
+            executor = self.executor
+            try:
+                future = executor.submit(process_batch, [request.task for request in batch])
+            except BaseException as e:
+                self.__finish(batch, e)
+                continue
+            future.add_done_callback(lambda future, batch=batch, executor=executor: self.__batch_done(batch, future, executor))
+
+    def __batch_done(self, batch:list, future:Future, executor:ProcessPoolExecutor):
+        try:
+            results = future.result()
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died, the pool cannot run anything else and is replaced once for all its batches
+                with self.__lock:
+                    if self.executor is executor:
+                        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+            self.__finish(batch, e)
+            return
+
+        for request, result in zip(batch, results):
+            self.metrics.record_request(request, result[0] == 'ok', result[2])
+            request.future.set_result(result)
+        self.__finish(batch)
+
+    def __finish(self, batch:list, error:BaseException = None):
+        if error is not None:
+            for request in batch:
+                self.metrics.record_request(request, False, 0.0)
+                request.future.set_result(('error', repr(error), 0.0))
+
+        with self.__lock:
+            self.__in_flight -= 1
+        self.__slots.release()
+
+    def close(self):
+        """
+        Function to stop taking requests, finish the queued ones and stop the worker processes
+        :return: None
+        """
+        self.__queue.put(_STOP)
+        self.__dispatcher.join()
+        self.executor.shutdown(wait=True)
+
+
+########################################### HTTP ####################################################
+
+# Function to parse a query string value as JSON, plain strings are kept as they are
+def parse_query_value(value:str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+# Function to get the parameters a client may set for an operation, by name: their signature parameter
+def get_operation_parameters(operation:str) -> dict:
+    action = next(action for prefix, action in OPERATION_ACTIONS.items() if operation.startswith(prefix))
+    signature = inspect.signature(getattr(Image_Operations, action))
+    return {name: parameter for name, parameter in signature.parameters.items() if name not in INTERNAL_PARAMETERS}
+
+
+# Function to check the parameters of a request against the signature of its operation
+def validate_parameters(operation:str, params:dict):
+    expected = get_operation_parameters(operation)
+    for name, value in params.items():
+        if name not in expected:
+            raise ValueError('Invalid parameter for {}: {}, expected one of {}'.format(operation, name, ', '.join(expected) or 'none'))
+
+        kind = expected[name].annotation
+        if value is None:
+            valid = expected[name].default is None
+        elif kind is float:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif kind is int:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = kind is inspect.Parameter.empty or isinstance(value, kind)
+        if not valid:
+            raise ValueError('Invalid parameter {}: {!r}, expected {}'.format(name, value, kind.__name__))
+
+
+# Function to resolve a path of a request, it must be inside one of the allowed directories
+def resolve_path(path, roots:list, option:str) -> str:
+    if not roots:
+        raise ValueError('File paths are disabled, start the service with ' + option)
+    if not isinstance(path, str):
+        raise ValueError('Invalid path: {!r}'.format(path))
+
+    real_path = os.path.realpath(path)
+    if not any(os.path.commonpath([real_path, root]) == root for root in roots):
+        raise ValueError('Path outside of the allowed directories: ' + path)
+    return real_path
+
+
+# Function to validate a request and fill in its defaults, it raises ValueError with the message returned to the client.
+# Paths are only accepted inside read_roots, output paths inside write_roots
+def make_task(task:dict, read_roots:list = None, write_roots:list = None) -> dict:
+    operation = str(task.get('operation', '')).replace('_menu', '')
+    if operation not in OPERATION_METHODS:
+        raise ValueError('Invalid operation: {}, expected one of {}'.format(operation, ', '.join(OPERATION_METHODS)))
+
+    dtype_policy = task.get('dtype_policy') or 'float64'
+    if dtype_policy not in DTYPE_POLICIES:
+        raise ValueError('Invalid dtype policy: {}, expected one of {}'.format(dtype_policy, ', '.join(DTYPE_POLICIES)))
+
+    response_format = (task.get('format') or '.png').lower()
+    response_format = response_format if response_format.startswith('.') else '.' + response_format
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError('Invalid format: {}, expected one of {}'.format(response_format, ', '.join(RESPONSE_FORMATS)))
+
+    params = task.get('params') or {}
+    if not isinstance(params, dict):
+        raise ValueError('Invalid params, expected an object')
+    validate_parameters(operation, params)
+
+    if (task.get('path') is None) == (task.get('data') is None):
+        raise ValueError('A request needs either a path or an image payload')
+
+    path = task.get('path')
+    if path is not None:
+        path = resolve_path(path, read_roots, '--read-root')
+        if not os.path.isfile(path):
+            raise ValueError('No such file: ' + task['path'])
+
+    output_path = task.get('output_path')
+    if output_path is not None:
+        output_path = resolve_path(output_path, write_roots, '--write-root')
+        if os.path.splitext(output_path)[1].lower() not in EXPORT_FORMATS:
+            raise ValueError('Invalid output format: {}, expected one of {}'.format(output_path, ', '.join(EXPORT_FORMATS)))
+
+    return {
+        'operation': operation, 'params': params, 'dtype_policy': dtype_policy, 'format': response_format,
+        'path': path, 'data': task.get('data'), 'output_path': output_path,
+    }
+
+
+class Service_Handler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of an Image_Service:
+    - POST /process - JSON body with operation, params, dtype_policy, format and either path or image (base64),
+      or an encoded image as the body (application/octet-stream or image/*) with the operation as /process/<operation>
+      and the rest in the query string. Returns the output encoded in format, or JSON if output_path is given.
+      Paths are only accepted inside the directories the service was started with
+    - GET /metrics - JSON counters, queue depth, batch sizes, throughput and latency percentiles
+    - GET /health
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # Unix socket clients have no address
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+    def send_json(self, status:int, body:dict, headers:dict = None):
+        self.send_body(status, json.dumps(body).encode(), 'application/json', headers)
+
+    def send_body(self, status:int, body:bytes, content_type:str, headers:dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Function to refuse a request addressed by a non-local host name, a page of another site resolving its own
+    # name to 127.0.0.1 would otherwise be same-origin with the service
+    def check_host(self) -> bool:
+        if not isinstance(self.client_address, tuple):
+            return True
+
+        host = self.headers.get('Host', '')
+        hostname = host[1:host.index(']')] if host.startswith('[') and ']' in host else host.rsplit(':', 1)[0]
+        if hostname in LOCAL_HOSTS or hostname == self.server.server_address[0]:
+            return True
+
+        self.send_json(403, {'error': 'Invalid host: ' + host})
+        return False
+
+    def do_GET(self):
+        if not self.check_host():
+            return
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self.send_json(200, self.server.service.get_metrics())
+        elif path == '/health':
+            self.send_json(200, {'status': 'ok', 'operations': OPERATION_METHODS})
+        else:
+            self.send_json(404, {'error': 'Not found: ' + path})
+
+    def read_task(self) -> dict:
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        read_roots, write_roots = self.server.read_roots, self.server.write_roots
+
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(ACCEPTED_CONTENT_TYPES):
+            raise ValueError('Invalid content type: {}, expected application/json, application/octet-stream or image/*'.format(content_type or 'none'))
+
+        if content_type == 'application/json':
+            try:
+                task = json.loads(body or b'{}')
+            except ValueError as e:
+                raise ValueError('Invalid JSON: ' + str(e))
+            if not isinstance(task, dict):
+                raise ValueError('Invalid request, expected an object')
+            if task.get('image') is not None:
+                task['data'] = base64.b64decode(task.pop('image'))
+            return make_task(task, read_roots, write_roots)
+
+        # Raw image body, e.g. curl -H "Content-Type: image/png" --data-binary @image.png "localhost:8765/process/edge_sobel?format=jpg"
+        query = dict(parse_qsl(url.query))
+        task = {
+            'operation': url.path[len('/process/'):],
+            'dtype_policy': query.pop('dtype_policy', None), 'format': query.pop('format', None),
+            'output_path': query.pop('output_path', None), 'path': query.pop('path', None),
+            'data': body or None,
+        }
+        task['params'] = {name: parse_query_value(value) for name, value in query.items()}
+        return make_task(task, read_roots, write_roots)
+
+    def do_POST(self):
+        if not self.check_host():
+            return
+        url = urlparse(self.path)
+        if url.path != '/process' and not url.path.startswith('/process/'):
+            self.send_json(404, {'error': 'Not found: ' + url.path})
+            return
+
+        try:
+            task = self.read_task()
+            request = self.server.service.submit(task)
+        except Service_Busy as e:
+            self.send_json(503, {'error': str(e)}, {'Retry-After': '1'})
+            return
+        except (ValueError, TypeError, OSError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            status, result, compute_time = request.future.result(timeout=self.server.request_timeout)
+        except TimeoutError:
+            self.send_json(504, {'error': 'Timed out waiting for the result'})
+            return
+
+        if status != 'ok':
+            self.send_json(400 if status == 'invalid' else 500, {'error': result})
+            return
+
+        headers = {
+            'X-Queue-Time': '{:.1f}'.format((request.dispatched - request.submitted) * 1000),
+            'X-Compute-Time': '{:.1f}'.format(compute_time * 1000),
+            'X-Batch-Size': str(request.batch_size),
+        }
+        if 'data' in result:
+            self.send_body(200, result['data'], CONTENT_TYPES[task['format']], headers)
+        else:
+            self.send_json(200, result, headers)
+
+
+# Connections not yet accepted, socketserver's default of 5 resets bursts of concurrent clients
+LISTEN_BACKLOG = 128
+
+
+class Service_HTTP_Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class Service_Unix_Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+# Function to create the server of a service, on a Unix socket if socket_path is given, else on host:port
+# Requests may read files inside read_roots and write outputs inside write_roots, no roots disables file paths
+def create_server(service:Image_Service, host:str = '127.0.0.1', port:int = DEFAULT_PORT, socket_path:str = None,
+                  request_timeout:float = REQUEST_TIMEOUT, log_requests:bool = False, read_roots:list = None, write_roots:list = None):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = Service_Unix_Server(socket_path, Service_Handler)
+    else:
+        server = Service_HTTP_Server((host, port), Service_Handler)
+
+    server.service = service
+    server.request_timeout = request_timeout
+    server.log_requests = log_requests
+    server.read_roots = [os.path.realpath(root) for root in read_roots or []]
+    server.write_roots = [os.path.realpath(root) for root in write_roots or []]
+    return server
+
+
+def main(argv:list = None) -> int:
+    parser = argparse.ArgumentParser(prog='serve', description='Serve the image operations over HTTP on localhost or a Unix socket')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on (default: {})'.format(DEFAULT_PORT))
+    parser.add_argument('--socket', dest='socket_path', default=None, help='Unix socket to listen on instead of a port')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=QUEUE_SIZE, help='Requests waiting for a worker before new ones are rejected')
+    parser.add_argument('--batch-size', dest='batch_max_size', type=int, default=BATCH_MAX_SIZE, help='Requests per batch')
+    parser.add_argument('--batch-wait', dest='batch_wait', type=float, default=BATCH_WAIT * 1000, help='Milliseconds a batch waits for more requests')
+    parser.add_argument('--read-root', dest='read_roots', action='append', default=[], help='Directory requests may read images from by path, repeatable (default: none, payloads only)')
+    parser.add_argument('--write-root', dest='write_roots', action='append', default=[], help='Directory requests may write outputs to, repeatable (default: none, outputs are returned)')
+    parser.add_argument('--log-requests', dest='log_requests', action='store_true', help='Log every request to stderr')
+    args = parser.parse_args(argv)
+
+    if args.queue_size < 1 or args.batch_max_size < 1:
+        parser.error('--queue-size and --batch-size must be at least 1')
+
+    service = Image_Service(args.workers, args.queue_size, args.batch_max_size, args.batch_wait / 1000)
+    server = create_server(service, args.host, args.port, args.socket_path, log_requests=args.log_requests,
+                           read_roots=args.read_roots, write_roots=args.write_roots)
+
+    print('Serving {} operations with {} workers on {}'.format(
+        len(OPERATION_METHODS), service.workers, args.socket_path or 'http://{}:{}'.format(args.host, args.port)))
+    sys.stdout.flush()
+
+    # A service stopped by its supervisor finishes the queued requests like on Ctrl+C
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket_path is not None and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
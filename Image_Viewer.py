@@ -0,0 +1,313 @@
+import math
+from contextlib import contextmanager
+
+import numpy as np
+import cv2
+
+from PyQt5 import QtWidgets
+from PyQt5.QtGui import QImage, QPainter, QTransform
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal
+from PyQt5 import sip
+
+from Image import Image
+from Result_Cache import Result_Cache
+from Tracing import trace_span
+
+# Tiles are TILE_SIZE x TILE_SIZE pixels of a pyramid level
+TILE_SIZE = 256
+
+# Memory budget of the tiles of one viewer
+TILE_CACHE_BYTES = 128 * 1024 * 1024
+
+# Zoom per wheel notch, and the zoom range relative to the fitted view and to 1:1
+ZOOM_STEP = 1.25
+MIN_ZOOM_OF_FIT = 0.5
+MAX_ZOOM = 32
+
+
+class Tile_Pyramid:
+    """
+    Multi-resolution tiles of an image. The levels are the image's own pyramid (Image.get_pyramid_image),
+    computed once per level on first use, and tiles are cut from a level and converted to the display
+    format only when they are drawn
+    """
+    def __init__(self, image:Image, tile_cache:Result_Cache, generation:int):
+        # Levels are built from the 8-bit image, bool and integer masks cannot be downsampled by cv2.pyrDown
+        if image.get_nd_image().dtype != np.uint8:
+            image = Image(image.get_uint8_image())
+        self.image = image
+        self.tile_cache = tile_cache
+        self.generation = generation
+
+        self.height, self.width = image.get_nd_image().shape[:2]
+
+        # The coarsest level is the first one that fits in a single tile
+        self.max_level = 0
+        width, height = self.width, self.height
+        while width > TILE_SIZE or height > TILE_SIZE:
+            width, height = (width + 1) // 2, (height + 1) // 2
+            self.max_level += 1
+
+    def get_level_size(self, level:int) -> tuple:
+        width, height = self.width, self.height
+        for _ in range(level):
+            width, height = (width + 1) // 2, (height + 1) // 2
+        return width, height
+
+    def get_level(self, downscale:float) -> int:
+        """
+        Function to get the level drawn at a zoom, the coarsest one that still has a pixel per displayed pixel
+        :param downscale: float - Image pixels per displayed pixel
+        :return: int
+        """
+        if downscale <= 1:
+            return 0
+        return min(int(math.floor(math.log2(downscale))), self.max_level)
+
+    def get_tile(self, level:int, tx:int, ty:int) -> np.ndarray:
+        """
+        Function to get a tile as BGRA pixels, the memory layout of QImage.Format_RGB32
+        :param level: int
+        :param tx: int - Tile column
+        :param ty: int - Tile row
+        :return: np.ndarray - Read-only, shared with the tile cache
+        """
+        key = (self.generation, level, tx, ty)
+        tile = self.tile_cache.get(key)
+        if tile is None:
+            img = self.image.get_pyramid_image(level).get_nd_image()
+            crop = img[ty * TILE_SIZE:(ty + 1) * TILE_SIZE, tx * TILE_SIZE:(tx + 1) * TILE_SIZE]
+            tile = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGRA if crop.ndim == 2 else cv2.COLOR_BGR2BGRA)
+            self.tile_cache.put(key, tile)
+        return tile
+
+
+# Function to wrap a BGRA tile in a QImage without copying it, the tile must outlive the QImage
+def get_tile_qimage(tile:np.ndarray) -> QImage:
+    h, w = tile.shape[:2]
+    return QImage(sip.voidptr(tile.ctypes.data), w, h, tile.strides[0], QImage.Format_RGB32)
+
+
+class Image_Viewer(QtWidgets.QGraphicsView):
+    """
+    Zoomable and pannable view of an image, drawn from the tiles of a Tile_Pyramid.
+    Only the tiles of the exposed area are drawn, at the level matching the zoom, so panning a large
+    image only converts the tiles scrolled into view. Scene coordinates are display pixels of the image:
+    an image shown with a scale (e.g. a preview proxy) covers the same area as the full resolution one.
+    Linked viewers follow each other's zoom and pan, see link_viewers.
+    """
+    view_changed = pyqtSignal()
+
+    def __init__(self, parent=None, tile_cache_bytes:int = TILE_CACHE_BYTES):
+        super().__init__(parent)
+        self.setScene(QtWidgets.QGraphicsScene(self))
+        self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
+        self.setResizeAnchor(QtWidgets.QGraphicsView.AnchorViewCenter)
+        self.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+        self.setViewportUpdateMode(QtWidgets.QGraphicsView.MinimalViewportUpdate)
+        self.setOptimizationFlag(QtWidgets.QGraphicsView.DontSavePainterState, True)
+        self.setFrameShape(QtWidgets.QFrame.NoFrame)
+
+        self.tile_cache = Result_Cache(max_bytes=tile_cache_bytes)
+        self.pyramid = None
+        self.image = None
+        self.image_scale = 1.0
+
+        # Generations key the tiles, the tiles of a replaced image are evicted as new ones are cached
+        self.__generation = 0
+
+        # A fitted view fits again when resized, zooming or panning leaves it
+        self.fitted = True
+
+        # Viewers following each other, and whether a change is being propagated
+        self.__linked = [self]
+        self.__sync = {'active': False}
+
+        self.horizontalScrollBar().valueChanged.connect(self.__emit_view_changed)
+        self.verticalScrollBar().valueChanged.connect(self.__emit_view_changed)
+
+    ########################################### Image ####################################################
+
+    def set_image(self, image:Image, scale:float = 1.0):
+        """
+        Function to show an image. The zoom and pan are kept if it covers the same area as the previous one,
+        so that consecutive outputs can be compared at the same place, otherwise the view is fitted
+        :param image: Image
+        :param scale: float - Display pixels per image pixel, e.g. the downscale of a preview proxy
+        :return: None
+        """
+        if image is not self.image or scale != self.image_scale:
+            self.__generation += 1
+            self.image = image
+            self.image_scale = scale
+            self.pyramid = Tile_Pyramid(image, self.tile_cache, self.__generation)
+
+        rect = QRectF(0, 0, self.pyramid.width * scale, self.pyramid.height * scale)
+        resized = rect != self.sceneRect()
+        with self.__unsynced():
+            self.setSceneRect(rect)
+
+        if resized or self.fitted:
+            self.fit()
+        self.viewport().update()
+
+    def clear(self):
+        self.image = None
+        self.pyramid = None
+        self.tile_cache.clear()
+        with self.__unsynced():
+            self.setSceneRect(QRectF())
+        self.fitted = True
+        self.viewport().update()
+
+    def get_zoom(self) -> float:
+        return self.transform().m11()
+
+    def get_display_size(self) -> tuple:
+        """
+        Function to get the size the whole image is displayed at with the current zoom
+        :return: tuple - (width, height), the viewport size if there is no image
+        """
+        if self.pyramid is None:
+            return self.viewport().width(), self.viewport().height()
+        rect = self.sceneRect()
+        return max(int(rect.width() * self.get_zoom()), 1), max(int(rect.height() * self.get_zoom()), 1)
+
+    ########################################### Drawing ####################################################
+
+    def drawBackground(self, painter:QPainter, rect:QRectF):
+        super().drawBackground(painter, rect)
+        if self.pyramid is None:
+            return
+
+        rect = rect.intersected(self.sceneRect())
+        if rect.isEmpty():
+            return
+
+        with trace_span("Image_Viewer.draw_tiles", "display"):
+            zoom = self.get_zoom() * self.image_scale
+            level = self.pyramid.get_level(1 / zoom)
+            level_width, level_height = self.pyramid.get_level_size(level)
+
+            # Scene units per level pixel, on each axis
+            fx = self.sceneRect().width() / level_width
+            fy = self.sceneRect().height() / level_height
+
+            # Downscaled pixels are filtered, magnified full resolution pixels are shown as blocks to inspect them
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, level > 0 or zoom < 1)
+
+            x0, x1 = int(rect.left() // (TILE_SIZE * fx)), int(math.ceil(rect.right() / (TILE_SIZE * fx)))
+            y0, y1 = int(rect.top() // (TILE_SIZE * fy)), int(math.ceil(rect.bottom() / (TILE_SIZE * fy)))
+            for ty in range(max(y0, 0), min(y1, math.ceil(level_height / TILE_SIZE))):
+                for tx in range(max(x0, 0), min(x1, math.ceil(level_width / TILE_SIZE))):
+                    tile = self.pyramid.get_tile(level, tx, ty)
+                    target = QRectF(tx * TILE_SIZE * fx, ty * TILE_SIZE * fy, tile.shape[1] * fx, tile.shape[0] * fy)
+                    painter.drawImage(target, get_tile_qimage(tile))
+
+    ########################################### Zoom and pan ####################################################
+
+    def fit(self):
+        """
+        Function to fit the whole image in the view keeping its aspect ratio. Fitting is not propagated to linked viewers
+        :return: None
+        """
+        if self.sceneRect().isEmpty():
+            return
+
+        with self.__unsynced():
+            self.fitInView(self.sceneRect(), Qt.KeepAspectRatio)
+        self.fitted = True
+
+    def zoom_to(self, zoom:float):
+        """
+        Function to set the zoom around the anchor, clamped between half the fitted zoom and MAX_ZOOM
+        :param zoom: float - Display pixels per scene unit
+        :return: None
+        """
+        if self.sceneRect().isEmpty():
+            return
+
+        rect = self.sceneRect()
+        fit_zoom = min(self.viewport().width() / rect.width(), self.viewport().height() / rect.height())
+        zoom = min(max(zoom, min(fit_zoom, 1) * MIN_ZOOM_OF_FIT), MAX_ZOOM)
+
+        self.setTransform(QTransform.fromScale(zoom, zoom))
+        self.fitted = False
+        self.__emit_view_changed()
+
+    def wheelEvent(self, event):
+        self.zoom_to(self.get_zoom() * ZOOM_STEP ** (event.angleDelta().y() / 120))
+
+    def mouseDoubleClickEvent(self, event):
+        # Toggles between the fitted view and 1:1 around the cursor
+        if self.fitted:
+            self.zoom_to(1.0)
+        else:
+            self.fit()
+            self.__emit_view_changed()
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key_Plus, Qt.Key_Equal):
+            self.zoom_to(self.get_zoom() * ZOOM_STEP)
+        elif event.key() == Qt.Key_Minus:
+            self.zoom_to(self.get_zoom() / ZOOM_STEP)
+        elif event.key() == Qt.Key_1:
+            self.zoom_to(1.0)
+        elif event.key() == Qt.Key_0:
+            self.fit()
+            self.__emit_view_changed()
+        else:
+            super().keyPressEvent(event)
+
+    def resizeEvent(self, event):
+        with self.__unsynced():
+            super().resizeEvent(event)
+        if self.fitted:
+            self.fit()
+
+    ########################################### Linking ####################################################
+
+    # Context in which changes of the view are neither propagated nor taken as user changes
+    @contextmanager
+    def __unsynced(self):
+        active, self.__sync['active'] = self.__sync['active'], True
+        try:
+            yield
+        finally:
+            self.__sync['active'] = active
+
+    def __emit_view_changed(self, *args):
+        if self.__sync['active']:
+            return
+
+        # A pan or zoom by the user leaves the fitted view
+        if args:
+            self.fitted = False
+
+        with self.__unsynced():
+            for viewer in self.__linked:
+                if viewer is not self:
+                    viewer.follow(self)
+        self.view_changed.emit()
+
+    def follow(self, other:'Image_Viewer'):
+        """
+        Function to take the zoom and the center of another viewer
+        :param other: Image_Viewer
+        :return: None
+        """
+        self.setTransform(other.transform())
+        self.centerOn(other.mapToScene(other.viewport().rect().center()))
+        self.fitted = other.fitted
+
+    def link(self, other:'Image_Viewer'):
+        linked = self.__linked + [viewer for viewer in other.__linked if viewer not in self.__linked]
+        for viewer in linked:
+            viewer.__linked = linked
+            viewer.__sync = self.__sync
+
+
+# Function to make viewers follow each other's zoom and pan
+def link_viewers(*viewers):
+    for viewer in viewers[1:]:
+        viewers[0].link(viewer)
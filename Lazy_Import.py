@@ -0,0 +1,24 @@
+import importlib
+
+
+class Lazy_Module:
+    def __init__(self, name:str):
+        """
+        Constructor for Lazy_Module class, a stand-in for a package whose submodules are imported on first use.
+        ski = Lazy_Module('skimage') makes ski.filters import skimage.filters only when it is first accessed.
+        :param name: str - Package name
+        """
+        self.__name = name
+
+    def __getattr__(self, attribute:str):
+        try:
+            value = importlib.import_module(self.__name + '.' + attribute)
+        except ModuleNotFoundError as e:
+            # Not a submodule, e.g. a function of the package itself
+            if e.name != self.__name + '.' + attribute:
+                raise
+            value = getattr(importlib.import_module(self.__name), attribute)
+
+        # Cache the resolved attribute, __getattr__ is not called again for it
+        setattr(self, attribute, value)
+        return value
@@ -0,0 +1,135 @@
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class Operation_Cancelled(Exception):
+    """
+    Raised inside a running operation when the user cancels it
+    """
+
+
+class Worker_Signals(QObject):
+    """
+    Signals emitted by an Operation_Worker. QRunnable is not a QObject, so the
+    signals live on a separate object and are delivered to the GUI thread.
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+
+class Operation_Worker(QRunnable):
+    def __init__(self, function, *args, **kwargs):
+        """
+        Constructor for Operation_Worker class
+        :param function: callable - The operation to run, it must accept a progress_callback keyword
+        :param args: positional arguments for the operation
+        :param kwargs: keyword arguments for the operation
+        """
+        super().__init__()
+
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+        self.signals = Worker_Signals()
+        self.__cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Function to request cancellation, the operation stops at its next progress report
+        :return: None
+        """
+        self.__cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.__cancel_event.is_set()
+
+    def report_progress(self, value:int):
+        """
+        Progress callback handed to the operation
+        :param value: int - Progress in percent (0-100)
+        :return: None
+        """
+        if self.is_cancelled():
+            raise Operation_Cancelled()
+
+        self.signals.progress.emit(int(value))
+
+    def run(self):
+        try:
+            result = self.function(*self.args, progress_callback=self.report_progress, **self.kwargs)
+        except Operation_Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.error.emit(e)
+        else:
+            # The operation may finish between the cancel request and its last progress report
+            if self.is_cancelled():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+
+class Operation_Runner:
+    def __init__(self, max_thread_count:int = None):
+        """
+        Constructor for Operation_Runner class. Runs one operation at a time on a QThreadPool,
+        starting a new operation cancels the previous one.
+        :param max_thread_count: int - Maximum number of worker threads, None keeps the Qt default
+        """
+        self.thread_pool = QThreadPool()
+        if max_thread_count is not None:
+            self.thread_pool.setMaxThreadCount(max_thread_count)
+
+        self.current_worker = None
+
+    def submit(self, function, *args, on_progress=None, on_finished=None, on_error=None, on_cancelled=None, **kwargs) -> Operation_Worker:
+        """
+        Function to run an operation in the background
+        :param function: callable - The operation to run
+        :param on_progress: callable(int) - Called on the GUI thread with the progress
+        :param on_finished: callable(object) - Called on the GUI thread with the result
+        :param on_error: callable(Exception) - Called on the GUI thread if the operation fails
+        :param on_cancelled: callable() - Called on the GUI thread if the operation was cancelled
+        :return: Operation_Worker
+        """
+        self.cancel()
+
+        worker = Operation_Worker(function, *args, **kwargs)
+
+        # Results of a superseded worker are dropped, only the current one reaches the callbacks
+        def is_current():
+            return worker is self.current_worker
+
+        def finish(callback, *values):
+            if is_current():
+                self.current_worker = None
+            if callback is not None:
+                callback(*values)
+
+        if on_progress is not None:
+            worker.signals.progress.connect(lambda value: is_current() and on_progress(value))
+        worker.signals.finished.connect(lambda result: is_current() and finish(on_finished, result))
+        worker.signals.error.connect(lambda error: is_current() and finish(on_error, error))
+        worker.signals.cancelled.connect(lambda: is_current() and finish(on_cancelled))
+
+        self.current_worker = worker
+        self.thread_pool.start(worker)
+
+        return worker
+
+    def cancel(self):
+        """
+        Function to cancel the running operation, if any
+        :return: None
+        """
+        if self.current_worker is not None:
+            self.current_worker.cancel()
+
+    def is_running(self) -> bool:
+        return self.current_worker is not None
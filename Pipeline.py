@@ -0,0 +1,150 @@
+import json
+
+import numpy as np
+
+from Image import Image
+from Image_Operations import Image_Operations, OPERATION_METHODS, DTYPE_POLICIES
+
+
+class Pipeline_Step:
+    def __init__(self, method:str, params:dict = None):
+        """
+        Constructor for Pipeline_Step class, one operation of a pipeline
+        :param method: str - Operation name, see Image_Operations.OPERATION_METHODS
+        :param params: dict - Keyword arguments of the operation
+        """
+        method = method.replace('_menu', '')
+        if method not in OPERATION_METHODS:
+            raise ValueError('Invalid method for pipeline step, method: ', method)
+
+        self.method = method
+        self.params = dict(params or {})
+
+        # Memoized output and the hash of the input it was computed from
+        self.output = None
+        self.input_hash = None
+
+    def invalidate(self):
+        self.output = None
+        self.input_hash = None
+
+    def to_dict(self) -> dict:
+        return {'method': self.method, 'params': self.params}
+
+
+class Pipeline:
+    def __init__(self, steps:list = None, dtype_policy:str = 'float64'):
+        """
+        Constructor for Pipeline class, a chain of operations evaluated lazily.
+        Each step's output is memoized with the hash of its input, so changing a step re-runs only
+        that step and the steps after it whose input actually changed.
+        :param steps: list of Pipeline_Step
+        :param dtype_policy: str - Precision of every step, see Image_Operations.DTYPE_POLICIES
+        """
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError('Invalid dtype policy, dtype_policy: ', dtype_policy)
+
+        self.steps = list(steps or [])
+        self.dtype_policy = dtype_policy
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    ########################################### Building ####################################################
+
+    def add_step(self, method:str, **params) -> int:
+        """
+        Function to append an operation, nothing is computed until run is called
+        :param method: str - Operation name
+        :param params: Keyword arguments of the operation
+        :return: int - Index of the new step
+        """
+        self.steps.append(Pipeline_Step(method, params))
+        return len(self.steps) - 1
+
+    def set_params(self, index:int, **params):
+        """
+        Function to change the parameters of a step. Only that step is invalidated, the steps after it
+        re-run when the pipeline is evaluated because their input hash changes.
+        :param index: int
+        :param params: Keyword arguments to update
+        :return: None
+        """
+        step = self.steps[index]
+        if all(step.params.get(name) == value for name, value in params.items()):
+            return
+
+        step.params.update(params)
+        step.invalidate()
+
+    def remove_step(self, index:int):
+        # The next step sees a different input hash and re-runs on its own
+        del self.steps[index]
+
+    def set_dtype_policy(self, dtype_policy:str):
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError('Invalid dtype policy, dtype_policy: ', dtype_policy)
+
+        # Every memoized output was computed with the previous precision
+        if dtype_policy != self.dtype_policy:
+            self.dtype_policy = dtype_policy
+            self.invalidate()
+
+    def invalidate(self, index:int = 0):
+        """
+        Function to drop the memoized outputs from a step onwards
+        :param index: int
+        :return: None
+        """
+        for step in self.steps[index:]:
+            step.invalidate()
+
+    ########################################### Evaluation ####################################################
+
+    def run(self, source, until:int = None, progress_callback=None) -> np.ndarray:
+        """
+        Function to evaluate the pipeline, reusing every memoized output that is still valid
+        :param source: np.ndarray, str or Image - Input of the first step
+        :param until: int - Index of the last step to evaluate, None evaluates all of them
+        :param progress_callback: callable(int) - Called with the progress in percent after each step
+        :return: np.ndarray - Output of the last evaluated step
+        """
+        image = source if isinstance(source, Image) else Image(source)
+        steps = self.steps if until is None else self.steps[:until + 1]
+
+        image_operator = Image_Operations(dtype_policy=self.dtype_policy)
+        for index, step in enumerate(steps):
+            input_hash = image.get_hash()
+
+            if step.output is None or step.input_hash != input_hash:
+                image_operator.set_source_image(image)
+                output = image_operator.apply_operation(step.method, **step.params)
+
+                # Conversions return None when the input is already in the requested color space
+                step.output = Image(output) if output is not None else image
+                step.input_hash = input_hash
+
+            image = step.output
+
+            if progress_callback is not None:
+                progress_callback(100 * (index + 1) // len(steps))
+
+        return image.get_nd_image()
+
+    ########################################### Serialization ####################################################
+
+    def to_dict(self) -> dict:
+        return {'steps': [step.to_dict() for step in self.steps], 'dtype_policy': self.dtype_policy}
+
+    @classmethod
+    def from_dict(cls, data:dict) -> 'Pipeline':
+        return cls([Pipeline_Step(step['method'], step.get('params')) for step in data['steps']], data.get('dtype_policy', 'float64'))
+
+    def save(self, path:str):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+    @classmethod
+    def load(cls, path:str) -> 'Pipeline':
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
@@ -0,0 +1,118 @@
+import inspect
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+
+
+class Result_Cache:
+    def __init__(self, max_bytes:int = 256 * 1024 * 1024):
+        """
+        Constructor for Result_Cache class, a thread-safe LRU cache of operation results with a byte budget
+        :param max_bytes: int - Memory budget of the cached results
+        """
+        self.max_bytes = max_bytes
+
+        self.__entries = OrderedDict()
+        self.__memory_size = 0
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key):
+        """
+        Function to get a cached result and mark it as recently used
+        :param key: hashable
+        :return: np.ndarray or None on a miss
+        """
+        with self.__lock:
+            if key not in self.__entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+
+    def put(self, key, value:np.ndarray):
+        """
+        Function to add a result, evicting the least recently used ones past the budget
+        :param key: hashable
+        :param value: np.ndarray
+        :return: None
+        """
+        # Results larger than the whole budget are not cached
+        if value.nbytes > self.max_bytes:
+            return
+
+        # Cached arrays are shared between callers, so they are made read-only
+        value.setflags(write=False)
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__memory_size -= self.__entries.pop(key).nbytes
+
+            self.__entries[key] = value
+            self.__memory_size += value.nbytes
+
+            while self.__memory_size > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__memory_size -= evicted.nbytes
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__memory_size = 0
+
+    def get_stats(self) -> dict:
+        with self.__lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.__entries),
+                'memory_size': self.__memory_size,
+            }
+
+
+def cached_operation(func):
+    """
+    Decorator for Image_Operations methods. Results are cached by the hash of the pixels the operation runs on
+    (the source or its preview proxy), the method name and the parameters with their defaults applied.
+    """
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(self, *args, progress_callback=None, **kwargs):
+        # A zero budget caches nothing, the pixels are not even hashed (e.g. the frames of a video)
+        if self.result_cache.max_bytes == 0:
+            return func(self, *args, progress_callback=progress_callback, **kwargs)
+
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        arguments.arguments['method'] = arguments.arguments['method'].replace('_menu', '')
+        arguments.arguments['progress_callback'] = progress_callback
+
+        # The preview size only selects the pyramid level, which is already covered by the pixel hash
+        source = self.get_operation_source(arguments.arguments['preview_size'])
+        params = tuple((name, value) for name, value in arguments.arguments.items() if name not in ('self', 'preview_size', 'progress_callback'))
+        key = (source.get_hash(), func.__name__, params)
+
+        ret = self.result_cache.get(key)
+        if ret is not None:
+            if progress_callback is not None:
+                progress_callback(100)
+            return ret
+
+        ret = func(*arguments.args, **arguments.kwargs)
+
+        # Conversions return None when the source is already in the requested color space
+        if isinstance(ret, np.ndarray):
+            self.result_cache.put(key, ret)
+
+        return ret
+    return wrapper
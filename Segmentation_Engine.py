@@ -0,0 +1,241 @@
+import time
+
+import numpy as np
+import cv2
+
+from Image import Image
+from Lazy_Import import Lazy_Module
+
+# skimage submodules are imported on the first segmentation
+ski = Lazy_Module('skimage')
+
+# The coarsest pyramid level solved is the smallest one still covering COARSE_SIZE x COARSE_SIZE
+COARSE_SIZE = 256
+
+# chan_vese has no callback, it is called in chunks of iterations resuming from the previous level set.
+# The first chunk of a level is sized by pixels, the next ones by the measured time per iteration,
+# so that every call runs about CHUNK_SECONDS: progress and cancellation stay responsive on large levels
+# without paying skimage's setup on every iteration
+CHUNK_PIXELS = 1024 * 1024
+CHUNK_SECONDS = 0.25
+
+
+MULTI_OTSU_COLOR_SPACES = ['gray', 'bgr', 'hsv']
+
+
+class _Converged(Exception):
+    def __init__(self, level_set:np.ndarray):
+        super().__init__()
+        self.level_set = level_set
+
+
+# Function to get the pyramid levels to solve, coarsest first.
+# Every level is an Image, so the downsampled planes are shared with the preview and the other operations
+def get_levels(source:Image, coarse_size:int = COARSE_SIZE) -> list:
+    coarsest = source.get_pyramid_level(coarse_size, coarse_size)
+    return [source.get_pyramid_image(level) for level in range(coarsest, -1, -1)]
+
+
+# Function to upsample the level set of the previous level as the initialization of the next one
+def upsample_level_set(level_set:np.ndarray, shape:tuple, interpolation:int) -> np.ndarray:
+    return cv2.resize(level_set, (shape[1], shape[0]), interpolation=interpolation)
+
+
+# Function to build the lookup table mapping every uint8 value to its class, scaled evenly over 0-255
+def get_label_lut(thresholds:np.ndarray, num_classes:int) -> np.ndarray:
+    labels = np.digitize(np.arange(256), bins=thresholds)
+    return (labels * 255 // (num_classes - 1)).astype(np.uint8)
+
+
+def multi_otsu(source:Image, num_classes:int = 3, color_space:str = 'gray', progress_callback=None) -> np.ndarray:
+    """
+    Function to segment the image in num_classes with multi-level Otsu thresholds.
+    The thresholds are derived from the histogram of every plane, which the source computes once and caches,
+    and the classes are applied in a single pass through a uint8 lookup table.
+    :param source: Image
+    :param num_classes: int - Number of classes per plane, at least 2
+    :param color_space: str - 'gray' segments the gray plane, 'bgr' and 'hsv' segment each plane separately
+    :param progress_callback: callable(int) - Called with the progress in percent
+    :return: np.ndarray - uint8 label map with the classes at 0, 255 / (num_classes - 1), ..., 255
+    """
+    if num_classes < 2:
+        raise ValueError('Multi Otsu needs at least 2 classes, num_classes: ', num_classes)
+    if color_space not in MULTI_OTSU_COLOR_SPACES:
+        raise ValueError('Invalid color space for multi Otsu, color_space: ', color_space)
+
+    planes = source.get_planes(color_space)
+    channels = planes.shape[2] if planes.ndim == 3 else 1
+
+    luts = []
+    for channel in range(channels):
+        counts, bin_centers = source.get_histogram(color_space, channel)
+        thresholds = ski.filters.threshold_multiotsu(classes=num_classes, hist=(counts, bin_centers))
+
+        if planes.dtype == np.uint8:
+            luts.append(get_label_lut(thresholds, num_classes))
+        else:
+            luts.append(thresholds)
+
+        if progress_callback is not None:
+            progress_callback(80 * (channel + 1) // channels)
+
+    if planes.dtype == np.uint8:
+        # One LUT per plane, cv2.LUT applies them to the interleaved planes in a single pass
+        lut = luts[0] if channels == 1 else np.dstack(luts)
+        ret = cv2.LUT(planes, lut)
+    else:
+        # Only 8-bit planes can be looked up, other depths are classified against the thresholds
+        planes = planes.reshape(planes.shape[:2] + (channels,))
+        ret = np.empty(planes.shape, dtype=np.uint8)
+        for channel, thresholds in enumerate(luts):
+            ret[..., channel] = np.digitize(planes[..., channel], bins=thresholds) * 255 // (num_classes - 1)
+        ret = ret.reshape(source.get_planes(color_space).shape)
+
+    if progress_callback is not None:
+        progress_callback(100)
+
+    return ret
+
+
+# Function to make the brighter region the foreground. Which side of a level set is inside is arbitrary,
+# rounding differences between precisions or pyramid levels can swap it
+def orient_segmentation(segmentation:np.ndarray, img:np.ndarray) -> np.ndarray:
+    mask = segmentation.astype(bool, copy=False)
+    if mask.all() or not mask.any():
+        return segmentation
+
+    if img[mask].mean() < img[~mask].mean():
+        return (1 - segmentation).astype(segmentation.dtype) if segmentation.dtype != bool else ~segmentation
+    return segmentation
+
+
+class _Progress:
+    """
+    Progress of a coarse-to-fine solve, weighted by the pixels times the iteration budget of every level
+    """
+    def __init__(self, levels:list, max_num_iter:int, refine_num_iter:int, progress_callback):
+        budgets = [max_num_iter] + [refine_num_iter] * (len(levels) - 1)
+        self.work = [level.get_nd_image().shape[0] * level.get_nd_image().shape[1] * budget for level, budget in zip(levels, budgets)]
+        self.total = sum(self.work)
+        self.done = 0
+        self.progress_callback = progress_callback
+
+    def iteration(self, iterations:int, pixels:int):
+        self.done += pixels * iterations
+        self.report()
+
+    def level_done(self, index:int):
+        # A converged level did not use its whole budget
+        self.done = sum(self.work[:index + 1])
+        self.report()
+
+    def report(self):
+        if self.progress_callback is not None:
+            self.progress_callback(min(100 * self.done // max(self.total, 1), 100))
+
+
+def chan_vese(source:Image, mu:float = 0.25, lambda1:float = 1.0, lambda2:float = 1.0, tol:float = 1e-3,
+              max_num_iter:int = 200, refine_num_iter:int = 10, dt:float = 0.5, coarse_size:int = COARSE_SIZE,
+              dtype=np.float64, progress_callback=None) -> np.ndarray:
+    """
+    Function to run skimage's Chan-Vese segmentation coarse-to-fine.
+    The coarsest pyramid level is solved from a checkerboard, then its level set is upsampled as the
+    initialization of the next level, which only needs a few iterations to settle.
+    :param source: Image
+    :param mu, lambda1, lambda2, dt: see skimage.segmentation.chan_vese
+    :param tol: float - A level stops when the RMS change of its level set between two iterations is below it
+    :param max_num_iter: int - Iteration budget of the coarsest level
+    :param refine_num_iter: int - Iteration budget of every finer level
+    :param coarse_size: int - Size the coarsest level still covers
+    :param dtype: np.float64 or np.float32 - Precision of the level sets
+    :param progress_callback: callable(int) - Called with the progress in percent, it may raise to cancel
+    :return: np.ndarray - Boolean segmentation of the full resolution source
+    """
+    if max_num_iter < 1 or refine_num_iter < 1:
+        raise ValueError('Chan-Vese needs at least 1 iteration per level, max_num_iter, refine_num_iter: ', max_num_iter, refine_num_iter)
+
+    levels = get_levels(source, coarse_size)
+    progress = _Progress(levels, max_num_iter, refine_num_iter, progress_callback)
+
+    level_set = 'checkerboard'
+    for index, level in enumerate(levels):
+        img = level.get_float_image(dtype)
+        if not isinstance(level_set, str):
+            level_set = upsample_level_set(level_set, img.shape, cv2.INTER_LINEAR)
+
+        budget = max_num_iter if index == 0 else refine_num_iter
+        chunk = max(CHUNK_PIXELS // img.size, 1)
+
+        iterations = 0
+        while iterations < budget:
+            count = min(chunk, budget - iterations)
+            previous = level_set
+            start = time.perf_counter()
+            segmentation, level_set, energies = ski.segmentation.chan_vese(
+                img, mu=mu, lambda1=lambda1, lambda2=lambda2, tol=tol, max_num_iter=count, dt=dt,
+                init_level_set=previous, extended_output=True)
+
+            iterations += len(energies)
+            progress.iteration(len(energies), img.size)
+            chunk = max(int(CHUNK_SECONDS * len(energies) / max(time.perf_counter() - start, 1e-6)), 1)
+
+            # chan_vese stops before the end of the chunk when its level set changed less than tol,
+            # a single iteration chunk always runs to its end so the change is checked here
+            if len(energies) < count:
+                break
+            if count == 1 and not isinstance(previous, str) and np.sqrt(np.mean((level_set - previous) ** 2)) < tol:
+                break
+
+        progress.level_done(index)
+
+    return orient_segmentation(segmentation, img)
+
+
+def morphological_chan_vese(source:Image, smoothing:int = 1, lambda1:float = 1, lambda2:float = 1, tol:float = 5e-3,
+                            max_num_iter:int = 100, refine_num_iter:int = 10, coarse_size:int = COARSE_SIZE,
+                            progress_callback=None) -> np.ndarray:
+    """
+    Function to run skimage's morphological Chan-Vese (morphological snakes) coarse-to-fine, see chan_vese.
+    :param source: Image
+    :param smoothing, lambda1, lambda2: see skimage.segmentation.morphological_chan_vese
+    :param tol: float - A level stops when less than this fraction of its pixels changed in one iteration
+    :param max_num_iter: int - Iteration budget of the coarsest level
+    :param refine_num_iter: int - Iteration budget of every finer level
+    :param coarse_size: int - Size the coarsest level still covers
+    :param progress_callback: callable(int) - Called with the progress in percent after every iteration, it may raise to cancel
+    :return: np.ndarray - int8 level set (0 or 1) of the full resolution source
+    """
+    if max_num_iter < 1 or refine_num_iter < 1:
+        raise ValueError('Morphological snakes need at least 1 iteration per level, max_num_iter, refine_num_iter: ', max_num_iter, refine_num_iter)
+
+    levels = get_levels(source, coarse_size)
+    progress = _Progress(levels, max_num_iter, refine_num_iter, progress_callback)
+
+    level_set = 'checkerboard'
+    for index, level in enumerate(levels):
+        img = level.get_gray()
+        if not isinstance(level_set, str):
+            level_set = upsample_level_set(level_set.astype(np.uint8), img.shape, cv2.INTER_NEAREST)
+
+        previous = []
+
+        # Called with the initial level set and after every iteration
+        def iteration(current):
+            if previous:
+                progress.iteration(1, img.size)
+                if np.count_nonzero(current != previous[0]) < tol * img.size:
+                    raise _Converged(current.copy())
+                previous[0] = current.copy()
+            else:
+                previous.append(current.copy())
+
+        try:
+            level_set = ski.segmentation.morphological_chan_vese(
+                img, max_num_iter if index == 0 else refine_num_iter, init_level_set=level_set,
+                smoothing=smoothing, lambda1=lambda1, lambda2=lambda2, iter_callback=iteration)
+        except _Converged as converged:
+            level_set = converged.level_set.astype(np.int8)
+
+        progress.level_done(index)
+
+    return orient_segmentation(level_set, img)
@@ -0,0 +1,318 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# A session file is this magic followed by records. Every record is a little-endian (header length, payload length)
+# prefix, a JSON header and an optional payload, each starting on a PAYLOAD_ALIGNMENT boundary so that raw
+# payloads can be viewed in place through a memory map. Records are only ever appended
+SESSION_MAGIC = b'IMGSESS1'
+RECORD_PREFIX = struct.Struct('<II')
+PAYLOAD_ALIGNMENT = 64
+
+# A delta snapshot is decoded from the previous one, a full snapshot is stored at least every KEYFRAME_INTERVAL
+# snapshots so that restoring any of them decodes a bounded chain
+KEYFRAME_INTERVAL = 8
+
+# Payloads that compress by less than this are stored raw, they are then mapped without any decoding
+MIN_COMPRESSION_RATIO = 0.9
+
+
+# Function to get the padding up to the next aligned offset
+def get_padding(offset:int) -> int:
+    return -offset % PAYLOAD_ALIGNMENT
+
+
+# Function to encode a snapshot as the smallest of raw, zlib, or zlib of the XOR against the previous snapshot
+def encode_snapshot(img:np.ndarray, previous:np.ndarray = None, compression_level:int = 1) -> tuple:
+    data = np.ascontiguousarray(img).view(np.uint8).reshape(-1)
+
+    encoding, payload = 'zlib', zlib.compress(data, compression_level)
+    if previous is not None and previous.shape == img.shape and previous.dtype == img.dtype:
+        delta = zlib.compress(np.bitwise_xor(data, np.ascontiguousarray(previous).view(np.uint8).reshape(-1)), compression_level)
+        if len(delta) < len(payload):
+            encoding, payload = 'delta', delta
+
+    if len(payload) > MIN_COMPRESSION_RATIO * data.nbytes:
+        return 'raw', data
+    return encoding, payload
+
+
+class Session_Writer:
+    def __init__(self, path:str, compression_level:int = 1, valid_length:int = None):
+        """
+        Constructor for Session_Writer class, appends the changes of a session to a session file as they happen.
+        Snapshots are encoded and written on a background thread in the order they were recorded.
+        :param path: str - Session file, created if it does not exist
+        :param compression_level: int - zlib level of the snapshots (1 is fastest)
+        :param valid_length: int - Session.valid_length of the file, a torn record after it is cut before appending
+        """
+        self.path = path
+        self.compression_level = compression_level
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__file = open(path, 'ab')
+        if valid_length is not None and self.__file.tell() > valid_length:
+            self.__file.truncate(valid_length)
+            self.__file.seek(valid_length)
+        if self.__file.tell() == 0:
+            self.__file.write(SESSION_MAGIC)
+            self.__file.write(b'\0' * get_padding(len(SESSION_MAGIC)))
+            self.__file.flush()
+
+        # One writer thread keeps the records in order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session_writer')
+
+        # Last snapshot written, the base of the next delta: (index, array, snapshots since the last full one)
+        self.__previous = None
+        self.__lock = threading.Lock()
+
+    def __write_record(self, header:dict, payload=None):
+        header_bytes = json.dumps(header).encode()
+        payload_length = len(payload) if payload is not None else 0
+
+        # A torn record at the end of the file is ignored on reopen, the records before it stay valid
+        record = bytearray(RECORD_PREFIX.pack(len(header_bytes), payload_length))
+        record += header_bytes
+        record += b'\0' * get_padding(len(record))
+        self.__file.write(record)
+        if payload is not None:
+            self.__file.write(payload)
+            self.__file.write(b'\0' * get_padding(payload_length))
+        self.__file.flush()
+
+    def __submit(self, function, *args):
+        with self.__lock:
+            return self.executor.submit(function, *args)
+
+    ########################################### Records ####################################################
+
+    def record_source(self, path:str = None, img:np.ndarray = None):
+        """
+        Function to record the source image by reference. A source without a file is stored with its pixels
+        :param path: str - File of the source, None if there is none
+        :param img: np.ndarray - Pixels of a source without a file, None with path=None records that the source was cleared
+        :return: None
+        """
+        if path is not None:
+            stat = os.stat(path)
+            header = {'type': 'source', 'path': os.path.abspath(path), 'mtime': stat.st_mtime, 'size': stat.st_size}
+            self.__submit(self.__write_record, header)
+        elif img is not None:
+            img = np.ascontiguousarray(img)
+            header = {'type': 'source', 'path': None, 'shape': list(img.shape), 'dtype': img.dtype.str}
+            self.__submit(self.__write_record, header, img.view(np.uint8).reshape(-1))
+        else:
+            self.__submit(self.__write_record, {'type': 'source', 'path': None})
+
+    def record_push(self, index:int, img:np.ndarray, metadata:dict = None):
+        """
+        Function to record a snapshot pushed on the history, it replaces the snapshots from index onwards
+        :param index: int - Index of the snapshot in the history
+        :param img: np.ndarray - Its pixels, not modified afterwards
+        :param metadata: dict - Operation that produced it, must be JSON serializable (tuples become lists)
+        :return: None
+        """
+        self.__submit(self.__write_snapshot, index, img, metadata)
+
+    def __write_snapshot(self, index:int, img:np.ndarray, metadata:dict):
+        previous = None
+        since_keyframe = 0
+        if self.__previous is not None and self.__previous[0] == index - 1 and self.__previous[2] + 1 < KEYFRAME_INTERVAL:
+            previous, since_keyframe = self.__previous[1], self.__previous[2] + 1
+
+        encoding, payload = encode_snapshot(img, previous, self.compression_level)
+        if encoding != 'delta':
+            since_keyframe = 0
+
+        header = {
+            'type': 'snapshot', 'index': index, 'shape': list(img.shape), 'dtype': img.dtype.str,
+            'encoding': encoding, 'metadata': metadata,
+        }
+        self.__write_record(header, payload)
+        self.__previous = (index, img, since_keyframe)
+
+    def record_position(self, index:int):
+        """
+        Function to record the current index of the history after an undo or a redo
+        :param index: int
+        :return: None
+        """
+        self.__submit(self.__write_record, {'type': 'position', 'index': index})
+
+    def record_clear(self):
+        self.__submit(self.__write_record, {'type': 'clear'})
+
+    def close(self):
+        """
+        Function to wait for the pending records and close the file
+        :return: None
+        """
+        with self.__lock:
+            self.executor.shutdown(wait=True)
+        self.__file.close()
+
+
+class Session:
+    def __init__(self, path:str):
+        """
+        Constructor for Session class, a session file opened for reading.
+        Only the record headers are read, the file is memory-mapped and every snapshot is decoded from the
+        map when it is requested, raw snapshots are returned as read-only views of the map without a copy.
+        :param path: str - Session file
+        """
+        self.path = path
+        self.source = None
+        self.snapshots = []
+        self.current_index = -1
+
+        # End of the last complete record
+        self.valid_length = 0
+
+        self.__file = open(path, 'rb')
+        size = os.fstat(self.__file.fileno()).st_size
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        if self.__map is None or self.__map[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+            raise ValueError('Not a session file: ' + path)
+
+        self.__read_records(size)
+
+    def __read_records(self, size:int):
+        offset = len(SESSION_MAGIC) + get_padding(len(SESSION_MAGIC))
+        self.valid_length = offset
+
+        while offset + RECORD_PREFIX.size <= size:
+            header_length, payload_length = RECORD_PREFIX.unpack_from(self.__map, offset)
+            header_end = offset + RECORD_PREFIX.size + header_length
+            payload_offset = header_end + get_padding(header_end)
+            record_end = payload_offset + payload_length + get_padding(payload_length) if payload_length else payload_offset
+
+            # The last record may be torn if the application stopped while writing it
+            if record_end > size:
+                break
+            try:
+                header = json.loads(self.__map[offset + RECORD_PREFIX.size:header_end])
+            except ValueError:
+                break
+
+            self.__apply(header, payload_offset, payload_length)
+            offset = self.valid_length = record_end
+
+    # Function to replay a record, the state after the last record is the state the session was left in
+    def __apply(self, header:dict, payload_offset:int, payload_length:int):
+        if header['type'] == 'source':
+            self.source = dict(header, offset=payload_offset, length=payload_length)
+        elif header['type'] == 'snapshot':
+            del self.snapshots[header['index']:]
+            self.snapshots.append(dict(header, offset=payload_offset, length=payload_length))
+            self.current_index = header['index']
+        elif header['type'] == 'position':
+            self.current_index = min(header['index'], len(self.snapshots) - 1)
+        elif header['type'] == 'clear':
+            self.snapshots = []
+            self.current_index = -1
+
+    def __get_payload(self, record:dict) -> memoryview:
+        return memoryview(self.__map)[record['offset']:record['offset'] + record['length']]
+
+    ########################################### Access ####################################################
+
+    def get_source_path(self) -> str:
+        """
+        Function to get the file of the source if it still exists unchanged
+        :return: str or None
+        """
+        if self.source is None or self.source['path'] is None or not os.path.exists(self.source['path']):
+            return None
+
+        stat = os.stat(self.source['path'])
+        if stat.st_mtime != self.source['mtime'] or stat.st_size != self.source['size']:
+            return None
+        return self.source['path']
+
+    def get_source_image(self) -> np.ndarray:
+        """
+        Function to get the pixels of a source that was stored without a file
+        :return: np.ndarray or None
+        """
+        if self.source is None or not self.source.get('length'):
+            return None
+        return np.frombuffer(self.__get_payload(self.source), dtype=np.dtype(self.source['dtype'])).reshape(self.source['shape'])
+
+    def get_snapshot(self, index:int) -> np.ndarray:
+        """
+        Function to decode a snapshot of the history
+        :param index: int
+        :return: np.ndarray - Read-only for raw snapshots, which view the map
+        """
+        record = self.snapshots[index]
+        dtype, shape = np.dtype(record['dtype']), record['shape']
+        payload = self.__get_payload(record)
+
+        if record['encoding'] == 'raw':
+            return np.frombuffer(payload, dtype=dtype).reshape(shape)
+
+        data = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        if record['encoding'] == 'delta':
+            previous = np.ascontiguousarray(self.get_snapshot(index - 1)).view(np.uint8).reshape(-1)
+            data = np.bitwise_xor(data, previous)
+        return data.view(dtype).reshape(shape)
+
+    def get_metadata(self, index:int) -> dict:
+        return self.snapshots[index]['metadata']
+
+    def get_live_bytes(self) -> int:
+        """
+        Function to get the payload bytes of the records still in use, to compare with the file size
+        :return: int
+        """
+        records = self.snapshots + ([self.source] if self.source is not None else [])
+        return sum(record['length'] for record in records)
+
+    def close(self):
+        # Views of raw snapshots keep the map open until they are freed
+        try:
+            self.__map.close()
+        except BufferError:
+            pass
+        self.__file.close()
+
+
+# Function to rewrite a session file with only its live records, dropped redo branches and cleared histories
+# take space until then. Returns True if the file was rewritten
+def compact_session(path:str, min_garbage_ratio:float = 0.5) -> bool:
+    session = Session(path)
+    try:
+        size = os.path.getsize(path)
+        if size - session.get_live_bytes() <= min_garbage_ratio * size:
+            return False
+
+        temporary_path = path + '.tmp'
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+        writer = Session_Writer(temporary_path)
+        if session.source is not None:
+            if session.source['path'] is not None:
+                # A source changed since it was recorded is left out, recording it again would take its new stat
+                # and restore outputs that were not computed from it
+                if session.get_source_path() is not None:
+                    writer.record_source(session.source['path'])
+            else:
+                writer.record_source(None, session.get_source_image())
+
+        for index in range(len(session.snapshots)):
+            writer.record_push(index, session.get_snapshot(index), session.get_metadata(index))
+        writer.record_position(session.current_index)
+        writer.close()
+    finally:
+        session.close()
+
+    os.replace(temporary_path, path)
+    return True
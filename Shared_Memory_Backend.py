@@ -0,0 +1,413 @@
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from Image import Image
+from Image_Operations import Image_Operations, DTYPE_POLICIES
+from Batch_Processing import init_worker
+
+# Segment sizes are rounded up to this, so that the outputs of similar operations can reuse each other's segments
+SEGMENT_ALIGNMENT = 1024 * 1024
+
+# A free segment is reused for a request at least this fraction of its size, larger segments are kept for larger requests
+SEGMENT_MIN_FILL = 0.5
+
+# Workers report their progress in a shared segment of int32 slots, one per operation in flight.
+# Operations submitted while every slot is taken run without reporting progress
+PROGRESS_SLOTS = 1024
+
+
+# Function to get an upper bound of the output size of an operation, the output segment is allocated before it runs.
+# Edge filters output floats (four planes for edge_compare_all), the other operations at most one byte per source byte
+def get_output_nbytes(method:str, shape:tuple, dtype:np.dtype, dtype_policy:str) -> int:
+    method = method.replace('_menu', '')
+    height, width = shape[:2]
+    channels = shape[2] if len(shape) == 3 else 1
+
+    if method.startswith('edge_'):
+        storage_dtype = np.dtype(DTYPE_POLICIES[dtype_policy][1] or DTYPE_POLICIES[dtype_policy][0])
+        planes = 4 if method == 'edge_compare_all' else 1
+        return height * width * planes * storage_dtype.itemsize
+
+    return height * width * max(channels, 3) * np.dtype(dtype).itemsize
+
+
+class Segment_Pool:
+    def __init__(self, max_free_bytes:int = 1024 * 1024 * 1024):
+        """
+        Constructor for Segment_Pool class, shared memory segments reused across calls.
+        Creating a segment maps new pages that the kernel zero-fills on first touch, reusing one skips both.
+        :param max_free_bytes: int - Memory kept in unused segments, segments released past it are unlinked
+        """
+        self.max_free_bytes = max_free_bytes
+
+        self.__free = []
+        self.__segments = {}
+        self.__lock = threading.Lock()
+
+    def get_free_bytes(self) -> int:
+        with self.__lock:
+            return sum(segment.size for segment in self.__free)
+
+    def acquire(self, nbytes:int) -> shared_memory.SharedMemory:
+        """
+        Function to get a segment of at least nbytes, the smallest fitting free one or a new one
+        :param nbytes: int
+        :return: SharedMemory
+        """
+        size = max(-(-nbytes // SEGMENT_ALIGNMENT), 1) * SEGMENT_ALIGNMENT
+
+        with self.__lock:
+            fitting = [segment for segment in self.__free if size <= segment.size and size >= segment.size * SEGMENT_MIN_FILL]
+            if fitting:
+                segment = min(fitting, key=lambda segment: segment.size)
+                self.__free.remove(segment)
+                return segment
+
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        with self.__lock:
+            self.__segments[segment.name] = segment
+        return segment
+
+    def release(self, segment:shared_memory.SharedMemory):
+        """
+        Function to give a segment back, it is kept for reuse within max_free_bytes
+        :param segment: SharedMemory
+        :return: None
+        """
+        with self.__lock:
+            if segment.name not in self.__segments:
+                return
+            if sum(free.size for free in self.__free) + segment.size <= self.max_free_bytes:
+                self.__free.append(segment)
+                return
+            del self.__segments[segment.name]
+
+        self.__unlink(segment)
+
+    def close(self):
+        """
+        Function to unlink every segment of the pool, including those still in use.
+        Arrays still viewing them stay valid, the memory is freed when they are
+        :return: None
+        """
+        with self.__lock:
+            segments = list(self.__segments.values())
+            self.__segments.clear()
+            self.__free.clear()
+
+        for segment in segments:
+            self.__unlink(segment)
+
+    @staticmethod
+    def __unlink(segment:shared_memory.SharedMemory):
+        segment.unlink()
+        try:
+            segment.close()
+        except BufferError:
+            # An array still views the segment, the mapping is closed when the segment object is collected
+            pass
+
+
+########################################### Worker processes ####################################################
+
+# Source attached by this worker: ((hash, segment name), segment, Image_Operations). Consecutive operations on the same
+# source reuse its derived planes (gray, float, pyramid levels) without attaching again. The name is part of the key,
+# a source placed again after it was replaced is in another segment
+_worker_source = None
+
+# Progress segment attached by this worker: (name, segment, int32 slots)
+_worker_progress = None
+
+
+# Function to attach a segment created by the parent. Attaching only maps it, the parent owns and unlinks it
+def attach_segment(name:str) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(name=name)
+
+
+# Function to get the operator of a source handle in a worker, attaching to the source segment if it changed
+def get_worker_operator(source_handle:tuple, dtype_policy:str) -> Image_Operations:
+    global _worker_source
+
+    source_hash, name, shape, dtype = source_handle
+    if _worker_source is None or _worker_source[0] != (source_hash, name):
+        if _worker_source is not None:
+            previous = _worker_source[1]
+            _worker_source = None
+            try:
+                previous.close()
+            except BufferError:
+                pass
+
+        segment = attach_segment(name)
+        img = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        img.setflags(write=False)
+
+        # The parent has its own result cache, the worker only keeps the planes derived from the source
+        image_operator = Image_Operations(img, cache_max_bytes=0, dtype_policy=dtype_policy)
+        _worker_source = ((source_hash, name), segment, image_operator)
+
+    image_operator = _worker_source[2]
+    if image_operator.dtype_policy != dtype_policy:
+        image_operator.set_dtype_policy(dtype_policy)
+    return image_operator
+
+
+# Function to get the progress callback of an operation in a worker, it writes the progress in the slot of the operation
+def get_worker_progress_callback(progress_handle:tuple):
+    global _worker_progress
+
+    if progress_handle is None:
+        return None
+
+    name, slot = progress_handle
+    if _worker_progress is None or _worker_progress[0] != name:
+        segment = attach_segment(name)
+        _worker_progress = (name, segment, np.ndarray(PROGRESS_SLOTS, dtype=np.int32, buffer=segment.buf))
+
+    slots = _worker_progress[2]
+
+    def progress_callback(value):
+        slots[slot] = value
+    return progress_callback
+
+
+# Function executed in the worker processes, it writes the result into the output segment and returns its shape and dtype.
+# A result larger than the segment is returned through the pipe instead
+def run_operation(source_handle:tuple, output_handle:tuple, progress_handle:tuple, method:str, params:dict, dtype_policy:str):
+    progress_callback = get_worker_progress_callback(progress_handle)
+    result = get_worker_operator(source_handle, dtype_policy).apply_operation(method, progress_callback=progress_callback, **params)
+
+    # Conversions return None when the source is already in the requested color space
+    if result is None:
+        return None
+
+    result = np.ascontiguousarray(result)
+    name, capacity = output_handle
+    if result.nbytes > capacity:
+        return result
+
+    segment = attach_segment(name)
+    try:
+        output = np.ndarray(result.shape, dtype=result.dtype, buffer=segment.buf)
+        output[...] = result
+        del output
+    finally:
+        segment.close()
+
+    return result.shape, result.dtype.str
+
+
+class Shared_Memory_Backend:
+    def __init__(self, workers:int = None, max_free_bytes:int = 1024 * 1024 * 1024):
+        """
+        Constructor for Shared_Memory_Backend class, runs operations in worker processes without pickling images.
+        The source is copied once into a shared memory segment that the workers attach to, the workers write
+        their results into output segments from a pool, and the caller gets arrays viewing those segments.
+        Every segment is created and unlinked by this process, a worker that crashes leaves nothing behind.
+        :param workers: int - Number of worker processes, None uses the CPU count
+        :param max_free_bytes: int - Memory kept in unused segments for reuse
+        """
+        self.workers = workers
+        self.segment_pool = Segment_Pool(max_free_bytes)
+
+        # The resource tracker unlinks the segments left by this process if it is killed,
+        # it is started before the workers so that they share it
+        resource_tracker.ensure_running()
+        self.executor = None
+
+        # Source placed in shared memory: hash, segment, handle and the number of operations using it
+        self.__source = None
+        self.__lock = threading.Lock()
+
+        # Progress slots of the operations in flight, the segment is taken from the pool on the first operation
+        self.__progress = None
+        self.__free_slots = list(range(PROGRESS_SLOTS))
+
+        # Segments are unlinked when the backend is collected or at exit, even if close is not called
+        self.__finalizer = weakref.finalize(self, self.segment_pool.close)
+
+    ########################################### Source ####################################################
+
+    def set_source(self, image:Image) -> tuple:
+        """
+        Function to place an image in shared memory, an image already placed is not copied again
+        :param image: Image
+        :return: tuple - Handle of the source: (hash, segment name, shape, dtype)
+        """
+        return self.__place_source(image, 0)['handle']
+
+    # Function to place a source and count the operations that will read it, under the same lock as the swap
+    # so that a concurrent set_source cannot release the segment in between
+    def __place_source(self, image:Image, operations:int) -> dict:
+        image = image if isinstance(image, Image) else Image(image)
+        source_hash = image.get_hash()
+
+        with self.__lock:
+            if self.__source is not None and self.__source['hash'] == source_hash:
+                self.__source['pending'] += operations
+                return self.__source
+
+        img = np.ascontiguousarray(image.get_nd_image())
+        segment = self.segment_pool.acquire(img.nbytes)
+        np.ndarray(img.shape, dtype=img.dtype, buffer=segment.buf)[...] = img
+
+        with self.__lock:
+            previous = self.__source
+            source = self.__source = {
+                'hash': source_hash, 'segment': segment, 'handle': (source_hash, segment.name, img.shape, img.dtype.str),
+                'pending': operations, 'retired': False,
+            }
+
+        if previous is not None:
+            self.__retire(previous)
+        return source
+
+    def __retire(self, source:dict):
+        # The segment of a replaced source is released once the operations still reading it finished
+        with self.__lock:
+            source['retired'] = True
+            released = source['pending'] == 0
+        if released:
+            self.segment_pool.release(source['segment'])
+
+    def __finish(self, source:dict):
+        with self.__lock:
+            source['pending'] -= 1
+            released = source['retired'] and source['pending'] == 0
+        if released:
+            self.segment_pool.release(source['segment'])
+
+    ########################################### Progress ####################################################
+
+    # Function to take a progress slot, None if every slot is taken
+    def __acquire_progress_slot(self) -> tuple:
+        with self.__lock:
+            if self.__progress is None:
+                segment = self.segment_pool.acquire(PROGRESS_SLOTS * np.dtype(np.int32).itemsize)
+                self.__progress = (segment, np.ndarray(PROGRESS_SLOTS, dtype=np.int32, buffer=segment.buf))
+            if not self.__free_slots:
+                return None
+
+            slot = self.__free_slots.pop()
+            self.__progress[1][slot] = 0
+            return self.__progress[0].name, slot
+
+    def __release_progress_slot(self, progress_handle:tuple):
+        if progress_handle is not None:
+            with self.__lock:
+                self.__free_slots.append(progress_handle[1])
+
+    def get_progress(self, progress_handle:tuple) -> int:
+        """
+        Function to read the progress an operation reported from its worker
+        :param progress_handle: tuple - Handle returned with the future by submit_with_progress
+        :return: int - Progress in percent, 0 if the operation has no slot
+        """
+        if progress_handle is None:
+            return 0
+        return int(self.__progress[1][progress_handle[1]])
+
+    ########################################### Operations ####################################################
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        return self.executor
+
+    def submit(self, image:Image, method:str, dtype_policy:str = 'float64', **params) -> Future:
+        """
+        Function to run an operation on an image in a worker process
+        :param image: Image - Source of the operation, e.g. Image_Operations.get_operation_source()
+        :param method: str - Operation name, see Image_Operations.apply_operation
+        :param dtype_policy: str - Precision of the operation, see Image_Operations.DTYPE_POLICIES
+        :param params: Keyword arguments of the operation
+        :return: Future - Resolves to an array viewing a shared segment, the segment returns to the pool when the array is freed
+        """
+        return self.submit_with_progress(image, method, dtype_policy, **params)[0]
+
+    def submit_with_progress(self, image:Image, method:str, dtype_policy:str = 'float64', **params) -> tuple:
+        """
+        Function to run an operation in a worker process that reports its progress, see submit and get_progress
+        :return: tuple - (Future, progress handle), the handle is valid until the future is done
+        """
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError('Invalid dtype policy, dtype_policy: ', dtype_policy)
+
+        source = self.__place_source(image, 1)
+        source_hash, name, shape, dtype = source['handle']
+
+        progress_handle = self.__acquire_progress_slot()
+        output = self.segment_pool.acquire(get_output_nbytes(method, shape, dtype, dtype_policy))
+
+        try:
+            worker_future = self.__get_executor().submit(
+                run_operation, source['handle'], (output.name, output.size), progress_handle, method, params, dtype_policy)
+        except BaseException:
+            self.segment_pool.release(output)
+            self.__release_progress_slot(progress_handle)
+            self.__finish(source)
+            raise
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def done(worker_future):
+            self.__finish(source)
+            try:
+                result = worker_future.result()
+            except BaseException as e:
+                self.segment_pool.release(output)
+                if isinstance(e, BrokenProcessPool):
+                    # A worker died, the pool cannot run anything else and is replaced on the next call
+                    self.executor = None
+                self.__release_progress_slot(progress_handle)
+                future.set_exception(e)
+                return
+
+            if not isinstance(result, tuple):
+                self.segment_pool.release(output)
+                self.__release_progress_slot(progress_handle)
+                future.set_result(result)
+                return
+
+            result_shape, result_dtype = result
+            array = np.ndarray(result_shape, dtype=np.dtype(result_dtype), buffer=output.buf)
+
+            # Views of the array keep it alive, the segment is reused once all of them are gone
+            weakref.finalize(array, self.segment_pool.release, output)
+            self.__release_progress_slot(progress_handle)
+            future.set_result(array)
+
+        worker_future.add_done_callback(done)
+        return future, progress_handle
+
+    def run(self, image:Image, method:str, dtype_policy:str = 'float64', progress_callback=None, **params) -> np.ndarray:
+        """
+        Function to run an operation in a worker process and wait for its result, see submit
+        :param progress_callback: callable(int) - Called with the progress the worker reports while waiting,
+        it may raise to cancel. The result of a cancelled operation is dropped when it finishes
+        :return: np.ndarray
+        """
+        future, progress_handle = self.submit_with_progress(image, method, dtype_policy, **params)
+
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except TimeoutError:
+                if progress_callback is not None:
+                    progress_callback(self.get_progress(progress_handle))
+
+    def close(self):
+        """
+        Function to stop the worker processes and unlink every segment
+        :return: None
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.__finalizer()
@@ -0,0 +1,189 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import cv2
+
+import Edge_Engine
+
+# Methods supported by the tiled engine and the overlap (halo) each one needs around a tile
+# so that the tile seams match the full-frame result exactly
+TILE_HALO = {
+    'bgr_2_gray': 0,
+    'bgr_2_hsv': 0,
+    'edge_roberts': 1,
+    'edge_sobel': 1,
+    'edge_scharr': 1,
+    'edge_prewitt': 1,
+}
+
+
+# Directory of the temporary outputs, removed with whatever is left in it when the interpreter exits
+_temporary_dir = None
+
+
+# Function to create a temporary .npy file for an output
+def get_temporary_path() -> str:
+    global _temporary_dir
+    if _temporary_dir is None:
+        _temporary_dir = tempfile.TemporaryDirectory(prefix='tiled_')
+
+    output_file, output_path = tempfile.mkstemp(prefix='tiled_', suffix='.npy', dir=_temporary_dir.name)
+    os.close(output_file)
+    return output_path
+
+
+# Function to remove a temporary output once its memory map is released.
+# Systems that cannot remove a mapped file keep it until the temporary directory is removed at exit
+def remove_temporary_file(path:str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Function to open an image as a read-only memory-mapped array.
+# .npy files are mapped directly, other formats are decoded once and cached as .npy in cache_dir
+def open_memmap(path:str, cache_dir:str = None) -> np.ndarray:
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+
+    # Compressed formats cannot be decoded partially, so they are converted to .npy once
+    cache_dir = cache_dir or tempfile.gettempdir()
+    cache_path = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0] + '.source.npy')
+
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(path):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('Could not decode image: ' + path)
+        np.save(cache_path, img)
+        del img
+
+    return np.load(cache_path, mmap_mode='r')
+
+
+# Function to get the output shape and dtype of a method for a given source
+def get_output_spec(method:str, source:np.ndarray, output_dtype=np.float64) -> tuple:
+    if method == 'bgr_2_gray':
+        return source.shape[:2], np.uint8
+    if method == 'bgr_2_hsv':
+        return source.shape[:2] + (3,), np.uint8
+    return source.shape[:2], np.dtype(output_dtype)
+
+
+# Function to compute one tile. The source slice includes the halo, which is cropped from the result
+def process_tile(method:str, tile:np.ndarray) -> np.ndarray:
+    if method == 'bgr_2_hsv':
+        return cv2.cvtColor(tile, cv2.COLOR_BGR2HSV)
+
+    if tile.ndim == 3:
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+    if method == 'bgr_2_gray':
+        return tile
+
+    # Same normalization as skimage's img_as_float on the full frame
+    if tile.dtype == np.uint8:
+        tile = tile * (1 / 255)
+    elif tile.dtype not in (np.float32, np.float64):
+        tile = tile.astype(np.float64)
+
+    return Edge_Engine.compute_edges(tile, [method])[0]
+
+
+# Function to split an image into tiles, every tile is (y0, y1, x0, x1)
+def get_tiles(height:int, width:int, tile_size:int) -> list:
+    return [
+        (y, min(y + tile_size, height), x, min(x + tile_size, width))
+        for y in range(0, height, tile_size)
+        for x in range(0, width, tile_size)
+    ]
+
+
+def run_tiled(source:np.ndarray, method:str, output_path:str = None, tile_size:int = 1024, workers:int = None,
+              output_dtype=np.float64, progress_callback=None) -> np.ndarray:
+    """
+    Function to run a neighbourhood filter or a conversion tile by tile.
+    Tiles are read with a halo overlap from the (memory-mapped) source and written into a memory-mapped output,
+    so the peak memory depends on the tile size and the number of workers, not on the image size.
+    :param source: np.ndarray - Source image, usually a read-only np.memmap
+    :param method: str - One of TILE_HALO's keys
+    :param output_path: str - .npy file for the output, None creates a temporary file removed with the returned array
+    :param tile_size: int - Tile edge length in pixels, without the halo
+    :param workers: int - Number of worker threads, None uses the executor default
+    :param output_dtype: dtype of the edge detection output, float64 matches skimage up to rounding
+    :param progress_callback: callable(int) - Called with the progress in percent after each tile
+    :return: np.memmap - The output image
+    """
+    method = method.replace('_menu', '')
+    if method not in TILE_HALO:
+        raise ValueError('Invalid method for tiled processing, method: ', method)
+
+    temporary = output_path is None
+    if temporary:
+        output_path = get_temporary_path()
+
+    shape, dtype = get_output_spec(method, source, output_dtype)
+    output = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=shape)
+
+    # Views of the output keep it alive, the file is removed when the last of them is released
+    if temporary:
+        weakref.finalize(output, remove_temporary_file, output_path)
+
+    height, width = source.shape[:2]
+    halo = TILE_HALO[method]
+    tiles = get_tiles(height, width, tile_size)
+
+    def run(tile):
+        y0, y1, x0, x1 = tile
+
+        # Extend the tile by the halo, clamped to the image; at the image border the filter's own padding applies
+        hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+        hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+
+        result = process_tile(method, np.asarray(source[hy0:hy1, hx0:hx1]))
+        output[y0:y1, x0:x1] = result[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run, tile) for tile in tiles]
+
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress_callback is not None:
+                    progress_callback(100 * done // len(tiles))
+        except BaseException:
+            # Cancellation or failure, do not start the remaining tiles
+            for future in futures:
+                future.cancel()
+            raise
+
+    output.flush()
+    return output
+
+
+def main(argv:list = None) -> int:
+    parser = argparse.ArgumentParser(prog='tiled', description='Run a filter or conversion tile by tile on a memory-mapped image')
+    parser.add_argument('--op', required=True, choices=list(TILE_HALO), help='Operation to apply')
+    parser.add_argument('--in', dest='input_path', required=True, help='Input image (.npy is memory-mapped directly)')
+    parser.add_argument('--out', dest='output_path', required=True, help='Output .npy file')
+    parser.add_argument('--tile-size', dest='tile_size', type=int, default=1024, help='Tile edge length in pixels')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker threads')
+    parser.add_argument('--dtype', default='float64', choices=['float32', 'float64'], help='Edge detection output dtype')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    source = open_memmap(args.input_path, os.path.dirname(os.path.abspath(args.output_path)))
+    output = run_tiled(source, args.op, args.output_path, args.tile_size, args.workers, np.dtype(args.dtype))
+
+    print('Processed {}x{} image in {:.2f} s -> {} {} {}'.format(
+        source.shape[1], source.shape[0], time.perf_counter() - start, args.output_path, output.shape, output.dtype))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
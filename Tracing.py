@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from functools import wraps
+
+
+class Span:
+    """
+    One traced stage, collected by the Tracer when it ends
+    """
+    __slots__ = ('name', 'category', 'start', 'wall_time', 'cpu_time', 'peak_memory', 'thread_id', 'children_peak')
+
+    def __init__(self, name:str, category:str):
+        self.name = name
+        self.category = category
+        self.start = 0.0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = None
+        self.thread_id = threading.get_ident()
+        self.children_peak = 0
+
+
+class Tracer:
+    def __init__(self, max_spans:int = 100000):
+        """
+        Constructor for Tracer class, collects the wall time, CPU time and optionally the peak allocation of traced stages
+        :param max_spans: int - Number of spans kept, the oldest ones are dropped past it
+        """
+        self.enabled = True
+        self.memory_enabled = False
+
+        self.__spans = deque(maxlen=max_spans)
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__origin = time.perf_counter()
+
+    def enable_memory(self):
+        """
+        Function to also record the peak allocation of every stage with tracemalloc.
+        tracemalloc slows allocations down and is process-wide, so stages running at the same time share their peak.
+        :return: None
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory_enabled = True
+
+    def clear(self):
+        with self.__lock:
+            self.__spans.clear()
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+    ########################################### Recording ####################################################
+
+    def __get_stack(self) -> list:
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def begin(self, name:str, category:str = 'stage') -> Span:
+        span = Span(name, category)
+
+        stack = self.__get_stack()
+
+        if self.memory_enabled:
+            current, peak = tracemalloc.get_traced_memory()
+
+            # Resetting the peak would lose the parent's peak so far, so it is folded into the parent first
+            if stack:
+                stack[-1].children_peak = max(stack[-1].children_peak, peak)
+            span.peak_memory = current
+            tracemalloc.reset_peak()
+
+        stack.append(span)
+        span.cpu_time = time.thread_time()
+        span.start = time.perf_counter()
+        return span
+
+    def end(self, span:Span):
+        span.wall_time = time.perf_counter() - span.start
+        span.cpu_time = time.thread_time() - span.cpu_time
+
+        stack = self.__get_stack()
+        stack.remove(span)
+
+        if self.memory_enabled and span.peak_memory is not None:
+            # The peak is reset by every nested span, so the children's peaks are folded back in
+            peak = max(tracemalloc.get_traced_memory()[1], span.children_peak)
+            if stack:
+                stack[-1].children_peak = max(stack[-1].children_peak, peak)
+            span.peak_memory = peak - span.peak_memory
+
+        with self.__lock:
+            self.__spans.append(span)
+
+    def span(self, name:str, category:str = 'stage'):
+        """
+        Context manager tracing the enclosed block
+        :param name: str - Name of the stage
+        :param category: str - Category shown in the trace viewer
+        """
+        return _Span_Context(self, name, category)
+
+    def traced(self, name:str = None, category:str = 'stage'):
+        """
+        Decorator tracing every call of a function
+        :param name: str - Name of the stage, the function's qualified name by default
+        :param category: str - Category shown in the trace viewer
+        """
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                span = self.begin(span_name, category)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.end(span)
+            return wrapper
+        return decorator
+
+    ########################################### Reporting ####################################################
+
+    def get_spans(self, since:float = None) -> list:
+        """
+        Function to get the recorded spans, oldest first
+        :param since: float - Only spans that started after this time.perf_counter() value
+        :return: list of Span
+        """
+        with self.__lock:
+            spans = list(self.__spans)
+        if since is not None:
+            spans = [span for span in spans if span.start >= since]
+        return spans
+
+    def get_breakdown(self, since:float = None) -> list:
+        """
+        Function to sum the wall time, CPU time and peak allocation of every stage
+        :param since: float - Only spans that started after this time.perf_counter() value
+        :return: list of (name, wall_time, cpu_time, peak_memory) in order of first appearance
+        """
+        breakdown = {}
+        for span in self.get_spans(since):
+            wall_time, cpu_time, peak_memory = breakdown.get(span.name, (0.0, 0.0, None))
+            if span.peak_memory is not None:
+                peak_memory = max(peak_memory or 0, span.peak_memory)
+            breakdown[span.name] = (wall_time + span.wall_time, cpu_time + span.cpu_time, peak_memory)
+
+        return [(name,) + values for name, values in breakdown.items()]
+
+    def format_breakdown(self, since:float = None) -> str:
+        parts = []
+        for name, wall_time, cpu_time, peak_memory in self.get_breakdown(since):
+            part = '{} {:.1f} ms'.format(name.split('.')[-1], wall_time * 1000)
+            if peak_memory is not None:
+                part += ' / {:.1f} MB'.format(peak_memory / 1e6)
+            parts.append(part)
+        return ' | '.join(parts)
+
+    def export_chrome_trace(self, path:str):
+        """
+        Function to write the spans in the Chrome trace event format (chrome://tracing, Perfetto)
+        :param path: str
+        :return: None
+        """
+        events = []
+        for span in self.get_spans():
+            args = {'cpu_ms': round(span.cpu_time * 1000, 3)}
+            if span.peak_memory is not None:
+                args['peak_bytes'] = span.peak_memory
+
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start - self.__origin) * 1e6,
+                'dur': span.wall_time * 1e6,
+                'pid': os.getpid(),
+                'tid': span.thread_id,
+                'args': args,
+            })
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+class _Span_Context:
+    __slots__ = ('tracer', 'name', 'category', 'span')
+
+    def __init__(self, tracer:Tracer, name:str, category:str):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.span = None
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            self.span = self.tracer.begin(self.name, self.category)
+        return self.span
+
+    def __exit__(self, *exc_info):
+        if self.span is not None:
+            self.tracer.end(self.span)
+        return False
+
+
+# Tracer shared by the whole application
+tracer = Tracer()
+traced = tracer.traced
+trace_span = tracer.span
@@ -1,42 +1,75 @@
-from PyQt5 import QtWidgets, uic
+from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QMainWindow
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer, QThreadPool, QSize
 from PyQt5 import QtGui
 
 import sys
 import cv2
 import numpy as np
-import time
 import os
-from Image_Operations import Image_Operations
-
-from functools import wraps
-
-# Define the decorator for the progress bar
-def progress_bar_decorator(time_delay):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(self, *args, **kwargs):
-            # Temporary progress bar generation
-            layout = QtWidgets.QVBoxLayout()
-            progress_bar = QtWidgets.QProgressBar()
-            progress_bar.setRange(0, 100)
-            progress_bar.setFixedHeight(15)
-            layout.addWidget(progress_bar)
-            
-            # Add progress bar to the status bar
-            self.statusBar().addPermanentWidget(progress_bar)
-            
-            for i in range(101):
-                time.sleep(time_delay / 100)
-                progress_bar.setValue(i)
-            self.statusBar().removeWidget(progress_bar)
-            
-            
-            return func(self, *args, **kwargs)
-        return wrapper
-    return decorator
+import hashlib
+import importlib.util
+from Image_Operations import Image_Operations, DTYPE_POLICIES
+from Operation_Worker import Operation_Runner, Operation_Worker
+from Image_Browser import Image_Browser
+from Image_Viewer import Image_Viewer, link_viewers
+from Image_Export import Image_Exporter, EXPORT_FORMATS, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESSION
+from Image import Image
+from Pipeline import Pipeline, Pipeline_Step
+from Video_Processing import Latest_Frame, stream_video
+from Shared_Memory_Backend import Shared_Memory_Backend
+from Session import Session, Session_Writer, compact_session
+from Tracing import tracer, traced, trace_span
+
+# Parameters tuned live from the Parameters panel, by method: (name, label, minimum, maximum, default)
+LIVE_PARAMETERS = {
+    'segment_multi_otsu': [('num_classes', 'Classes', 2, 5, 3)],
+    'segment_chan_vese': [('max_num_iter', 'Iterations', 10, 500, 200)],
+    'segment_moprh_snakes': [('max_num_iter', 'Iterations', 10, 300, 100)],
+}
+
+# A value is previewed once it stopped changing for LIVE_PREVIEW_DELAY ms and committed to the history
+# after LIVE_COMMIT_DELAY ms, or when the slider is released
+LIVE_PREVIEW_DELAY = 80
+LIVE_COMMIT_DELAY = 800
+
+# Previews of a changing value run on the pyramid level covering this fraction of the display
+LIVE_PROXY_SCALE = 0.5
+
+# The session is recorded as it changes and reopened on the next start
+SESSION_PATH = os.path.join("__session__", "session.bin")
+
+
+def load_ui_class(ui_path, cache_dir="__ui_cache__"):
+    """
+    @brief Returns the Ui class generated from a .ui file. The file is compiled to Python once and the
+    module is cached by the hash of the .ui content, so it is rebuilt only when the design changes.
+    @param ui_path Path of the Qt Designer file.
+    @param cache_dir Directory of the compiled modules.
+    @return The Ui_<name> class with a setupUi(window) method.
+    """
+    with open(ui_path, "rb") as ui_file:
+        digest = hashlib.sha1(ui_file.read()).hexdigest()[:12]
+
+    module_name = os.path.splitext(os.path.basename(ui_path))[0] + "_" + digest
+    module_path = os.path.join(cache_dir, module_name + ".py")
+
+    if not os.path.exists(module_path):
+        # uic is only needed, and imported, when the design changed
+        from PyQt5 import uic
+
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = module_path + ".tmp"
+        with open(temporary_path, "w") as module_file:
+            uic.compileUi(ui_path, module_file)
+        os.replace(temporary_path, module_path)
+
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return next(value for name, value in vars(module).items() if name.startswith("Ui_"))
 
 
 class UI_Interface(QMainWindow, Image_Operations):
@@ -48,9 +81,18 @@ class UI_Interface(QMainWindow, Image_Operations):
         @brief Constructor for the UI_Interface class. Initializes the UI and sets up signal-slot connections.
         """
         super().__init__()
-        uic.loadUi('UI_Interface_design.ui', self)
+
+        # The compiled design creates the widgets on the Ui object, they are exposed on the window like uic.loadUi does
+        with trace_span("startup.load_ui", "startup"):
+            ui = load_ui_class('UI_Interface_design.ui')()
+            ui.setupUi(self)
+            self.__dict__.update(vars(ui))
         self.show()
 
+        ###################### Image Viewers ########################
+
+        self.init_image_viewers()
+
         ###################### Side Bar #############################
 
         self.full_menu_widget.setVisible(False)
@@ -58,7 +100,36 @@ class UI_Interface(QMainWindow, Image_Operations):
         for button in self.side_menu_buttons:
             button.clicked.connect(self.sidebar_button_clicked)
         
-        self.init_buttons()
+        with trace_span("startup.init_buttons", "startup"):
+            self.init_buttons()
+
+        # Icons are loaded after the first paint
+        QTimer.singleShot(0, self.load_icons)
+
+        ###################### Background Operations ################
+
+        self.init_progress_bar()
+        self.operation_runner = Operation_Runner()
+
+        ###################### Preview Mode #########################
+
+        self.init_preview_mode()
+
+        ###################### Precision ############################
+
+        self.init_dtype_policy()
+
+        ###################### Worker Processes #####################
+
+        self.init_process_backend()
+
+        ###################### Live Parameters ######################
+
+        self.init_live_parameters()
+
+        ###################### Folder Browser #######################
+
+        self.init_image_browser()
 
         ###################### MENU OPERATIONS ######################
 
@@ -72,6 +143,20 @@ class UI_Interface(QMainWindow, Image_Operations):
         self.output_save_menu.triggered.connect(self.save_output_image)
         self.output_save_as_menu.triggered.connect(self.save_as_output_image)
         self.output_export_menu.triggered.connect(self.export_output_image)
+        self.output_export_formats_menu.triggered.connect(self.export_output_formats)
+
+        # Encoding runs in the background with the settings of the Export Settings dialog
+        self.init_exporter()
+        self.export_settings_menu.triggered.connect(self.edit_export_settings)
+
+        # Trace export
+        self.export_trace_menu = QtWidgets.QAction("Export Trace", self)
+        self.export_trace_menu.setObjectName("export_trace_menu")
+        self.export_trace_menu.triggered.connect(self.export_trace)
+        self.menuFile.insertAction(self.exit_menu, self.export_trace_menu)
+
+        # Video processing
+        self.init_video_preview()
         
         ###################### Common Operations #####################
         self.output_undo_menu.triggered.connect(self.undo_output_image)
@@ -87,6 +172,13 @@ class UI_Interface(QMainWindow, Image_Operations):
         # Disable the buttons
         self.change_buttons_state("default",True)
 
+        ###################### Session ##############################
+
+        # The previous session is reopened after the first paint
+        self.session = None
+        self.session_writer = None
+        QTimer.singleShot(0, self.restore_session)
+
     ###################### UI Operations ######################
 
     def get_buttons(self):
@@ -124,7 +216,8 @@ class UI_Interface(QMainWindow, Image_Operations):
         elif state == "default":
             edit_buttons = [
                 self.source_folder_menu, self.exit_menu, self.exit_button, self.source_side,
-                self.findChild(QtWidgets.QPushButton, "source_open"), self.source_folder_menu, self.menuFile
+                self.findChild(QtWidgets.QPushButton, "source_open"), self.findChild(QtWidgets.QPushButton, "source_open_folder"),
+                self.source_folder_menu, self.menuFile
             ]
         elif state == "full":
             edit_buttons = []
@@ -135,6 +228,334 @@ class UI_Interface(QMainWindow, Image_Operations):
             else:
                 button.setEnabled(not visible)
 
+    def init_image_viewers(self):
+        """
+        @brief Replaces the source and output labels of the design with tiled viewers that zoom and pan together.
+        """
+        for name in ("source_image_frame", "output_image_frame"):
+            label = getattr(self, name)
+            viewer = Image_Viewer(label.parentWidget())
+            viewer.setObjectName(name)
+            label.parentWidget().layout().replaceWidget(label, viewer)
+            label.deleteLater()
+            setattr(self, name, viewer)
+
+        link_viewers(self.source_image_frame, self.output_image_frame)
+
+    def init_progress_bar(self):
+        """
+        @brief Adds the progress bar and the cancel button of background operations to the status bar.
+        """
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setFixedHeight(15)
+
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.setObjectName("operation_cancel")
+        self.cancel_button.setFixedHeight(20)
+        self.cancel_button.clicked.connect(self.cancel_operation)
+
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+
+    def init_preview_mode(self):
+        """
+        @brief Adds the preview mode toggle to the Edit menu and the displayed resolution label to the status bar.
+        """
+        self.preview_mode_menu = QtWidgets.QAction("Preview Mode", self)
+        self.preview_mode_menu.setObjectName("preview_mode_menu")
+        self.preview_mode_menu.setCheckable(True)
+        self.preview_mode_menu.setChecked(True)
+        self.menuEdit.addSeparator()
+        self.menuEdit.addAction(self.preview_mode_menu)
+
+        self.resolution_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.resolution_label)
+
+    def init_dtype_policy(self):
+        """
+        @brief Adds the Precision submenu to the Edit menu. The interface uses float64 by default like scripts and batch,
+        8-bit results are displayed and saved the same and take a quarter of the memory of float32 results in the history.
+        """
+        self.precision_menu = self.menuEdit.addMenu("Precision")
+        self.precision_group = QtWidgets.QActionGroup(self)
+        self.precision_group.setExclusive(True)
+
+        labels = {'uint8': "8-bit Results", 'float32': "Float32", 'float64': "Float64 (Reference)"}
+        for dtype_policy in DTYPE_POLICIES:
+            action = QtWidgets.QAction(labels[dtype_policy], self)
+            action.setObjectName("precision_" + dtype_policy + "_menu")
+            action.setCheckable(True)
+            action.setChecked(dtype_policy == 'float64')
+            action.triggered.connect(lambda checked, dtype_policy=dtype_policy: self.set_dtype_policy(dtype_policy))
+            self.precision_group.addAction(action)
+            self.precision_menu.addAction(action)
+
+        self.set_dtype_policy('float64')
+
+    def init_process_backend(self):
+        """
+        @brief Adds the Run in Worker Processes toggle to the Edit menu. Operations then run in worker processes
+        that share the source and the results through shared memory, the processes start on the first operation.
+        """
+        self.process_backend_menu = QtWidgets.QAction("Run in Worker Processes", self)
+        self.process_backend_menu.setObjectName("process_backend_menu")
+        self.process_backend_menu.setCheckable(True)
+        self.process_backend_menu.setChecked(False)
+        self.menuEdit.addAction(self.process_backend_menu)
+
+        self.process_backend = None
+
+    def get_operation_function(self, operation):
+        """
+        @brief Returns the function running an operation, the operation itself or its worker process counterpart.
+        @param operation The Image_Operations method.
+        @return Callable taking the method and the parameters of the operation.
+        """
+        if not self.process_backend_menu.isChecked():
+            return operation
+        return self.apply_operation_in_process
+
+    def apply_operation_in_process(self, method, preview_size=None, progress_callback=None, **kwargs):
+        """
+        @brief Runs an operation in a worker process of the shared memory backend.
+        @param method The operation name.
+        @param preview_size The display size the operation runs at, None for the full resolution.
+        @param progress_callback Called while waiting, it raises when the operation is cancelled.
+        @return The result, viewing a shared memory segment.
+        """
+        if self.process_backend is None:
+            self.process_backend = Shared_Memory_Backend()
+
+        # Only the pyramid level the operation runs on is placed in shared memory
+        return self.process_backend.run(self.get_operation_source(preview_size), method, self.dtype_policy, progress_callback, **kwargs)
+
+    ###################### Session ##############################
+
+    def restore_session(self):
+        """
+        @brief Reopens the session file of the previous run. Only the current snapshot is decoded,
+        the other ones are loaded from the memory-mapped file when undo or redo reaches them.
+        A session that cannot be restored is set aside as session.bin.bad, so that it does not fail again on the next start.
+        """
+        valid_length = None
+        if os.path.exists(SESSION_PATH):
+            try:
+                self.session = Session(SESSION_PATH)
+                valid_length = self.session.valid_length
+                self.restore_session_state()
+            except Exception as error:
+                if self.session is not None:
+                    self.session.close()
+                    self.session = None
+                self.output_image_history.clear()
+                self.output_image_frame.clear()
+                valid_length = None
+
+                self.statusBar().showMessage("Could not reopen the previous session: " + str(error), 5000)
+                os.replace(SESSION_PATH, SESSION_PATH + ".bad")
+
+        self.session_writer = Session_Writer(SESSION_PATH, valid_length=valid_length)
+
+        # The outputs of a source that changed or was deleted are not restored, the file records that they are gone
+        if self.session is not None and self.session.snapshots and not self.has_source_image():
+            self.record_session("source")
+            self.record_session("clear")
+
+    def restore_session_state(self):
+        """
+        @brief Restores the source and the history of the opened session. The history is only restored
+        with its source, the outputs of a source that changed or was deleted since do not belong to the new file.
+        """
+        source_path = self.session.get_source_path()
+        source_image = self.session.get_source_image() if source_path is None else None
+        if source_path is not None or source_image is not None:
+            self.set_source_image(source_path if source_path is not None else source_image)
+            self.source_image_path = source_path
+            self.update_source_image()
+            self.change_buttons_state("source_opened", False)
+
+        if not self.has_source_image():
+            if self.session.snapshots:
+                self.statusBar().showMessage("The source of the previous session changed, its outputs were not restored", 5000)
+            return
+
+        for index, record in enumerate(self.session.snapshots):
+            loader = lambda index=index: self.session.get_snapshot(index)
+            self.output_image_history.append_external(loader, record["shape"], record["dtype"], record["metadata"])
+
+        if self.session.current_index >= 0:
+            self.output_image_history.set_current_index(self.session.current_index)
+            self.update_output_image()
+
+    def record_session(self, record, *args):
+        """
+        @brief Appends a change to the session file, see Session_Writer.
+        @param record Name of the record: "source", "push", "position" or "clear".
+        @param args Arguments of the Session_Writer.record_<record> method.
+        """
+        if self.session_writer is not None:
+            getattr(self.session_writer, "record_" + record)(*args)
+
+    def set_output_image(self, output, operation=None):
+        """
+        @brief Pushes an output on the history and records it in the session.
+        """
+        super().set_output_image(output, operation)
+        self.record_session("push", self.output_image_history.get_current_index(), self.get_output_image().get_nd_image(), operation)
+
+    def undo_output_image(self):
+        super().undo_output_image()
+        self.record_session("position", self.output_image_history.get_current_index())
+
+    def redo_output_image(self):
+        super().redo_output_image()
+        self.record_session("position", self.output_image_history.get_current_index())
+
+    def init_live_parameters(self):
+        """
+        @brief Adds the Parameters panel, shown while the output comes from an operation with parameters in LIVE_PARAMETERS.
+        Previews run on their own runner, so a newer value cancels the preview of the previous one.
+        """
+        self.live_parameters_dock = QtWidgets.QDockWidget("Parameters", self)
+        self.live_parameters_dock.setObjectName("live_parameters_dock")
+        self.live_parameters_dock.setWidget(QtWidgets.QWidget())
+        self.live_parameters_layout = QtWidgets.QFormLayout(self.live_parameters_dock.widget())
+        self.addDockWidget(Qt.RightDockWidgetArea, self.live_parameters_dock)
+        self.live_parameters_dock.setVisible(False)
+
+        self.live_method = None
+        self.live_sliders = {}
+        self.live_runner = Operation_Runner()
+
+        self.live_preview_timer = QTimer(self)
+        self.live_preview_timer.setSingleShot(True)
+        self.live_preview_timer.setInterval(LIVE_PREVIEW_DELAY)
+        self.live_preview_timer.timeout.connect(self.preview_live_parameters)
+
+        self.live_commit_timer = QTimer(self)
+        self.live_commit_timer.setSingleShot(True)
+        self.live_commit_timer.setInterval(LIVE_COMMIT_DELAY)
+        self.live_commit_timer.timeout.connect(self.commit_live_parameters)
+
+    def init_video_preview(self):
+        """
+        @brief Adds the Process Video action to the File menu. The output frame shows the processed frames
+        at the display rate, frames produced faster than they are displayed are dropped from the preview only.
+        """
+        self.process_video_menu = QtWidgets.QAction("Process Video...", self)
+        self.process_video_menu.setObjectName("process_video_menu")
+        self.process_video_menu.triggered.connect(self.process_video)
+        self.menuFile.insertAction(self.export_trace_menu, self.process_video_menu)
+
+        self.video_frames = Latest_Frame()
+        self.video_timer = QTimer(self)
+        self.video_timer.setInterval(33)
+        self.video_timer.timeout.connect(self.show_video_frame)
+
+    def init_image_browser(self):
+        """
+        @brief Adds the filmstrip of the opened folder below the images, hidden until a folder is opened.
+        """
+        self.image_browser = Image_Browser()
+        self.browser_runner = Operation_Runner()
+
+        # Thumbnails decode on their own pool so they never queue behind an operation
+        self.thumbnail_pool = QThreadPool()
+        self.thumbnail_pool.setMaxThreadCount(2)
+        self.thumbnail_workers = []
+
+        thumbnail_size = self.image_browser.thumbnail_size
+        self.filmstrip = QtWidgets.QListWidget(self)
+        self.filmstrip.setObjectName("filmstrip")
+        self.filmstrip.setViewMode(QtWidgets.QListView.IconMode)
+        self.filmstrip.setFlow(QtWidgets.QListView.LeftToRight)
+        self.filmstrip.setWrapping(False)
+        self.filmstrip.setMovement(QtWidgets.QListView.Static)
+        self.filmstrip.setIconSize(QSize(thumbnail_size, thumbnail_size))
+        self.filmstrip.setFixedHeight(thumbnail_size + 48)
+        self.filmstrip.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.filmstrip.currentRowChanged.connect(self.browse_image)
+        self.filmstrip.setVisible(False)
+        self.verticalLayout.addWidget(self.filmstrip)
+
+        self.source_previous_menu.triggered.connect(lambda: self.browse_step(-1))
+        self.source_next_menu.triggered.connect(lambda: self.browse_step(1))
+
+    def init_exporter(self):
+        """
+        @brief Creates the background encoder and the default export settings.
+        """
+        self.image_exporter = Image_Exporter()
+        self.export_pool = QThreadPool()
+        self.export_workers = []
+
+        self.export_settings = {
+            "jpeg_quality": DEFAULT_JPEG_QUALITY,
+            "png_compression": DEFAULT_PNG_COMPRESSION,
+            "formats": [".jpg", ".png"],
+        }
+
+    def get_preview_size(self):
+        """
+        @brief Returns the display size operations run at in preview mode, the size the source is shown at
+        with the current zoom. Zooming in makes the next operations preview at a finer pyramid level.
+        @return (width, height), or None when preview mode is off.
+        """
+        if not self.preview_mode_menu.isChecked():
+            return None
+        return self.source_image_frame.get_display_size()
+
+    def get_display_scale(self, preview_size):
+        """
+        @brief Returns the display pixels per pixel of an output computed at a preview size, so that it
+        covers the same area of the viewer as the source.
+        @param preview_size The preview size of the operation, None for the full resolution.
+        @return The scale of the pyramid level the operation ran on.
+        """
+        # Without a source the output is shown at its own resolution
+        if preview_size is None or not self.has_source_image():
+            return 1.0
+
+        source = self.get_source_image()
+        width = source.get_nd_image().shape[1]
+        level_width = width
+        for _ in range(source.get_pyramid_level(*preview_size)):
+            level_width = (level_width + 1) // 2
+        return width / level_width
+
+    def update_resolution_label(self):
+        """
+        @brief Shows the resolution of the displayed output and whether it is a preview proxy.
+        """
+        output_image = self.get_output_image()
+        if output_image is None:
+            self.resolution_label.clear()
+            return
+
+        h, w = output_image.get_nd_image().shape[:2]
+        operation = self.get_output_operation()
+
+        if operation is not None and operation.get("preview_size") is not None and self.has_source_image():
+            source_h, source_w = self.get_source_image().get_nd_image().shape[:2]
+            if (w, h) != (source_w, source_h):
+                self.resolution_label.setText("Output: {}x{} preview of {}x{}".format(w, h, source_w, source_h))
+                return
+
+        self.resolution_label.setText("Output: {}x{} full resolution".format(w, h))
+
+    def set_progress_bar_state(self, running):
+        """
+        @brief Shows or hides the progress bar and the cancel button.
+        @param running True while a background operation is running.
+        """
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(running)
+        self.cancel_button.setVisible(running)
+        self.cancel_button.setEnabled(running)
+
     ###################### Side Bar #############################
 
     def sidebar_button_clicked(self):
@@ -159,6 +580,7 @@ class UI_Interface(QMainWindow, Image_Operations):
 
         buttons = [
             {"name": "Open", "object_name": "source_open", "icon": "src/icons/open.svg", "function": self.load_image_button},
+            {"name": "Open Folder", "object_name": "source_open_folder", "icon": "src/icons/open.svg", "function": self.load_folder_button},
             {"name": "Export", "object_name": "source_export", "icon": "src/icons/export.svg", "function": self.export_source_image},
             {"name": "Clear", "object_name": "source_clear", "icon": "src/icons/clear.svg", "function": self.image_edit_operations},
 
@@ -180,13 +602,14 @@ class UI_Interface(QMainWindow, Image_Operations):
             {"name": "Sobel", "object_name": "edge_sobel", "icon": "src/icons/edge_detection.svg", "function": self.edge_detection_handler},
             {"name": "Scharr", "object_name": "edge_scharr", "icon": "src/icons/edge_detection.svg", "function": self.edge_detection_handler},
             {"name": "Prewitt", "object_name": "edge_prewitt", "icon": "src/icons/edge_detection.svg", "function": self.edge_detection_handler},
+            {"name": "Compare All", "object_name": "edge_compare_all", "icon": "src/icons/edge_detection.svg", "function": self.edge_detection_handler},
         ]
         for button_dict in buttons:
 
             button = QtWidgets.QPushButton(button_dict['name'])
             button.setObjectName(button_dict['object_name'])
             button.clicked.connect(button_dict['function'])
-            button.setIcon(QtGui.QIcon(button_dict['icon']))
+            button.setProperty("icon_path", button_dict['icon'])
 
             self.toolbox_layout.addWidget(button)
         
@@ -195,6 +618,21 @@ class UI_Interface(QMainWindow, Image_Operations):
             if menu_button:
                 menu_button.triggered.connect(button_dict['function'])
 
+    @traced("startup.load_icons", "startup")
+    def load_icons(self):
+        """
+        @brief Loads the icons of the toolbox buttons, deferred so they do not delay the first paint.
+        """
+        icons = {}
+        for i in range(self.toolbox_layout.count()):
+            button = self.toolbox_layout.itemAt(i).widget()
+            icon_path = button.property("icon_path")
+
+            if icon_path:
+                if icon_path not in icons:
+                    icons[icon_path] = QtGui.QIcon(icon_path)
+                button.setIcon(icons[icon_path])
+
     def edit_full_menu_buttons(self, sender):
         """
         @brief Edits the buttons displayed in the full menu based on the sidebar button clicked.
@@ -206,7 +644,7 @@ class UI_Interface(QMainWindow, Image_Operations):
         
         if sender == self.source_side:
             # Buttons to show
-            button_object_names = ["source_open", "source_export", "source_clear"]
+            button_object_names = ["source_open", "source_open_folder", "source_export", "source_clear"]
             
             # Show buttons to the container
             for i, button_name in enumerate(button_object_names):
@@ -246,7 +684,7 @@ class UI_Interface(QMainWindow, Image_Operations):
 
         elif sender == self.edge_detection_side:
             # Buttons to show
-            button_object_names = ["edge_roberts", "edge_sobel", "edge_scharr", "edge_prewitt"]
+            button_object_names = ["edge_roberts", "edge_sobel", "edge_scharr", "edge_prewitt", "edge_compare_all"]
             
             # Show buttons to the container
             for i, button_name in enumerate(button_object_names):
@@ -271,21 +709,128 @@ class UI_Interface(QMainWindow, Image_Operations):
 
             # Assign the source image path
             self.source_image_path = image_path
+            self.record_session("source", image_path)
+
+            # Enable the buttons
+            self.change_buttons_state("source_opened", False)
+
+    def load_folder_button(self):
+        """
+        @brief Opens a folder and shows its images in the filmstrip, the first one becomes the source image.
+        """
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Open folder', '')
+        if folder:
+            self.open_folder(folder)
+
+    def open_folder(self, folder):
+        """
+        @brief Lists the images of a folder in the filmstrip and starts decoding their thumbnails.
+        @param folder Path of the folder.
+        """
+        if not self.image_browser.open_folder(folder):
+            self.statusBar().showMessage("No images found in " + folder, 3000)
+            return
+
+        # Thumbnails of the previous folder that did not start yet are dropped
+        self.thumbnail_pool.clear()
+        for worker in self.thumbnail_workers:
+            worker.cancel()
+        self.thumbnail_workers = []
+
+        self.filmstrip.blockSignals(True)
+        self.filmstrip.clear()
+        for index, path in enumerate(self.image_browser.paths):
+            item = QtWidgets.QListWidgetItem(os.path.basename(path))
+            item.setToolTip(path)
+            self.filmstrip.addItem(item)
+
+            worker = Operation_Worker(self.image_browser.get_thumbnail, index)
+            worker.signals.finished.connect(lambda img, item=item: self.set_thumbnail(item, img))
+            self.thumbnail_workers.append(worker)
+            self.thumbnail_pool.start(worker)
+        self.filmstrip.blockSignals(False)
+
+        self.filmstrip.setVisible(True)
+        self.filmstrip.setCurrentRow(0)
+
+    def set_thumbnail(self, item, img):
+        """
+        @brief Slot called on the GUI thread when the thumbnail of a filmstrip item is decoded.
+        @param item The QListWidgetItem of the image.
+        @param img The thumbnail.
+        """
+        # The item is gone if another folder was opened in the meantime
+        if self.filmstrip.row(item) >= 0:
+            item.setIcon(QtGui.QIcon(QPixmap.fromImage(Image(img).get_QImage())))
+
+    def browse_image(self, row):
+        """
+        @brief Makes a folder image the source image. Prefetched images are shown at once, others are decoded in the background.
+        @param row The index of the image in the folder.
+        """
+        if row < 0:
+            return
+
+        path = self.image_browser.get_path(row)
+
+        def loaded(img):
+            # A running operation belongs to the previous source
+            self.operation_runner.cancel()
+            self.statusBar().clearMessage()
+            self.set_source_image(img)
+            self.update_source_image()
+
+            # Assign the source image path
+            self.source_image_path = path
+            self.record_session("source", path)
 
             # Enable the buttons
             self.change_buttons_state("source_opened", False)
 
+        # The file may have been deleted or become unreadable since the folder was opened
+        try:
+            cached = self.image_browser.is_cached(row)
+            if cached:
+                self.browser_runner.cancel()
+                img = self.image_browser.get_image(row)
+        except (OSError, ValueError) as error:
+            self.operation_failed(error)
+            return
+
+        if cached:
+            loaded(img)
+        else:
+            self.statusBar().showMessage("Loading " + os.path.basename(path) + "...")
+            self.browser_runner.submit(self.image_browser.get_image, row, on_finished=loaded, on_error=self.operation_failed)
+
+    def browse_step(self, step):
+        """
+        @brief Moves to the next or previous image of the opened folder.
+        @param step 1 for the next image, -1 for the previous one.
+        """
+        if len(self.image_browser):
+            self.filmstrip.setCurrentRow(min(max(self.filmstrip.currentRow() + step, 0), len(self.image_browser) - 1))
+
     def save_output_image(self):
         """
         @brief Saves the output image to the source image path.
         """
         if self.source_image_path:
-            self.get_output_image().save_image(self.source_image_path)
+            source_image_path = self.source_image_path
 
-            # UX - Clear the output image and update the source image
-            self.findChild(QtWidgets.QPushButton, "output_clear").click()
-            self.set_source_image(self.source_image_path)
-            self.update_source_image()
+            # The output of a previous source would overwrite another file
+            operation = self.get_output_operation()
+            if operation is not None and not self.is_output_of_source(operation):
+                self.statusBar().showMessage("The output belongs to a previous source, use Save As", 5000)
+                return
+
+            def saved():
+                # UX - Clear the output image and update the source image
+                self.findChild(QtWidgets.QPushButton, "output_clear").click()
+                self.set_source_image(source_image_path)
+                self.update_source_image()
+
+            self.render_output_image(lambda output_image: self.save_in_background(output_image, [source_image_path], saved))
 
 
     def save_as_output_image(self):
@@ -301,7 +846,7 @@ class UI_Interface(QMainWindow, Image_Operations):
 
             # If the folder path is not empty, save the output image, check extension is jpg
             if image_save_path.endswith('.jpg'):
-                self.get_output_image().save_image(image_save_path)
+                self.render_output_image(lambda output_image, path=image_save_path: self.save_in_background(output_image, [path]))
                 break
             else:
                 print("Please select a valid path with .jpg extension")
@@ -319,7 +864,7 @@ class UI_Interface(QMainWindow, Image_Operations):
 
             # If the folder path is not empty, save the output image, check extension is jpg or png or bmp
             if (image_save_path.endswith('.jpg') or image_save_path.endswith('.png') or image_save_path.endswith('.bmp')):
-                self.get_output_image().save_image(image_save_path)
+                self.render_output_image(lambda output_image, path=image_save_path: self.save_in_background(output_image, [path]))
                 break
             else:
                 print("Please select a valid path with .jpg or .png or .bmp extension : ", image_save_path)
@@ -337,85 +882,460 @@ class UI_Interface(QMainWindow, Image_Operations):
 
             # If the folder path is not empty, save the output image, check extension is jpg or png or bmp
             if (image_save_path.endswith('.jpg') or image_save_path.endswith('.png') or image_save_path.endswith('.bmp')):
-                self.get_source_image().save_image(image_save_path)
+                self.save_in_background(self.get_source_image(), [image_save_path])
                 break
             else:
                 print("Please select a valid path with .jpg or .png or .bmp extension : ", image_save_path)
 
+    def export_output_formats(self):
+        """
+        @brief Exports the output image in every format selected in the export settings, encoded in parallel.
+        """
+        image_save_path = QtWidgets.QFileDialog.getSaveFileName(self, 'Export in all formats', "output", "Base name (*)")[0]
+
+        if image_save_path and self.export_settings["formats"]:
+            base_path = os.path.splitext(image_save_path)[0]
+            paths = [base_path + extension for extension in self.export_settings["formats"]]
+            self.render_output_image(lambda output_image: self.save_in_background(output_image, paths))
+
+    def edit_export_settings(self):
+        """
+        @brief Opens a dialog to set the JPEG quality, the PNG compression level and the formats of the multi-format export.
+        """
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle("Export Settings")
+        layout = QtWidgets.QFormLayout(dialog)
+
+        jpeg_quality = QtWidgets.QSpinBox(dialog)
+        jpeg_quality.setRange(0, 100)
+        jpeg_quality.setValue(self.export_settings["jpeg_quality"])
+        layout.addRow("JPEG / WebP quality", jpeg_quality)
+
+        png_compression = QtWidgets.QSpinBox(dialog)
+        png_compression.setRange(0, 9)
+        png_compression.setValue(self.export_settings["png_compression"])
+        png_compression.setToolTip("0 is the fastest and largest, 9 the slowest and smallest")
+        layout.addRow("PNG compression", png_compression)
+
+        format_boxes = {}
+        for extension in EXPORT_FORMATS:
+            format_boxes[extension] = QtWidgets.QCheckBox(extension, dialog)
+            format_boxes[extension].setChecked(extension in self.export_settings["formats"])
+            layout.addRow("All formats export" if len(format_boxes) == 1 else "", format_boxes[extension])
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, dialog)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addRow(buttons)
+
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            self.export_settings = {
+                "jpeg_quality": jpeg_quality.value(),
+                "png_compression": png_compression.value(),
+                "formats": [extension for extension, box in format_boxes.items() if box.isChecked()],
+            }
+
+    def save_in_background(self, image, paths, on_saved=None):
+        """
+        @brief Encodes and writes an image on the export pool with the current export settings, the UI stays responsive.
+        @param image The Image to save.
+        @param paths The output paths, several paths are encoded in parallel.
+        @param on_saved Optional callable called on the GUI thread once every file is written.
+        """
+        worker = Operation_Worker(
+            self.image_exporter.export, image, paths,
+            jpeg_quality=self.export_settings["jpeg_quality"], png_compression=self.export_settings["png_compression"],
+        )
+
+        def saved(paths):
+            self.export_workers.remove(worker)
+            self.statusBar().showMessage("Saved " + ", ".join(os.path.basename(path) for path in paths), 3000)
+            if on_saved is not None:
+                on_saved()
+
+        def failed(error):
+            self.export_workers.remove(worker)
+            self.statusBar().showMessage("Save failed: " + str(error), 5000)
+
+        worker.signals.finished.connect(saved)
+        worker.signals.error.connect(failed)
+
+        # Workers are referenced until they finish so their signals stay connected
+        self.export_workers.append(worker)
+        self.export_pool.start(worker)
+        self.statusBar().showMessage("Saving " + ", ".join(os.path.basename(path) for path in paths) + "...")
+
+    def render_output_image(self, on_rendered):
+        """
+        @brief Passes the full resolution output to on_rendered. If a preview proxy is displayed,
+        the operation that produced it is first re-run at full resolution in the background.
+        @param on_rendered Callable receiving the full resolution Image.
+        """
+        operation = self.get_output_operation()
+
+        if operation is None or operation.get("preview_size") is None:
+            on_rendered(self.get_output_image())
+            return
+
+        # The output of another source than the loaded one cannot be rendered again, the displayed pixels are saved
+        if not self.is_output_of_source(operation):
+            self.statusBar().showMessage("The output belongs to a previous source, it is saved at its preview resolution", 5000)
+            on_rendered(self.get_output_image())
+            return
+
+        source = self.get_source_image()
+
+        def rendered(img):
+            # Conversions return None when the source is already in the requested color space
+            on_rendered(Image(img) if img is not None else source)
+
+        arguments = {name: value for name, value in operation.items() if name != "source_hash"}
+        self.run_operation(self.get_operation_function(self.apply_operation), on_finished=rendered, **dict(arguments, preview_size=None))
+
+    def is_output_of_source(self, operation):
+        """
+        @brief Checks if an output was produced from the loaded source image.
+        @param operation The method and parameters of a history entry, with the hash of its source.
+        @return True if the source is loaded and unchanged, entries recorded without a hash are taken as its own.
+        """
+        if not self.has_source_image():
+            return False
+        return operation.get("source_hash") in (None, self.get_source_image().get_hash())
+
+    def process_video(self):
+        """
+        @brief Applies the operation that produced the output to every frame of a video, with a live preview.
+        Without an output file the frames are only previewed, at the preview size.
+        """
+        operation = self.get_output_operation()
+        if operation is None:
+            self.statusBar().showMessage("Apply an operation to the image first, it is then applied to every frame", 5000)
+            return
+
+        input_path = QtWidgets.QFileDialog.getOpenFileName(self, 'Open video', '', "Video files (*.mp4 *.avi *.mkv *.mov)")[0]
+        if not input_path:
+            return
+        output_path = QtWidgets.QFileDialog.getSaveFileName(self, 'Save processed video (cancel to preview only)', "", "Video files (*.mp4 *.avi)")[0] or None
+
+        params = {name: value for name, value in operation.items() if name not in ("method", "preview_size", "source_hash")}
+        chain = Pipeline([Pipeline_Step(operation["method"].replace("_menu", ""), params)])
+
+        def finished(summary):
+            self.video_timer.stop()
+            self.show_video_frame()
+            message = "Processed {} frames in {:.1f} s, {:.1f} fps, {} dropped from the preview".format(
+                summary["frames"], summary["elapsed"], summary["fps"], self.video_frames.dropped)
+            self.statusBar().showMessage(message + (" -> " + output_path if output_path else ""))
+
+        self.video_frames = Latest_Frame()
+        self.video_timer.start()
+        self.run_operation(
+            stream_video, on_finished=finished, input_path=input_path, chain=chain, output_path=output_path,
+            dtype_policy=self.dtype_policy, preview_size=None if output_path else self.get_preview_size(),
+            frame_callback=self.video_frames.put,
+        )
+
+    def show_video_frame(self):
+        """
+        @brief Displays the latest processed video frame, if a new one arrived since the last call.
+        """
+        frame = self.video_frames.take()
+        if frame is not None:
+            image = Image(frame)
+            self.display_output_image(image)
+            self.resolution_label.setText("Video: {}x{}".format(*image.get_nd_image().shape[1::-1]))
+        elif not self.operation_runner.is_running():
+            # Cancelled or failed
+            self.video_timer.stop()
+
+    def export_trace(self):
+        """
+        @brief Opens a file dialog to export the traced stages of the session as a Chrome trace JSON file.
+        """
+        trace_path = QtWidgets.QFileDialog.getSaveFileName(self, 'Export trace', "trace.json", "Chrome trace (*.json)")[0]
+
+        if trace_path:
+            tracer.export_chrome_trace(trace_path)
+            self.statusBar().showMessage("Trace exported to " + trace_path, 3000)
+
     ###################### Image Operations ######################
 
-    @progress_bar_decorator(0.4)
+    @traced("UI_Interface.update_source_image", "display")
     def update_source_image(self):
         """
         @brief Updates the source image display in the UI.
         """
-        label_size = (self.source_image_frame.width(), self.source_image_frame.height())
-
-        self.source_image_frame.setPixmap(
-            QPixmap.fromImage(
-                self.get_source_image().get_QImage()
-            ).scaled(label_size[0], label_size[1])
-        )
-        self.source_image_frame.setAlignment(Qt.AlignCenter)
+        self.source_image_frame.set_image(self.get_source_image())
     
-    @progress_bar_decorator(0.4)
+    @traced("UI_Interface.update_output_image", "display")
     def update_output_image(self):
         """
         @brief Updates the output image display in the UI.
         """
-        label_size = (self.output_image_frame.width(), self.output_image_frame.height())
-        
-        self.output_image_frame.setPixmap(
-            QPixmap.fromImage(
-                self.get_output_image().get_QImage()
-            ).scaled(label_size[0], label_size[1])
-        )
-        self.output_image_frame.setAlignment(Qt.AlignCenter)
+        operation = self.get_output_operation()
+        preview_size = operation.get("preview_size") if operation is not None else None
+        self.display_output_image(self.get_output_image(), self.get_display_scale(preview_size))
+        self.update_resolution_label()
+        self.update_live_parameters()
 
         self.change_buttons_state("full", False)
-        
 
-    def conversion_handler(self):
+    def display_output_image(self, image, scale=1.0):
         """
-        @brief Handles image conversion operations.
+        @brief Shows an image in the output frame without changing the history.
+        @param image The Image to display.
+        @param scale Display pixels per image pixel, see get_display_scale.
+        """
+        self.output_image_frame.set_image(image, scale)
+
+    ###################### Live Parameters ######################
+
+    def update_live_parameters(self):
+        """
+        @brief Shows the sliders of the operation that produced the output, set to the values it used.
+        """
+        operation = self.get_output_operation()
+        method = operation.get("method", "").replace("_menu", "") if operation is not None else None
+
+        if method not in LIVE_PARAMETERS:
+            self.live_method = None
+            self.live_parameters_dock.setVisible(False)
+            return
+
+        if method != self.live_method:
+            while self.live_parameters_layout.rowCount():
+                self.live_parameters_layout.removeRow(0)
+            self.live_sliders = {}
+            self.live_value_labels = {}
+
+            for name, label, minimum, maximum, default in LIVE_PARAMETERS[method]:
+                slider = QtWidgets.QSlider(Qt.Horizontal)
+                slider.setObjectName("live_" + name)
+                slider.setRange(minimum, maximum)
+                value_label = QtWidgets.QLabel()
+                slider.valueChanged.connect(value_label.setNum)
+                slider.valueChanged.connect(self.live_parameter_changed)
+                slider.sliderReleased.connect(self.commit_live_parameters)
+
+                row = QtWidgets.QHBoxLayout()
+                row.addWidget(slider)
+                row.addWidget(value_label)
+                self.live_parameters_layout.addRow(label, row)
+                self.live_sliders[name] = slider
+                self.live_value_labels[name] = value_label
+
+            self.live_method = method
+
+        # Setting the values of the displayed output is not a change
+        for name, value in self.get_operation_parameters(operation).items():
+            slider = self.live_sliders[name]
+            slider.blockSignals(True)
+            slider.setValue(value)
+            slider.blockSignals(False)
+            self.live_value_labels[name].setNum(value)
+
+        self.live_parameters_dock.setVisible(True)
+
+    def get_operation_parameters(self, operation):
+        """
+        @brief Returns the live parameters an operation used, with the defaults of those it did not set.
+        @param operation The method and parameters of a history entry.
+        @return Dict of parameter name to value.
+        """
+        return {
+            name: operation.get(name) if operation.get(name) is not None else default
+            for name, label, minimum, maximum, default in LIVE_PARAMETERS[self.live_method]
+        }
+
+    def get_live_parameters(self):
+        """
+        @brief Returns the values of the sliders.
+        @return Dict of parameter name to value.
+        """
+        return {name: slider.value() for name, slider in self.live_sliders.items()}
+
+    def live_parameter_changed(self, value):
+        """
+        @brief Slot called on every slider change. Changes are coalesced, only the value the slider
+        rests on for LIVE_PREVIEW_DELAY ms is previewed.
+        @param value The new value of the slider.
+        """
+        self.live_preview_timer.start()
+
+        # A dragged slider commits when it is released, keyboard and wheel changes when they settle
+        if any(slider.isSliderDown() for slider in self.live_sliders.values()):
+            self.live_commit_timer.stop()
+        else:
+            self.live_commit_timer.start()
+
+    def preview_live_parameters(self):
+        """
+        @brief Runs the operation with the slider values on a downscaled proxy and shows the result without adding it to the history.
+        """
+        if self.live_method is None or not self.has_source_image():
+            return
+
+        parameters = self.get_live_parameters()
+        display_size = self.source_image_frame.get_display_size()
+        preview_size = (max(int(display_size[0] * LIVE_PROXY_SCALE), 1), max(int(display_size[1] * LIVE_PROXY_SCALE), 1))
+
+        def previewed(img):
+            # A result whose values were changed since it started is dropped, the newer values are on their way
+            if img is None or parameters != self.get_live_parameters():
+                return
+            image = Image(img)
+            self.display_output_image(image, self.get_display_scale(preview_size))
+            self.resolution_label.setText("Output: {}x{} live preview".format(*image.get_nd_image().shape[1::-1]))
+
+        # Submitting cancels the preview of the previous values, its result never reaches the display
+        self.live_runner.submit(
+            self.apply_operation, method=self.live_method, preview_size=preview_size, **parameters,
+            on_finished=previewed, on_error=self.operation_failed,
+        )
+
+    def commit_live_parameters(self):
+        """
+        @brief Runs the operation with the settled slider values like a toolbox button, adding one entry to the history.
+        """
+        self.live_preview_timer.stop()
+        self.live_commit_timer.stop()
+        self.live_runner.cancel()
+
+        if self.live_method is None or not self.has_source_image():
+            return
+
+        parameters = self.get_live_parameters()
+
+        # Back to the values of the current entry, the preview is replaced by it
+        if parameters == self.get_operation_parameters(self.get_output_operation() or {}):
+            self.update_output_image()
+            return
+
+        self.run_operation(self.get_operation_function(self.apply_operation), method=self.live_method, preview_size=self.get_preview_size(), **parameters)
+
+    def run_operation(self, operation, on_finished=None, **kwargs):
         """
+        @brief Runs an image operation on the worker pool and displays its result when it finishes.
+        @param operation The Image_Operations method to run.
+        @param on_finished Optional callable receiving the result instead of displaying it.
+        @param kwargs Keyword arguments passed to the operation.
+        """
+        if on_finished is None:
+            # The entry records the source it was computed from, a save renders it again only from that source
+            metadata = dict(kwargs)
+            if self.has_source_image():
+                metadata["source_hash"] = self.get_source_image().get_hash()
+            on_finished = lambda img: self.operation_finished(img, metadata)
+
+        # Stages traced from here on make up the breakdown shown when the operation finishes
+        self.operation_trace_start = tracer.now()
+
+        def finished(img):
+            self.set_progress_bar_state(False)
+            on_finished(img)
+
+        self.set_progress_bar_state(True)
+        self.statusBar().showMessage("Running " + kwargs.get("method", operation.__name__) + "...")
+
+        self.operation_runner.submit(
+            operation, **kwargs,
+            on_progress=self.progress_bar.setValue,
+            on_finished=finished,
+            on_error=self.operation_failed,
+            on_cancelled=self.operation_cancelled,
+        )
+
+    def operation_finished(self, img, operation=None):
+        """
+        @brief Slot called on the GUI thread when a background operation finishes.
+        @param img The result of the operation.
+        @param operation The method and parameters that produced the result.
+        """
+        if img is not None:
+            self.set_output_image(img, operation)
+            self.update_output_image()
 
+        stats = self.result_cache.get_stats()
+        self.statusBar().showMessage("{} | cache {} hits, {} misses".format(
+            tracer.format_breakdown(since=self.operation_trace_start), stats['hits'], stats['misses']
+        ))
+
+    def operation_failed(self, error):
+        """
+        @brief Slot called on the GUI thread when a background operation raises an exception.
+        @param error The exception raised by the operation.
+        """
+        self.set_progress_bar_state(False)
+        self.statusBar().showMessage("Operation failed: " + str(error), 5000)
+
+    def operation_cancelled(self):
+        """
+        @brief Slot called on the GUI thread when a background operation is cancelled.
+        """
+        self.set_progress_bar_state(False)
+        self.statusBar().showMessage("Operation cancelled", 3000)
+
+    def cancel_operation(self):
+        """
+        @brief Requests cancellation of the running background operation.
+        """
+        self.cancel_button.setEnabled(False)
+        self.operation_runner.cancel()
 
+    def conversion_handler(self):
+        """
+        @brief Handles image conversion operations.
+        """
         sender = self.sender()
-        img = self.conversion_actions(method=sender.objectName())
-        
-        self.set_output_image(img)
-        self.update_output_image()
+        self.run_operation(self.get_operation_function(self.conversion_actions), method=sender.objectName(), preview_size=self.get_preview_size())
 
     def segmentation_handler(self):
         """
         @brief Handles image segmentation operations.
         """
-        
         sender = self.sender()
-        img = self.segment_image(method=sender.objectName())
-        
-        self.set_output_image(img)
-        self.update_output_image()
+        self.run_operation(self.get_operation_function(self.segment_image), method=sender.objectName(), preview_size=self.get_preview_size())
 
     def edge_detection_handler(self):
-        """,
+        """
         @brief Handles image edge detection operations.
         """
-        
         sender = self.sender()
-        img = self.edge_detection_actions(method=sender.objectName())
-
-        self.set_output_image(img)
-        self.update_output_image()
+        self.run_operation(self.get_operation_function(self.edge_detection_actions), method=sender.objectName(), preview_size=self.get_preview_size())
 
     ###################### Common Operations #####################
 
     def exit_app(self):
         """
-        @brief Exits the application.
+        @brief Exits the application, the window is closed like from its title bar, see closeEvent.
         """
-        sys.exit()
+        self.close()
+
+    def closeEvent(self, event):
+        """
+        @brief Shuts the background work down and writes the session before the window closes,
+        whether it is closed from the title bar or from Exit.
+        @param event The QCloseEvent.
+        """
+        self.operation_runner.cancel()
+        self.live_runner.cancel()
+        self.image_browser.shutdown()
+        if self.process_backend is not None:
+            self.process_backend.close()
+            self.process_backend = None
+
+        # Files being saved are written completely before exiting
+        self.export_pool.waitForDone()
+        self.image_exporter.shutdown()
+
+        # Pending records are written, the file is rewritten if most of it belongs to dropped snapshots
+        if self.session_writer is not None:
+            self.session_writer.close()
+            if self.session is not None:
+                self.session.close()
+            self.session_writer = None
+            compact_session(SESSION_PATH)
+        super().closeEvent(event)
 
     def image_edit_operations(self):
         """
@@ -434,13 +1354,25 @@ class UI_Interface(QMainWindow, Image_Operations):
             self.update_output_image()
         
         elif object_name == "source_clear":
+            self.operation_runner.cancel()
+            self.live_runner.cancel()
             self.set_source_image(None)
             self.source_image_path = None
+
+            # The sliders belong to the output of the cleared source
+            self.live_preview_timer.stop()
+            self.live_commit_timer.stop()
+            self.live_method = None
+            self.live_parameters_dock.setVisible(False)
+            self.record_session("source")
             self.change_buttons_state("default", True)
             self.source_image_frame.clear()
 
         elif object_name == "output_clear":
-            self.output_image_history = {"image_history":[], "current_index":0}
+            self.output_image_history.clear()
+            self.record_session("clear")
+            self.resolution_label.clear()
+            self.update_live_parameters()
             self.change_buttons_state("source_opened", False)
             self.source_side.click()
             self.output_image_frame.clear()
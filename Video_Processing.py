@@ -0,0 +1,291 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+
+from Image import Image
+from Image_Operations import Image_Operations, OPERATION_METHODS, DTYPE_POLICIES
+from Pipeline import Pipeline, Pipeline_Step
+
+# Video extensions and the codec written for them
+VIDEO_CODECS = {
+    '.avi': 'MJPG',
+    '.mp4': 'mp4v',
+    '.mkv': 'mp4v',
+    '.mov': 'mp4v',
+}
+
+# Frames waiting between decode and compute, and between compute and encode.
+# Full queues block the faster stage, so the memory does not grow with the video length
+QUEUE_SIZE = 4
+
+# Marks the end of a stream in the queues
+_END = object()
+
+
+# Function to read the frames of a capture into a ring of preallocated buffers.
+# A buffer is overwritten buffers frames later, so a frame must be consumed or copied before that
+def read_frames(capture, buffers:int = QUEUE_SIZE + 2):
+    width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    ring = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(buffers)]
+
+    index = 0
+    while True:
+        success, frame = capture.read(ring[index % buffers])
+        if not success:
+            return
+        yield frame
+        index += 1
+
+
+# Function to iterate over a generator running in a thread, at most maxsize items ahead of the consumer.
+# Closing the returned generator stops the thread
+def run_in_thread(iterable, maxsize:int = QUEUE_SIZE, name:str = None):
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # A consumer that stopped early no longer takes items, the thread checks for it while the queue is full
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Function to get the steps of an operation chain: an operation name, a Pipeline or a serialized Pipeline (dict)
+def get_steps(chain) -> list:
+    if isinstance(chain, str):
+        method = chain.replace('_menu', '')
+        if method not in OPERATION_METHODS:
+            raise ValueError('Invalid operation, method: ', chain)
+        return [Pipeline_Step(method)]
+    if isinstance(chain, dict):
+        chain = Pipeline.from_dict(chain)
+    return list(chain.steps)
+
+
+# Function to apply the steps to frames. The operator has no result cache, frames of a video never repeat
+def process_frames(frames, steps:list, dtype_policy:str = 'float64', preview_size:tuple = None):
+    image_operator = Image_Operations(cache_max_bytes=0, dtype_policy=dtype_policy)
+
+    for frame in frames:
+        image = Image(frame)
+
+        # Only the first step downscales, the next ones run on its output
+        size = preview_size
+        for step in steps:
+            image_operator.set_source_image(image)
+            output = image_operator.apply_operation(step.method, preview_size=size, **step.params)
+
+            # Conversions return None when the frame is already in the requested color space
+            if output is not None:
+                image, size = Image(output), None
+
+        # An output that is the frame itself is copied, its buffer is reused by the decoder
+        output = image.get_nd_image()
+        yield output.copy() if np.shares_memory(output, frame) else output
+
+
+# Function to convert an operation output to the 8-bit BGR frame the writer expects
+def to_video_frame(output:np.ndarray) -> np.ndarray:
+    frame = Image(output).get_uint8_image()
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else frame
+
+
+# Function to write frames, the writer is opened with the size of the first one
+def write_frames(frames, output_path:str, fps:float, codec:str = None):
+    codec = codec or VIDEO_CODECS.get(os.path.splitext(output_path)[1].lower(), 'mp4v')
+    writer = None
+
+    try:
+        for frame in frames:
+            frame = to_video_frame(frame)
+            if writer is None:
+                writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*codec), fps, (frame.shape[1], frame.shape[0]))
+                if not writer.isOpened():
+                    raise ValueError('Could not open video writer: ' + output_path)
+            writer.write(frame)
+            yield frame
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+class Latest_Frame:
+    """
+    Single slot between the stream and a display slower than it. A frame that was not displayed
+    before the next one arrives is dropped, so the stream never waits for the display
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__frame = None
+        self.dropped = 0
+
+    def put(self, frame:np.ndarray):
+        with self.__lock:
+            if self.__frame is not None:
+                self.dropped += 1
+            self.__frame = frame
+
+    def take(self) -> np.ndarray:
+        with self.__lock:
+            frame, self.__frame = self.__frame, None
+            return frame
+
+
+def stream_video(input_path:str, chain, output_path:str = None, dtype_policy:str = 'float64', preview_size:tuple = None,
+                 queue_size:int = QUEUE_SIZE, codec:str = None, frame_callback=None, progress_callback=None) -> dict:
+    """
+    Function to run an operation chain over the frames of a video.
+    Decoding, the operations and encoding run as three overlapping stages connected by bounded queues:
+    frames are decoded into reused buffers in one thread, processed in the calling thread and encoded in another.
+    :param input_path: str - Video file
+    :param chain: str, Pipeline or dict - Operation name or pipeline applied to every frame
+    :param output_path: str - Output video, None only processes the frames (e.g. for a preview)
+    :param dtype_policy: str - Precision of the operations, see Image_Operations.DTYPE_POLICIES
+    :param preview_size: tuple - (width, height) the first step runs at, None keeps the full resolution
+    :param queue_size: int - Frames buffered between two stages
+    :param codec: str - FourCC of the output, None picks it from the extension, see VIDEO_CODECS
+    :param frame_callback: callable(np.ndarray) - Called with every output frame, e.g. Latest_Frame.put
+    :param progress_callback: callable(int) - Called with the progress in percent after each frame, it may raise to cancel
+    :return: dict - Summary with frames, elapsed time and frames per second
+    """
+    if dtype_policy not in DTYPE_POLICIES:
+        raise ValueError('Invalid dtype policy, dtype_policy: ', dtype_policy)
+    steps = get_steps(chain)
+
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError('Could not open video: ' + input_path)
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # The ring holds the frames queued for compute, the one being processed and the one being decoded
+    frames = run_in_thread(read_frames(capture, queue_size + 2), queue_size, 'video_decode')
+    outputs = process_frames(frames, steps, dtype_policy, preview_size)
+
+    encoded = queue.Queue(maxsize=queue_size)
+    encode_errors = []
+    encoder = None
+    if output_path is not None:
+        def frames_to_encode():
+            while True:
+                frame = encoded.get()
+                if frame is _END:
+                    return
+                yield frame
+
+        def encode():
+            try:
+                for _ in write_frames(frames_to_encode(), output_path, fps, codec):
+                    pass
+            except BaseException as e:
+                encode_errors.append(e)
+                # Unblock the compute stage waiting on a full queue
+                while encoded.get() is not _END:
+                    pass
+
+        encoder = threading.Thread(target=encode, name='video_encode', daemon=True)
+        encoder.start()
+
+    start = time.perf_counter()
+    processed = 0
+    try:
+        for output in outputs:
+            if encode_errors:
+                break
+            if encoder is not None:
+                encoded.put(output)
+            if frame_callback is not None:
+                frame_callback(output)
+
+            processed += 1
+            if progress_callback is not None:
+                progress_callback(min(100 * processed // frame_count, 99) if frame_count > 0 else 0)
+    finally:
+        outputs.close()
+        frames.close()
+        capture.release()
+        if encoder is not None:
+            encoded.put(_END)
+            encoder.join()
+
+    if encode_errors:
+        raise encode_errors[0]
+
+    elapsed = time.perf_counter() - start
+    if progress_callback is not None:
+        progress_callback(100)
+
+    return {
+        'frames': processed,
+        'elapsed': elapsed,
+        'fps': processed / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv:list = None) -> int:
+    parser = argparse.ArgumentParser(prog='video', description='Run an operation or a pipeline over the frames of a video')
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument('--op', choices=OPERATION_METHODS, help='Operation to apply to every frame')
+    operation.add_argument('--pipeline', default=None, help='Pipeline JSON file to apply to every frame')
+    parser.add_argument('--in', dest='input_path', required=True, help='Input video')
+    parser.add_argument('--out', dest='output_path', default=None, help='Output video (default: process without writing)')
+    parser.add_argument('--codec', default=None, help='FourCC of the output (default: from the extension)')
+    parser.add_argument('--dtype', dest='dtype_policy', choices=list(DTYPE_POLICIES), default=None, help='Precision of the operations (default: float64)')
+    parser.add_argument('--queue-size', dest='queue_size', type=int, default=QUEUE_SIZE, help='Frames buffered between two stages')
+    args = parser.parse_args(argv)
+
+    if args.queue_size < 1:
+        parser.error('--queue-size must be at least 1')
+
+    if args.pipeline is not None:
+        if args.dtype_policy is not None:
+            parser.error('the precision is stored in the pipeline file')
+        chain = Pipeline.load(args.pipeline)
+        dtype_policy = chain.dtype_policy
+    else:
+        chain = args.op
+        dtype_policy = args.dtype_policy or 'float64'
+
+    summary = stream_video(args.input_path, chain, args.output_path, dtype_policy, queue_size=args.queue_size, codec=args.codec)
+
+    print('Processed {} frames in {:.2f} s, {:.1f} fps'.format(summary['frames'], summary['elapsed'], summary['fps']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
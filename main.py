@@ -1,19 +1,54 @@
-from UI_interface import UI_Interface
-import Image_Operations
-
-import cv2
-import numpy as np
 import sys
-import skimage as ski
-from PyQt5 import QtWidgets, uic
+import time
+
+# Process start, for the startup profile
+START_TIME = time.perf_counter()
+
+
+# Function to print the time spent in each startup phase, called on the first event loop turn after the icons
+def print_startup_profile(tracer):
+    print('Startup profile:')
+    for span in tracer.get_spans():
+        if span.category == 'startup':
+            print('  {:28s} {:8.1f} ms'.format(span.name.replace('startup.', ''), span.wall_time * 1000))
+    print('  {:28s} {:8.1f} ms'.format('total (until icons loaded)', (time.perf_counter() - START_TIME) * 1000))
+    sys.stdout.flush()
 
 
 if __name__ == '__main__':
-    
+
+    # Headless batch processing, e.g. python main.py batch --op edge_sobel --in src/images --out output/batch
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        import Batch_Processing
+        sys.exit(Batch_Processing.main(sys.argv[2:]))
+
+    # Local processing service, e.g. python main.py serve --port 8765
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        import Image_Service
+        sys.exit(Image_Service.main(sys.argv[2:]))
+
+    from Tracing import tracer, trace_span
+
+    # Record the peak allocation of every traced stage, this slows allocations down
+    if '--trace-memory' in sys.argv:
+        tracer.enable_memory()
+
+    with trace_span('startup.import_qt', 'startup'):
+        from PyQt5 import QtWidgets
+        from PyQt5.QtCore import QTimer
+
+    with trace_span('startup.import_ui', 'startup'):
+        from UI_interface import UI_Interface
+
     app = QtWidgets.QApplication(sys.argv)
-    window = UI_Interface()
-    sys.exit(app.exec_())
+    with trace_span('startup.create_window', 'startup'):
+        window = UI_Interface()
+
+    if '--startup-profile' in sys.argv:
+        # Queued after the window's icon loading, so it runs once the first paint and the icons are done
+        QTimer.singleShot(0, lambda: print_startup_profile(tracer))
 
+    sys.exit(app.exec_())
 """
 class -> UI_Interface( Image_Operations )
     def __init__(self):
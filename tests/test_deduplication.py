@@ -0,0 +1,121 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from Batch_Processing import run_deduplicated_batch
+from Deduplication import Dedup_Index, get_operation_key, hash_file
+
+
+def write_image(path, img, params=()):
+    assert cv2.imwrite(str(path), img, list(params))
+    return str(path)
+
+
+def test_hash_file_is_the_hash_of_the_bytes(tmp_path):
+    first, second, third = tmp_path / 'first', tmp_path / 'second', tmp_path / 'third'
+    first.write_bytes(b'pixels')
+    second.write_bytes(b'pixels')
+    third.write_bytes(b'other pixels')
+    assert hash_file(str(first)) == hash_file(str(second)) != hash_file(str(third))
+
+
+def test_unchanged_files_are_not_read_again(tmp_path):
+    path = tmp_path / 'image.png'
+    path.write_bytes(b'pixels')
+    index = Dedup_Index()
+
+    file_hash, cached = index.get_file_hash(str(path))
+    assert not cached
+    assert index.get_file_hash(str(path)) == (file_hash, True)
+
+    # A new size or mtime reads the file again
+    path.write_bytes(b'other pixels')
+    assert index.get_file_hash(str(path))[1] is False
+
+
+def test_outputs_are_found_by_pixels_operation_and_format(tmp_path):
+    index_path = str(tmp_path / 'index.json')
+    index = Dedup_Index(index_path)
+    key = get_operation_key('edge_sobel', {}, 'float64', '.png')
+    output = tmp_path / 'output.png'
+    output.write_bytes(b'result')
+    index.set_output(str(output), 'pixels', key)
+
+    assert index.is_output_current(str(output), 'pixels', key)
+    assert index.find_output('pixels', key, '.PNG') == str(output)
+    assert index.find_output('pixels', key, '.bmp') is None
+    assert index.find_output('other pixels', key, '.png') is None
+    assert not index.is_output_current(str(output), 'pixels', get_operation_key('edge_sobel', {}, 'float32', '.png'))
+
+    # The index is persistent
+    index.save()
+    index = Dedup_Index(index_path)
+    assert index.find_output('pixels', key, '.png') == str(output)
+
+    # A modified output is neither current nor copied
+    output.write_bytes(b'modified result')
+    assert not index.is_output_current(str(output), 'pixels', key)
+    assert index.find_output('pixels', key, '.png') is None
+
+
+def test_an_output_made_again_moves_to_its_new_key(tmp_path):
+    index = Dedup_Index()
+    key = get_operation_key('edge_sobel', {}, 'float64', '.png')
+    output = tmp_path / 'output.png'
+    output.write_bytes(b'result')
+
+    index.set_output(str(output), 'pixels', key)
+    index.set_output(str(output), 'other pixels', key)
+    assert index.find_output('pixels', key, '.png') is None
+    assert index.find_output('other pixels', key, '.png') == str(output)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    rng = np.random.default_rng(0)
+    first = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    second = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    paths = [write_image(input_dir / 'a.png', first)]
+
+    # A byte-identical copy, the same pixels in another format and another image
+    copy = input_dir / 'a_copy.png'
+    copy.write_bytes((input_dir / 'a.png').read_bytes())
+    paths += [str(copy), write_image(input_dir / 'a_other.bmp', first), write_image(input_dir / 'b.png', second)]
+    return paths, second
+
+
+def run(paths, output_dir):
+    return run_deduplicated_batch(paths, str(output_dir), 'bgr_2_gray', {}, workers=1, log=lambda *args: None)
+
+
+def test_batch_processes_every_distinct_image_once(tmp_path, inputs):
+    paths, second = inputs
+    output_dir = tmp_path / 'output'
+    output_dir.mkdir()
+
+    summary = run(paths, output_dir)
+    assert summary['failed'] == 0 and summary['processed'] == 4
+    assert summary['files_read'] == 4 and summary['decoded'] == 3 and summary['unique_images'] == 2
+
+    # The .bmp output cannot be copied from a .png one
+    assert summary['computed'] == 3 and summary['copied'] == 1
+    assert (output_dir / 'a.png').read_bytes() == (output_dir / 'a_copy.png').read_bytes()
+    assert np.array_equal(cv2.imread(str(output_dir / 'a.png'), cv2.IMREAD_UNCHANGED),
+                          cv2.imread(str(output_dir / 'a_other.bmp'), cv2.IMREAD_UNCHANGED))
+
+    # Nothing changed, nothing is read, decoded or written again
+    summary = run(paths, output_dir)
+    assert summary['files_read'] == 0 and summary['decoded'] == 0
+    assert summary['skipped'] == 4 and summary['computed'] == 0 and summary['copied'] == 0
+
+    # The same pixels in other bytes are decoded once and their output copied
+    paths.append(write_image(os.path.dirname(paths[0]) + '/c.png', second, (cv2.IMWRITE_PNG_COMPRESSION, 0)))
+    summary = run(paths, output_dir)
+    assert summary['files_read'] == 1 and summary['decoded'] == 1
+    assert summary['skipped'] == 4 and summary['copied'] == 1 and summary['computed'] == 0
+    assert (output_dir / 'c.png').read_bytes() == (output_dir / 'b.png').read_bytes()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import skimage.filters
+
+import Edge_Engine
+import Tiled_Processing
+
+# skimage's roberts has no mode argument, its convolution reflects like the others with mode='reflect'
+SKIMAGE_FILTERS = {
+    'edge_roberts': skimage.filters.roberts,
+    'edge_sobel': lambda img: skimage.filters.sobel(img, mode='reflect'),
+    'edge_scharr': lambda img: skimage.filters.scharr(img, mode='reflect'),
+    'edge_prewitt': lambda img: skimage.filters.prewitt(img, mode='reflect'),
+}
+
+
+@pytest.fixture
+def img():
+    rng = np.random.default_rng(0)
+    return rng.random((67, 45))
+
+
+def test_every_filter_matches_skimage(img):
+    planes = Edge_Engine.compute_edges(img)
+    assert planes.shape == (len(Edge_Engine.EDGE_ENGINE_METHODS),) + img.shape
+
+    for plane, method in zip(planes, Edge_Engine.EDGE_ENGINE_METHODS):
+        assert np.allclose(plane, SKIMAGE_FILTERS[method](img), rtol=0, atol=1e-12), method
+
+
+def test_subsets_follow_the_order_of_methods(img):
+    planes = Edge_Engine.compute_edges(img, ['edge_prewitt_menu', 'edge_roberts'])
+    assert np.allclose(planes[0], skimage.filters.prewitt(img, mode='reflect'), rtol=0, atol=1e-12)
+    assert np.allclose(planes[1], skimage.filters.roberts(img), rtol=0, atol=1e-12)
+
+
+def test_float32_keeps_its_precision(img):
+    planes = Edge_Engine.compute_edges(img.astype(np.float32), ['edge_sobel'])
+    assert planes.dtype == np.float32
+    assert np.allclose(planes[0], skimage.filters.sobel(img, mode='reflect'), rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize('methods, image', [
+    (['edge_canny'], np.zeros((8, 8))),
+    (None, np.zeros((8, 8, 3))),
+    (None, np.zeros((8, 8), dtype=np.uint8)),
+])
+def test_invalid_arguments(methods, image):
+    with pytest.raises(ValueError):
+        Edge_Engine.compute_edges(image, methods)
+
+
+def test_progress_is_reported_after_each_filter(img):
+    progress = []
+    Edge_Engine.compute_edges(img, progress_callback=progress.append)
+    assert progress == [25, 50, 75, 100]
+
+
+def test_tiled_edges_match_the_full_frame():
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 256, (70, 90, 3), dtype=np.uint8)
+    full = Tiled_Processing.process_tile('edge_sobel', source)
+
+    tiled = Tiled_Processing.run_tiled(source, 'edge_sobel', tile_size=32)
+    assert np.allclose(tiled, full, rtol=0, atol=1e-12)
+
+
+def test_mosaic_places_each_plane_in_its_cell(img):
+    planes = Edge_Engine.compute_edges(img)
+    mosaic = Edge_Engine.make_mosaic(planes, Edge_Engine.EDGE_ENGINE_METHODS)
+    height, width = img.shape
+    assert mosaic.shape == (2 * height, 2 * width)
+
+    # The label only covers the top-left corner of each cell
+    assert np.array_equal(mosaic[height - 10:height, 2 * width - 10:2 * width], planes[1][-10:, -10:])
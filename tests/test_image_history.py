@@ -0,0 +1,84 @@
+import numpy as np
+
+from Image import Image
+from Image_History import Image_History
+
+
+def make_images(count, shape=(32, 32)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(count)]
+
+
+def test_undo_redo_restore_every_snapshot():
+    history = Image_History(max_bytes=10 ** 9, raw_window=1)
+    images = make_images(6)
+    for index, img in enumerate(images):
+        history.push(Image(img), {'step': index})
+
+    # Older snapshots are compressed, the current one and its neighbour stay raw
+    assert history.get_states() == ['compressed'] * 4 + ['raw'] * 2
+
+    for index in reversed(range(len(images))):
+        assert np.array_equal(history.get_current().get_nd_image(), images[index])
+        assert history.get_current_metadata() == {'step': index}
+        history.undo()
+    assert not history.undo()
+
+    for index in range(len(images)):
+        assert np.array_equal(history.get_current().get_nd_image(), images[index])
+        history.redo()
+    assert not history.redo()
+
+
+def test_push_drops_the_redo_branch():
+    history = Image_History()
+    images = make_images(4)
+    for img in images[:3]:
+        history.push(Image(img))
+    history.undo()
+    history.undo()
+    history.push(Image(images[3]))
+
+    assert len(history) == 2
+    assert history.get_current_index() == 1
+    assert np.array_equal(history.get_current().get_nd_image(), images[3])
+
+
+def test_snapshots_past_the_budget_are_spilled_and_restored():
+    images = make_images(8, shape=(64, 64))
+    history = Image_History(max_bytes=2 * images[0].nbytes, raw_window=0)
+    for img in images:
+        history.push(Image(img))
+
+    assert history.get_memory_size() <= history.max_bytes
+    assert 'spilled' in history.get_states()
+
+    for index in reversed(range(len(images))):
+        history.set_current_index(index)
+        assert np.array_equal(history.get_current().get_nd_image(), images[index])
+        assert history.get_memory_size() <= history.max_bytes + images[0].nbytes
+
+
+def test_external_snapshots_are_loaded_when_current():
+    history = Image_History()
+    images = make_images(2)
+    loads = []
+
+    def loader(index):
+        loads.append(index)
+        return images[index]
+
+    for index, img in enumerate(images):
+        history.append_external(lambda index=index: loader(index), img.shape, img.dtype, {'step': index})
+    assert loads == []
+
+    history.set_current_index(1)
+    assert np.array_equal(history.get_current().get_nd_image(), images[1])
+    assert loads == [1]
+
+
+def test_clear():
+    history = Image_History()
+    history.push(Image(make_images(1)[0]))
+    history.clear()
+    assert len(history) == 0 and history.get_current_index() == -1 and history.get_memory_size() == 0
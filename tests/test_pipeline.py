@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from Image_Operations import Image_Operations
+from Pipeline import Pipeline
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    apply_operation = Image_Operations.apply_operation
+
+    def counted(self, method, **kwargs):
+        calls.append(method)
+        return apply_operation(self, method, **kwargs)
+    monkeypatch.setattr(Image_Operations, 'apply_operation', counted)
+    return calls
+
+
+@pytest.fixture
+def source():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (48, 64, 3), dtype=np.uint8)
+
+
+def make_pipeline():
+    pipeline = Pipeline()
+    pipeline.add_step('bgr_2_gray')
+    pipeline.add_step('denoise_gaussian_menu', kernel_size=3)
+    pipeline.add_step('edge_sobel')
+    return pipeline
+
+
+def test_pipeline_matches_the_operations_in_sequence(source):
+    expected = source
+    for method, params in (('bgr_2_gray', {}), ('denoise_gaussian', {'kernel_size': 3}), ('edge_sobel', {})):
+        expected = Image_Operations(expected, cache_max_bytes=0).apply_operation(method, **params)
+
+    assert np.allclose(make_pipeline().run(source), expected, rtol=0, atol=1e-12)
+
+
+def test_changing_a_step_reruns_it_and_the_steps_after_it(source, calls):
+    pipeline = make_pipeline()
+    first = pipeline.run(source)
+    assert calls == ['bgr_2_gray', 'denoise_gaussian', 'edge_sobel']
+
+    calls.clear()
+    assert pipeline.run(source) is first
+    assert calls == []
+
+    # The same value does not invalidate the step
+    pipeline.set_params(1, kernel_size=3)
+    pipeline.run(source)
+    assert calls == []
+
+    pipeline.set_params(1, kernel_size=5)
+    assert not np.array_equal(pipeline.run(source), first)
+    assert calls == ['denoise_gaussian', 'edge_sobel']
+
+
+def test_steps_whose_input_did_not_change_are_not_rerun(calls):
+    # Any median of a constant image is the same image
+    pipeline = Pipeline()
+    pipeline.add_step('denoise_median', kernel_size=3)
+    pipeline.add_step('edge_sobel')
+    source = np.full((32, 32), 7, dtype=np.uint8)
+    pipeline.run(source)
+
+    calls.clear()
+    pipeline.set_params(0, kernel_size=5)
+    pipeline.run(source)
+    assert calls == ['denoise_median']
+
+
+def test_a_new_source_or_precision_reruns_every_step(source, calls):
+    pipeline = make_pipeline()
+    pipeline.run(source)
+
+    calls.clear()
+    pipeline.run(source[::-1])
+    assert len(calls) == 3
+
+    calls.clear()
+    pipeline.set_dtype_policy('float32')
+    assert pipeline.run(source[::-1]).dtype == np.float32
+    assert len(calls) == 3
+
+
+def test_run_until_and_remove_step(source, calls):
+    pipeline = make_pipeline()
+    gray = pipeline.run(source, until=0)
+    assert calls == ['bgr_2_gray'] and gray.ndim == 2
+
+    calls.clear()
+    pipeline.remove_step(1)
+    pipeline.run(source)
+    assert calls == ['edge_sobel']
+
+
+def test_serialization_round_trip(tmp_path, source):
+    pipeline = make_pipeline()
+    pipeline.set_dtype_policy('float32')
+    path = str(tmp_path / 'pipeline.json')
+    pipeline.save(path)
+
+    loaded = Pipeline.load(path)
+    assert loaded.to_dict() == pipeline.to_dict() == Pipeline.from_dict(pipeline.to_dict()).to_dict()
+    assert np.allclose(loaded.run(source), pipeline.run(source), rtol=0, atol=1e-6)
+
+
+def test_invalid_steps():
+    with pytest.raises(ValueError):
+        Pipeline().add_step('edge_canny')
+    with pytest.raises(ValueError):
+        Pipeline(dtype_policy='float16')
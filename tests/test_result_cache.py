@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from Image_Operations import Image_Operations
+from Result_Cache import Result_Cache
+
+
+def test_least_recently_used_entries_are_evicted_past_the_budget():
+    cache = Result_Cache(max_bytes=300)
+    for key in 'abc':
+        cache.put(key, np.zeros(100, dtype=np.uint8))
+
+    # 'a' becomes the most recently used, 'b' is evicted by the next entry
+    assert cache.get('a') is not None
+    cache.put('d', np.zeros(100, dtype=np.uint8))
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.get_stats()['memory_size'] == 300
+
+
+def test_results_larger_than_the_budget_are_not_cached():
+    cache = Result_Cache(max_bytes=10)
+    cache.put('a', np.zeros(11, dtype=np.uint8))
+    assert len(cache) == 0
+
+
+def test_cached_results_are_read_only():
+    cache = Result_Cache()
+    value = np.zeros(4)
+    cache.put('a', value)
+    with pytest.raises(ValueError):
+        cache.get('a')[0] = 1
+
+
+@pytest.fixture
+def operator():
+    rng = np.random.default_rng(0)
+    return Image_Operations(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8))
+
+
+def test_operations_are_cached_by_source_method_and_parameters(operator):
+    first = operator.apply_operation('edge_sobel')
+    assert operator.apply_operation('edge_sobel_menu') is first
+    assert operator.result_cache.get_stats()['hits'] == 1
+
+    # Defaults are applied before the lookup, spelling out a default hits the same entry
+    assert operator.segment_image(method='segment_multi_otsu') is operator.segment_image(method='segment_multi_otsu', num_classes=3)
+    assert operator.segment_image(method='segment_multi_otsu', num_classes=4) is not operator.segment_image(method='segment_multi_otsu')
+
+
+def test_a_new_source_invalidates_the_cache(operator):
+    first = operator.apply_operation('edge_sobel')
+    operator.set_source_image(np.zeros((64, 64, 3), dtype=np.uint8))
+
+    second = operator.apply_operation('edge_sobel')
+    assert second is not first
+    assert not second.any()
+
+
+def test_cached_result_matches_an_uncached_run(operator):
+    uncached = Image_Operations(operator.get_source_image().get_nd_image(), cache_max_bytes=0)
+    for method in ('bgr_2_gray', 'edge_prewitt', 'segment_multi_otsu'):
+        operator.apply_operation(method)
+        assert np.array_equal(operator.apply_operation(method), uncached.apply_operation(method))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import Segmentation_Engine
+from Image import Image
+
+
+@pytest.fixture
+def source():
+    # A bright square on a dark, noisy background
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 40, (96, 128), dtype=np.uint8)
+    img[24:72, 32:96] += 180
+    return Image(img)
+
+
+@pytest.mark.parametrize('segment', [Segmentation_Engine.chan_vese, Segmentation_Engine.morphological_chan_vese])
+@pytest.mark.parametrize('budget', [{'max_num_iter': 0}, {'refine_num_iter': 0}])
+def test_empty_iteration_budgets_are_rejected(source, segment, budget):
+    with pytest.raises(ValueError):
+        segment(source, **budget)
+
+
+@pytest.mark.parametrize('segment', [Segmentation_Engine.chan_vese, Segmentation_Engine.morphological_chan_vese])
+def test_the_square_is_segmented_coarse_to_fine(source, segment):
+    progress = []
+    segmentation = np.asarray(segment(source, coarse_size=32, progress_callback=progress.append), dtype=bool)
+    assert segmentation.shape == source.get_nd_image().shape
+
+    # Either phase may be the square, the segmentation follows its border
+    square = np.zeros(segmentation.shape, dtype=bool)
+    square[24:72, 32:96] = True
+    agreement = max(np.mean(segmentation == square), np.mean(segmentation != square))
+    assert agreement > 0.95
+
+    assert progress == sorted(progress) and progress[-1] == 100
+
+
+def test_a_single_iteration_budget_is_enough(source):
+    segmentation = Segmentation_Engine.chan_vese(source, max_num_iter=1, refine_num_iter=1, coarse_size=32)
+    assert segmentation.shape == source.get_nd_image().shape
@@ -0,0 +1,254 @@
+import os
+
+import numpy as np
+import pytest
+
+from Session import Session, Session_Writer, compact_session
+
+
+def make_snapshots():
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (64, 48, 3), dtype=np.uint8)
+    smooth = np.tile(np.arange(48, dtype=np.float64), (64, 1))
+    delta = noise.copy()
+    delta[10:20, 10:20] = 0
+    return [noise, smooth, delta, delta.astype(np.float32)]
+
+
+def write_session(path, source_path=None, source=None, snapshots=(), position=None):
+    writer = Session_Writer(path)
+    writer.record_source(source_path, source)
+    for index, img in enumerate(snapshots):
+        writer.record_push(index, img, {'method': 'step_{}'.format(index)})
+    if position is not None:
+        writer.record_position(position)
+    writer.close()
+
+
+def test_restore_is_byte_identical(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    source = np.arange(30, dtype=np.uint8).reshape(5, 6)
+    snapshots = make_snapshots()
+    write_session(path, source=source, snapshots=snapshots, position=2)
+
+    session = Session(path)
+    try:
+        assert session.current_index == 2
+        assert np.array_equal(session.get_source_image(), source)
+        for index, img in enumerate(snapshots):
+            restored = session.get_snapshot(index)
+            assert restored.dtype == img.dtype and restored.shape == img.shape
+            assert restored.tobytes() == img.tobytes()
+            assert session.get_metadata(index) == {'method': 'step_{}'.format(index)}
+    finally:
+        session.close()
+
+
+def test_push_after_undo_drops_the_redo_branch(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    snapshots = make_snapshots()
+
+    writer = Session_Writer(path)
+    for index, img in enumerate(snapshots[:3]):
+        writer.record_push(index, img)
+    writer.record_position(0)
+    writer.record_push(1, snapshots[3])
+    writer.close()
+
+    session = Session(path)
+    try:
+        assert len(session.snapshots) == 2 and session.current_index == 1
+        assert session.get_snapshot(1).tobytes() == snapshots[3].tobytes()
+    finally:
+        session.close()
+
+
+def test_torn_record_is_ignored_and_cut_before_appending(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    snapshots = make_snapshots()
+    write_session(path, snapshots=snapshots[:2])
+    complete_size = os.path.getsize(path)
+
+    # The application stopped in the middle of a record
+    with open(path, 'ab') as file:
+        file.write(b'\x10\x00\x00\x00\xff\xff\x00\x00{"type": "snap')
+
+    session = Session(path)
+    valid_length = session.valid_length
+    assert valid_length == complete_size
+    assert len(session.snapshots) == 2
+    session.close()
+
+    writer = Session_Writer(path, valid_length=valid_length)
+    writer.record_push(2, snapshots[2])
+    writer.close()
+
+    session = Session(path)
+    try:
+        assert len(session.snapshots) == 3
+        assert session.get_snapshot(2).tobytes() == snapshots[2].tobytes()
+    finally:
+        session.close()
+
+
+def test_not_a_session_file(tmp_path):
+    path = tmp_path / 'session.bin'
+    path.write_bytes(b'not a session')
+    with pytest.raises(ValueError):
+        Session(str(path))
+
+
+def test_changed_source_is_not_returned(tmp_path):
+    source_path = tmp_path / 'source.png'
+    source_path.write_bytes(b'pixels')
+    path = str(tmp_path / 'session.bin')
+    write_session(path, source_path=str(source_path))
+
+    session = Session(path)
+    assert session.get_source_path() == str(source_path)
+    session.close()
+
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    session = Session(path)
+    assert session.get_source_path() is None
+    session.close()
+
+    os.remove(source_path)
+    session = Session(path)
+    assert session.get_source_path() is None
+    session.close()
+
+
+def test_compaction_keeps_the_live_records(tmp_path):
+    path = str(tmp_path / 'session.bin')
+    snapshots = make_snapshots()
+
+    writer = Session_Writer(path)
+    for index, img in enumerate(snapshots):
+        writer.record_push(index, img)
+    writer.record_clear()
+    writer.record_push(0, snapshots[1], {'method': 'kept'})
+    writer.close()
+
+    size = os.path.getsize(path)
+    assert compact_session(path)
+    assert os.path.getsize(path) < size
+
+    session = Session(path)
+    try:
+        assert len(session.snapshots) == 1 and session.current_index == 0
+        assert session.get_snapshot(0).tobytes() == snapshots[1].tobytes()
+        assert session.get_metadata(0) == {'method': 'kept'}
+    finally:
+        session.close()
+
+
+def test_compaction_leaves_out_a_changed_source(tmp_path):
+    source_path = tmp_path / 'source.png'
+    source_path.write_bytes(b'pixels')
+    path = str(tmp_path / 'session.bin')
+    snapshots = make_snapshots()
+
+    writer = Session_Writer(path)
+    writer.record_source(str(source_path))
+    for index, img in enumerate(snapshots):
+        writer.record_push(index, img)
+    writer.record_clear()
+    writer.close()
+
+    source_path.write_bytes(b'other pixels')
+    assert compact_session(path)
+
+    session = Session(path)
+    try:
+        assert session.get_source_path() is None
+    finally:
+        session.close()
+
+
+########################################### Interface ####################################################
+
+@pytest.fixture
+def window_factory(tmp_path, monkeypatch):
+    QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+    import UI_interface
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setattr(UI_interface, 'SESSION_PATH', str(tmp_path / 'session' / 'session.bin'))
+
+    windows = []
+
+    # The previous session is restored by a zero timer once the window is created
+    def create():
+        window = UI_interface.UI_Interface()
+        app.processEvents()
+        windows.append(window)
+        return window
+
+    yield create
+
+    for window in windows:
+        window.close()
+    app.processEvents()
+
+
+def write_source(path):
+    import cv2
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    img[16:48, 16:48] = 255
+    cv2.imwrite(str(path), img)
+
+
+def test_interface_restores_its_session(tmp_path, window_factory):
+    source_path = tmp_path / 'source.png'
+    write_source(source_path)
+    output = np.arange(64 * 64, dtype=np.float64).reshape(64, 64)
+
+    os.makedirs(tmp_path / 'session')
+    write_session(str(tmp_path / 'session' / 'session.bin'), source_path=str(source_path), snapshots=[output])
+
+    window = window_factory()
+    assert window.has_source_image()
+    assert len(window.output_image_history) == 1
+    assert window.get_output_image().get_nd_image().tobytes() == output.tobytes()
+
+
+def test_interface_drops_the_outputs_of_a_changed_source(tmp_path, window_factory):
+    source_path = tmp_path / 'source.png'
+    write_source(source_path)
+    session_path = tmp_path / 'session' / 'session.bin'
+    os.makedirs(session_path.parent)
+    write_session(str(session_path), source_path=str(source_path), snapshots=[np.zeros((64, 64))], position=0)
+
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    window = window_factory()
+    assert not window.has_source_image()
+    assert len(window.output_image_history) == 0
+    window.close()
+
+    # The next start finds a session without outputs instead of failing again
+    session = Session(str(session_path))
+    try:
+        assert session.snapshots == []
+    finally:
+        session.close()
+
+
+def test_interface_sets_aside_a_session_that_fails_to_restore(tmp_path, window_factory, monkeypatch):
+    import UI_interface
+
+    session_path = tmp_path / 'session' / 'session.bin'
+    os.makedirs(session_path.parent)
+    write_session(str(session_path), source=np.zeros((8, 8), dtype=np.uint8), snapshots=[np.zeros((8, 8))])
+
+    def fail(self):
+        raise RuntimeError('corrupt snapshot')
+    monkeypatch.setattr(UI_interface.UI_Interface, 'restore_session_state', fail)
+
+    window = window_factory()
+    assert len(window.output_image_history) == 0
+    assert os.path.exists(str(session_path) + '.bad')
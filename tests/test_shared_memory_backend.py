@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+
+from Image import Image
+from Image_Operations import Image_Operations
+from Shared_Memory_Backend import Segment_Pool, Shared_Memory_Backend, SEGMENT_ALIGNMENT
+
+
+@pytest.fixture
+def pool():
+    pool = Segment_Pool(max_free_bytes=4 * SEGMENT_ALIGNMENT)
+    yield pool
+    pool.close()
+
+
+def test_segments_are_aligned_and_reused(pool):
+    segment = pool.acquire(10)
+    assert segment.size == SEGMENT_ALIGNMENT
+
+    pool.release(segment)
+    assert pool.get_free_bytes() == SEGMENT_ALIGNMENT
+    assert pool.acquire(SEGMENT_ALIGNMENT) is segment
+    assert pool.get_free_bytes() == 0
+
+
+def test_large_free_segments_are_kept_for_large_requests(pool):
+    large = pool.acquire(3 * SEGMENT_ALIGNMENT)
+    pool.release(large)
+
+    # A request filling less than SEGMENT_MIN_FILL of the free segment gets a new one
+    small = pool.acquire(SEGMENT_ALIGNMENT)
+    assert small is not large
+    assert pool.acquire(2 * SEGMENT_ALIGNMENT) is large
+
+
+def test_segments_past_the_free_budget_are_unlinked(pool):
+    segments = [pool.acquire(2 * SEGMENT_ALIGNMENT) for _ in range(3)]
+    for segment in segments:
+        pool.release(segment)
+    assert pool.get_free_bytes() == 4 * SEGMENT_ALIGNMENT
+
+
+@pytest.fixture(scope='module')
+def backend():
+    backend = Shared_Memory_Backend(workers=1)
+    yield backend
+    backend.close()
+
+
+def make_image(value=0, shape=(128, 128, 3)):
+    rng = np.random.default_rng(value)
+    return Image(rng.integers(0, 256, shape, dtype=np.uint8))
+
+
+# Float results differ in the last bit with the alignment of the buffers they are computed from
+def assert_same_result(result, expected):
+    assert result.dtype == expected.dtype and result.shape == expected.shape
+    assert np.allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_results_match_the_operations_in_process(backend):
+    image = make_image()
+    local = Image_Operations(image.get_nd_image(), cache_max_bytes=0)
+    for method in ('bgr_2_gray', 'edge_sobel', 'segment_multi_otsu'):
+        assert_same_result(backend.run(image, method), local.apply_operation(method))
+
+
+def test_worker_progress_is_forwarded(backend):
+    progress = []
+    # Large enough for the run to outlast the first progress poll
+    backend.run(make_image(shape=(1024, 1024, 3)), 'segment_chan_vese', progress_callback=progress.append, max_num_iter=200)
+    assert progress and max(progress) > 0
+
+
+def test_concurrent_sources_keep_their_segments(backend):
+    images = [make_image(value) for value in range(4)]
+    expected = [Image_Operations(image.get_nd_image(), cache_max_bytes=0).apply_operation('edge_sobel') for image in images]
+    errors = []
+
+    def run(offset):
+        try:
+            for step in range(6):
+                index = (offset + step) % len(images)
+                assert_same_result(backend.run(images[index], 'edge_sobel'), expected[index])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(offset,)) for offset in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []